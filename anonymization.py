@@ -1,8 +1,18 @@
 from scapy.all import PcapReader, PcapWriter
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
+import hmac
 import ipaddress
 import random
 import csv
+import socket
+import struct
+import numpy as np
 import pandas as pd
+import instrumentation as ins
+import raw_pcap as rp
 import games as g
 
 def csv_substitute_ip_pairs(input_csv, output_csv, ip_list, substitute_ip):
@@ -18,15 +28,8 @@ def csv_substitute_ip_pairs(input_csv, output_csv, ip_list, substitute_ip):
     # Load the CSV data
     data = pd.read_csv(input_csv)
 
-    def replace_ips(row):
-        if row["SourceIP"] in ip_list:
-            row["DestinationIP"] = substitute_ip
-        elif row["DestinationIP"] in ip_list:
-            row["SourceIP"] = substitute_ip
-        return row
-
     # Apply substitution
-    data = data.apply(replace_ips, axis=1)
+    data = substitute_ip_columns(data, [(ip_list, substitute_ip)])
 
     # Save the modified CSV
     data.to_csv(output_csv, index=False)
@@ -45,22 +48,14 @@ def csv_substitute_ips_for_sublists(input_csv, output_csv, ip_sublists_with_subs
     # Load the CSV data
     data = pd.read_csv(input_csv)
 
-    def replace_ips(row):
-        for ip_sublist, substitute_ip in ip_sublists_with_subs:
-            if row["SourceIP"] in ip_sublist:
-                row["DestinationIP"] = substitute_ip
-            elif row["DestinationIP"] in ip_sublist:
-                row["SourceIP"] = substitute_ip
-        return row
-
     # Apply substitution
-    data = data.apply(replace_ips, axis=1)
+    data = substitute_ip_columns(data, ip_sublists_with_subs)
 
     # Save the modified CSV
     data.to_csv(output_csv, index=False)
     print(f"Modified CSV saved to {output_csv}")
 
-def csv_substitute_ips_for_sublists_chunked(input_csv, output_csv, ip_sublists_with_subs, chunksize=10000):
+def csv_substitute_ips_for_sublists_chunked(input_csv, output_csv, ip_sublists_with_subs, chunksize=10000, workers=1):
     """
     Substitutes IPs for DestinationIP and SourceIP based on a list of sublists with specific substitution IPs,
     optimized for large files using chunked processing.
@@ -70,8 +65,9 @@ def csv_substitute_ips_for_sublists_chunked(input_csv, output_csv, ip_sublists_w
     - output_csv: Path to save the modified CSV file.
     - ip_sublists_with_subs: List of tuples where each tuple contains a sublist of IPs and a substitution IP.
     - chunksize: Number of rows to process per chunk.
+    - workers: Number of processes substituting chunks in parallel (1 processes them in this process).
     """
-    # Flatten sublists and create a mapping dictionary for substitution
+    # Flatten sublists and create a mapping dictionary for substitution (a later sublist wins)
     ip_to_substitute = {}
     for ip_sublist, substitute_ip in ip_sublists_with_subs:
         for ip in ip_sublist:
@@ -79,99 +75,377 @@ def csv_substitute_ips_for_sublists_chunked(input_csv, output_csv, ip_sublists_w
 
     # Open the output file for writing and process chunks
     with pd.read_csv(input_csv, chunksize=chunksize) as reader, open(output_csv, 'w') as writer:
-        for i, chunk in enumerate(reader):
-            # Replace DestinationIP if SourceIP is in the sublist
-            chunk["DestinationIP"] = chunk.apply(
-                lambda row: ip_to_substitute.get(row["SourceIP"], row["DestinationIP"]), axis=1
-            )
-            # Replace SourceIP if DestinationIP is in the sublist
-            chunk["SourceIP"] = chunk.apply(
-                lambda row: ip_to_substitute.get(row["DestinationIP"], row["SourceIP"]), axis=1
-            )
-
-            # Write chunk to the output file
-            chunk.to_csv(writer, index=False, header=(i == 0))  # Write header only for the first chunk
-            print(f"Processed chunk {i + 1}")
+        if workers > 1:
+            # Keep a bounded number of chunks in flight and write them back in input order
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                done = 0
+                for i, chunk in enumerate(reader):
+                    pending.append(executor.submit(substitute_chunk_to_csv, chunk, ip_to_substitute, i == 0))
+                    if len(pending) >= 2 * workers:
+                        writer.write(pending.popleft().result())
+                        done += 1
+                        print(f"Processed chunk {done}")
+                while pending:
+                    writer.write(pending.popleft().result())
+                    done += 1
+                    print(f"Processed chunk {done}")
+        else:
+            for i, chunk in enumerate(reader):
+                writer.write(substitute_chunk_to_csv(chunk, ip_to_substitute, i == 0))
+                print(f"Processed chunk {i + 1}")
 
     print(f"Modified CSV saved to {output_csv}")
 
+def substitute_chunk_to_csv(chunk, ip_to_substitute, header):
+    # Substitute one chunk and return it as CSV text (header only for the first chunk)
+    return substitute_ip_map(chunk, ip_to_substitute).to_csv(index=False, header=header)
+
+def substitute_ip_map(data, ip_to_substitute):
+    """
+    Vectorized IP substitution of csv_substitute_ips_for_sublists_chunked.
+
+    Unlike substitute_ip_columns, the sublists are flattened into one mapping: DestinationIP is
+    replaced by the substitution of SourceIP, then SourceIP by the substitution of the new
+    DestinationIP. Lookups are done per distinct IP instead of per row.
 
+    Parameters:
+    - data: DataFrame with SourceIP and DestinationIP columns, modified in place.
+    - ip_to_substitute: Dictionary mapping IPs to their substitution IP.
 
-def anonymize_ip_by_subnet(input_pcap, output_pcap, tracking_file, ip_groups):
+    Returns:
+    - The modified DataFrame.
     """
-    Anonymizes public IPs in a PCAP file based on a list of private IP groups, assigning public IPs from specified subnets.
+    def lookup(key, current):
+        codes, uniques = pd.factorize(data[key])
+        # The extra entries are picked by code -1 (missing values)
+        found = np.array([ip in ip_to_substitute for ip in uniques] + [False])[codes]
+        subs = np.array([ip_to_substitute.get(ip) for ip in uniques] + [None], dtype=object)[codes]
+        return np.where(found, subs, data[current].to_numpy(dtype=object))
+
+    data["DestinationIP"] = lookup("SourceIP", "DestinationIP")
+    data["SourceIP"] = lookup("DestinationIP", "SourceIP")
+    return data
+
+def substitute_ip_columns(data, ip_sublists_with_subs):
+    """
+    Vectorized IP substitution shared by the csv_substitute_* functions.
+
+    For every (sublist, substitution IP) pair, in order: rows whose SourceIP is in the sublist
+    get the substitution IP as DestinationIP, otherwise rows whose DestinationIP is in the
+    sublist get it as SourceIP. Both columns are factorized once, so membership is checked
+    per distinct IP instead of per row.
 
     Parameters:
-    - input_pcap: Path to the input PCAP file.
-    - output_pcap: Path to save the anonymized PCAP file.
-    - tracking_file: Path to save the tracking associations.
-    - ip_groups: Dictionary where keys are private IP lists and values are subnets for anonymization.
+    - data: DataFrame with SourceIP and DestinationIP columns, modified in place.
+    - ip_sublists_with_subs: List of tuples where each tuple contains a sublist of IPs and a substitution IP.
+
+    Returns:
+    - The modified DataFrame.
     """
-    def is_public_ip(ip):
-        try:
-            ip_obj = ipaddress.ip_address(ip)
-            return not (ip_obj.is_private or ip_obj.is_loopback or ip_obj.is_reserved or ip_obj.is_link_local)
-        except ValueError:
-            return False
+    columns = {}
+    for name in ("SourceIP", "DestinationIP"):
+        codes, uniques = pd.factorize(data[name])
+        columns[name] = (codes, list(uniques))
+
+    def matches(name, ip_set):
+        codes, uniques = columns[name]
+        # The extra False entry is picked by code -1 (missing values)
+        return np.array([ip in ip_set for ip in uniques] + [False])[codes]
+
+    def assign(name, mask, ip):
+        codes, uniques = columns[name]
+        if ip not in uniques:
+            uniques.append(ip)
+        codes[mask] = uniques.index(ip)
+
+    for ip_sublist, substitute_ip in ip_sublists_with_subs:
+        ip_set = set(ip_sublist)
+        src_match = matches("SourceIP", ip_set)
+        dst_match = matches("DestinationIP", ip_set) & ~src_match
+        assign("DestinationIP", src_match, substitute_ip)
+        assign("SourceIP", dst_match, substitute_ip)
 
-    def generate_ip_from_subnet(subnet):
-        net = ipaddress.ip_network(subnet)
-        return str(net[random.randint(1, net.num_addresses - 2)])
+    for name, (codes, uniques) in columns.items():
+        data[name] = np.array(uniques + [np.nan], dtype=object)[codes]
+    return data
 
-    ip_to_substitute = {}  # Store public-to-anonymized mappings
-    tracking_data = set()  # Store unique (PrivateIP, PublicIP, ReplacementIP) tuples
 
+
+def is_public_ip(ip):
+    if isinstance(ip, str) and ip.count(".") == 3:
+        try:
+            return is_public_address(struct.unpack("!I", socket.inet_aton(ip))[0])
+        except OSError:
+            pass
+
+    # Not a dotted IPv4 string, classify it without the cache
+    try:
+        ip_obj = ipaddress.ip_address(ip)
+        return not (ip_obj.is_private or ip_obj.is_loopback or ip_obj.is_reserved or ip_obj.is_link_local)
+    except ValueError:
+        return False
+
+@lru_cache(maxsize=None)
+def is_public_address(address):
+    # Classification of an integer IPv4 address, memoized since the same hosts appear in every packet
+    ip_obj = ipaddress.IPv4Address(address)
+    return not (ip_obj.is_private or ip_obj.is_loopback or ip_obj.is_reserved or ip_obj.is_link_local)
+
+class SubnetAllocator:
+    """
+    Hands out collision-free replacement addresses from the anonymization subnets and
+    remembers the public-to-replacement mapping.
+
+    Without key or seed the addresses are drawn like the original random.randint based
+    allocation (but never twice). With a seed the draws are reproducible. With a key the
+    address of a public IP is derived from HMAC-SHA256(key, ip), probing to the next free
+    address on collisions. Only that first choice is independent of the order in which the
+    public IPs are seen: a subnet holds far fewer addresses than there are public IPs, so a
+    probed address depends on the IPs allocated before it. To map a public IP to the same
+    replacement in every capture, share one allocator across the captures or save its
+    mapping and load it for the next one.
+
+    Parameters:
+    - key: Optional secret (str or bytes) for keyed allocation.
+    - seed: Optional seed for reproducible random allocation.
+    """
+
+    def __init__(self, key=None, seed=None):
+        self.key = key.encode() if isinstance(key, str) else key
+        self.rng = random.Random(seed) if seed is not None else random
+        self.mapping = {}  # public IP -> (replacement IP, subnet)
+        self.networks = {}  # subnet -> ip_network
+        self.used = {}  # subnet -> set of used host indexes
+
+    def get(self, public_ip, subnet):
+        """
+        Return the replacement of public_ip, allocating one from subnet on first use.
+        """
+        entry = self.mapping.get(public_ip)
+        if entry is None:
+            entry = (self.allocate(public_ip, subnet), subnet)
+            self.mapping[public_ip] = entry
+        return entry[0]
+
+    def __contains__(self, public_ip):
+        return public_ip in self.mapping
+
+    def network(self, subnet):
+        net = self.networks.get(subnet)
+        if net is None:
+            net = self.networks[subnet] = ipaddress.ip_network(subnet)
+            self.used.setdefault(subnet, set())
+        return net
+
+    def allocate(self, public_ip, subnet):
+        net = self.network(subnet)
+        used = self.used[subnet]
+        size = net.num_addresses - 2  # Skip the network and broadcast addresses
+        if len(used) >= size:
+            raise ValueError(f"No free address left in {subnet}")
+
+        if self.key is not None:
+            digest = hmac.new(self.key, public_ip.encode(), hashlib.sha256).digest()
+            index = int.from_bytes(digest[:8], "big") % size
+            while index in used:
+                index = (index + 1) % size
+        else:
+            index = self.rng.randrange(size)
+            while index in used:
+                index = self.rng.randrange(size)
+        used.add(index)
+        return str(net[index + 1])
+
+    def save(self, mapping_file):
+        """
+        Write the mapping table (PublicIP, Subnet, ReplacementIP) to a CSV file.
+        """
+        with open(mapping_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["PublicIP", "Subnet", "ReplacementIP"])
+            for public_ip, (replacement_ip, subnet) in self.mapping.items():
+                writer.writerow([public_ip, subnet, replacement_ip])
+
+    @classmethod
+    def load(cls, mapping_file, key=None, seed=None):
+        """
+        Rebuild an allocator from a mapping table written by save, so later captures reuse
+        the same replacements and new public IPs never collide with them.
+        """
+        allocator = cls(key, seed)
+        with open(mapping_file, newline="") as f:
+            for row in csv.DictReader(f):
+                subnet = row["Subnet"]
+                net = allocator.network(subnet)
+                replacement_ip = row["ReplacementIP"]
+                allocator.mapping[row["PublicIP"]] = (replacement_ip, subnet)
+                allocator.used[subnet].add(int(ipaddress.ip_address(replacement_ip)) - int(net.network_address) - 1)
+        return allocator
+
+def get_private_ip_to_subnet(ip_groups):
     # Reverse map to quickly find subnets based on private IPs
     private_ip_to_subnet = {}
     for private_ips, subnet in ip_groups.items():
         for ip in private_ips:
             private_ip_to_subnet[ip] = subnet
+    return private_ip_to_subnet
 
-    with PcapReader(input_pcap) as reader, PcapWriter(output_pcap, append=True, sync=True) as writer:
-        for packet in reader:
-            if packet.haslayer("IP"):
-                src_ip = packet["IP"].src
-                dst_ip = packet["IP"].dst
+def anonymize_ip_pair(src_ip, dst_ip, allocator, private_ip_to_subnet, tracking_data):
+    """
+    Pick the replacements of the public addresses of one packet.
 
-                # Process SourceIP
-                if is_public_ip(src_ip):
-                    if src_ip not in ip_to_substitute:
-                        replacement_ip = generate_ip_from_subnet(private_ip_to_subnet.get(dst_ip, "10.0.0.0/8"))
-                        ip_to_substitute[src_ip] = replacement_ip
-                    else:
-                        replacement_ip = ip_to_substitute[src_ip]
+    Parameters:
+    - src_ip, dst_ip: Source and destination IP of the packet.
+    - allocator: SubnetAllocator holding the public-to-anonymized mappings.
+    - private_ip_to_subnet: Private IP to anonymization subnet map (see get_private_ip_to_subnet).
+    - tracking_data: Set of (PrivateIP, PublicIP, ReplacementIP) tuples, extended in place.
 
-                    # Track mapping if DestinationIP is in the exception list
-                    if dst_ip in private_ip_to_subnet:
-                        tracking_data.add((dst_ip, src_ip, replacement_ip))
+    Returns:
+    - (new_src, new_dst), None for an address that stays unchanged.
+    """
+    new_src = new_dst = None
 
-                    packet["IP"].src = replacement_ip
+    # Process SourceIP
+    if is_public_ip(src_ip):
+        replacement_ip = allocator.get(src_ip, private_ip_to_subnet.get(dst_ip, "10.0.0.0/8"))
 
-                # Process DestinationIP
-                if is_public_ip(dst_ip):
-                    if dst_ip not in ip_to_substitute:
-                        replacement_ip = generate_ip_from_subnet(private_ip_to_subnet.get(src_ip, "10.0.0.0/8"))
-                        ip_to_substitute[dst_ip] = replacement_ip
-                    else:
-                        replacement_ip = ip_to_substitute[dst_ip]
+        # Track mapping if DestinationIP is in the exception list
+        if dst_ip in private_ip_to_subnet:
+            tracking_data.add((dst_ip, src_ip, replacement_ip))
 
-                    # Track mapping if SourceIP is in the exception list
-                    if src_ip in private_ip_to_subnet:
-                        tracking_data.add((src_ip, dst_ip, replacement_ip))
+        new_src = replacement_ip
 
-                    packet["IP"].dst = replacement_ip
+    # Process DestinationIP
+    if is_public_ip(dst_ip):
+        replacement_ip = allocator.get(dst_ip, private_ip_to_subnet.get(src_ip, "10.0.0.0/8"))
 
-                # Recalculate checksums
-                del packet["IP"].chksum
+        # Track mapping if SourceIP is in the exception list
+        if src_ip in private_ip_to_subnet:
+            tracking_data.add((src_ip, dst_ip, replacement_ip))
 
-            writer.write(packet)
+        new_dst = replacement_ip
 
+    return new_src, new_dst
+
+def anonymize_scapy_pckt(packet, allocator, private_ip_to_subnet, tracking_data):
+    # Rewrite the first IP layer of a dissected packet and let Scapy recompute its checksum
+    if packet.haslayer("IP"):
+        new_src, new_dst = anonymize_ip_pair(packet["IP"].src, packet["IP"].dst,
+                                             allocator, private_ip_to_subnet, tracking_data)
+        if new_src is not None:
+            packet["IP"].src = new_src
+        if new_dst is not None:
+            packet["IP"].dst = new_dst
+
+        # Recalculate checksums
+        del packet["IP"].chksum
+    return packet
+
+def write_tracking_file(tracking_file, tracking_data):
     # Save tracking data to the file
     with open(tracking_file, "w", newline="") as f:
         writer = csv.writer(f)
         writer.writerow(["PrivateIP", "PublicIP", "ReplacementIP"])
         writer.writerows(tracking_data)
 
+@ins.instrumented("anonymize_ip_by_subnet")
+def anonymize_ip_by_subnet(input_pcap, output_pcap, tracking_file, ip_groups, allocator=None):
+    """
+    Anonymizes public IPs in a PCAP file based on a list of private IP groups, assigning public IPs from specified subnets.
+
+    Parameters:
+    - input_pcap: Path to the input PCAP file.
+    - output_pcap: Path to save the anonymized PCAP file.
+    - tracking_file: Path to save the tracking associations.
+    - ip_groups: Dictionary where keys are private IP lists and values are subnets for anonymization.
+    - allocator: Optional SubnetAllocator, share (or load) one to keep mappings across captures.
+    """
+    allocator = allocator or SubnetAllocator()  # Store public-to-anonymized mappings
+    tracking_data = set()  # Store unique (PrivateIP, PublicIP, ReplacementIP) tuples
+    private_ip_to_subnet = get_private_ip_to_subnet(ip_groups)
+
+    with PcapReader(input_pcap) as reader, PcapWriter(output_pcap, append=True, sync=True) as writer:
+        ins.track(reader)
+        anonymize = ins.timed("anonymize", anonymize_scapy_pckt)
+        write = ins.timed("write", writer.write)
+        pckt_no = 0
+        for packet in ins.timed_iter("read", reader):
+            write(anonymize(packet, allocator, private_ip_to_subnet, tracking_data))
+            pckt_no += 1
+            if pckt_no % 100000 == 0:
+                ins.progress(pckt_no)
+
+    write_tracking_file(tracking_file, tracking_data)
+
+    print(f"Anonymized PCAP saved to {output_pcap}")
+    print(f"Tracking data saved to {tracking_file}")
+
+@ins.instrumented("anonymize_ip_by_subnet_fast")
+def anonymize_ip_by_subnet_fast(input_pcap, output_pcap, tracking_file, ip_groups, l4_checksums=False,
+                                buffer_size=8 * 1024 * 1024, allocator=None):
+    """
+    Byte-level version of anonymize_ip_by_subnet with the same mapping rules and packets.
+
+    The address fields of the outer IPv4 header are rewritten in the raw record and the
+    header checksum is recomputed, without dissecting or re-encoding the packet with Scapy.
+    Records the byte parser cannot place (IPv6, tunnels, truncated headers...) go through
+    the Scapy path of anonymize_ip_by_subnet. The output is written in large buffered blocks.
+
+    Parameters:
+    - input_pcap: Path to the input PCAP file.
+    - output_pcap: Path to save the anonymized PCAP file (appended to if it exists).
+    - tracking_file: Path to save the tracking associations.
+    - ip_groups: Dictionary where keys are private IP lists and values are subnets for anonymization.
+    - l4_checksums: Also patch TCP/UDP checksums for the new pseudo-header (RFC 1624).
+      anonymize_ip_by_subnet leaves them untouched, so keep False for identical output.
+    - buffer_size: Size of the output buffer in bytes.
+    - allocator: Optional SubnetAllocator, share (or load) one to keep mappings across captures.
+    """
+    allocator = allocator or SubnetAllocator()  # Store public-to-anonymized mappings
+    tracking_data = set()  # Store unique (PrivateIP, PublicIP, ReplacementIP) tuples
+    private_ip_to_subnet = get_private_ip_to_subnet(ip_groups)
+
+    pckt_no = 0
+    with rp.RawPcapReader(input_pcap) as reader, \
+            rp.RawPcapWriter(output_pcap, reader, append=True, buffer_size=buffer_size) as writer:
+        anonymize_pair = ins.timed("anonymize", anonymize_ip_pair)
+        anonymize_pckt = ins.timed("anonymize_scapy", anonymize_scapy_pckt)
+        write = ins.timed("write", writer.write)
+        for pckt in ins.timed_iter("read", reader):
+            pckt_no += 1
+            data = pckt.data
+            off = rp.ipv4_offset(data, pckt.linktype)
+
+            if off is not None and off >= 0 and rp.ipv4_in_place_ok(pckt, off):
+                ihl = (data[off] & 0x0F) << 2
+                src, dst = data[off + 12:off + 16], data[off + 16:off + 20]
+                new_src, new_dst = anonymize_pair(socket.inet_ntoa(src), socket.inet_ntoa(dst),
+                                                  allocator, private_ip_to_subnet, tracking_data)
+                checksum = (data[off + 10] << 8) | data[off + 11]
+                if new_src is not None or new_dst is not None or rp.ipv4_header_checksum(data, off, ihl) != checksum:
+                    buf = bytearray(data)
+                    if new_src is not None:
+                        buf[off + 12:off + 16] = socket.inet_aton(new_src)
+                    if new_dst is not None:
+                        buf[off + 16:off + 20] = socket.inet_aton(new_dst)
+                    buf[off + 10:off + 12] = rp.ipv4_header_checksum(buf, off, ihl).to_bytes(2, "big")
+                    if l4_checksums:
+                        rp.update_l4_checksum(buf, off, ihl, src + dst, bytes(buf[off + 12:off + 20]))
+                    pckt.data = buf
+            elif off != -1:  # Everything but frames that cannot carry IP (ARP)
+                packet = anonymize_pckt(pckt.to_scapy(), allocator, private_ip_to_subnet, tracking_data)
+                pckt.data = bytes(packet)
+                pckt.caplen = len(pckt.data)
+
+            write(pckt)
+
+            if pckt_no % 100000 == 0:  # Periodic logging
+                print(f"Processed {pckt_no} packets")
+                ins.progress(pckt_no, pckt)
+
+    write_tracking_file(tracking_file, tracking_data)
+
     print(f"Anonymized PCAP saved to {output_pcap}")
     print(f"Tracking data saved to {tracking_file}")
 
@@ -201,9 +475,10 @@ ip_groups = {
 }
 
 
-anonymize_ip_by_subnet("PCAP/28_06_1330-1830.pcap","PCAP/anonymized_28_06_1330-1830.pcap","csv/28_06_1330-1830_ip_replacements.csv", ip_groups)
-anonymize_ip_by_subnet("PCAP/29_06_1000-1330.pcap","PCAP/anonymized_29_06_1000-1330.pcap","csv/29_06_1000-1330_ip_replacements.csv", ip_groups)
-anonymize_ip_by_subnet("PCAP/29_06_1330-1830.pcap","PCAP/anonymized_29_06_1330-1830.pcap","csv/29_06_1330-1830_ip_replacements.csv", ip_groups)
+if __name__ == "__main__":
+    anonymize_ip_by_subnet("PCAP/28_06_1330-1830.pcap","PCAP/anonymized_28_06_1330-1830.pcap","csv/28_06_1330-1830_ip_replacements.csv", ip_groups)
+    anonymize_ip_by_subnet("PCAP/29_06_1000-1330.pcap","PCAP/anonymized_29_06_1000-1330.pcap","csv/29_06_1000-1330_ip_replacements.csv", ip_groups)
+    anonymize_ip_by_subnet("PCAP/29_06_1330-1830.pcap","PCAP/anonymized_29_06_1330-1830.pcap","csv/29_06_1330-1830_ip_replacements.csv", ip_groups)
 
 # Example usage
 #ip_sublists_with_subs = [
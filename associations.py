@@ -1,32 +1,130 @@
+import heapq
+import os
+import numpy as np
 import pandas as pd
+import dataset_cache as dc
+import table_io as tio
 
-def create_association_csv(input_csv, output_csv):
+ASSOCIATION_COLUMNS = ["SourceIP", "DestinationIP", "SourcePort", "DestinationPort"]
+ASSOCIATION_DTYPES = {"SourceIP": "category", "DestinationIP": "category", "SourcePort": "uint16", "DestinationPort": "uint16"}
+
+def create_association_csv(input_csv, output_csv, chunksize=tio.CHUNK_ROWS, top_k=None):
     """
     Create a new CSV with unique associations of SourceIP, DestinationIP, SourcePort, and DestinationPort,
     along with the count of packets for each association, sorted by descending PacketCount.
 
+    The input is read in chunks of the four key columns only, so memory depends on the number of
+    distinct associations rather than on the size of the input (see count_associations).
+
     Parameters:
-    - input_csv: Path to the input CSV file.
+    - input_csv: Path to the input CSV (or Parquet) file.
     - output_csv: Path to save the output CSV file.
+    - chunksize: Rows read per chunk.
+    - top_k: Optionally keep only the top_k associations with the most packets (ties in key order).
     """
-    # Load the CSV data
-    df = pd.read_csv(input_csv)
-
-    # Group by the unique association columns and count the number of packets in each group
-    association_counts = (
-        df.groupby(["SourceIP", "DestinationIP", "SourcePort", "DestinationPort"])
-        .size()
-        .reset_index(name="PacketCount")
-    )
+    association_counts = count_associations(input_csv, chunksize)
 
-    # Sort by descending PacketCount
-    sorted_associations = association_counts.sort_values(by="PacketCount", ascending=False)
+    if top_k is None:
+        # Sort by descending PacketCount
+        sorted_associations = association_counts.sort_values(by="PacketCount", ascending=False)
+    else:
+        # Select with a heap instead of sorting every association
+        counts = association_counts["PacketCount"].to_numpy()
+        top = heapq.nlargest(top_k, range(len(counts)), key=lambda i: (counts[i], -i))
+        sorted_associations = association_counts.iloc[top]
 
     # Save the result to a new CSV
     sorted_associations.to_csv(output_csv, index=False)
     print(f"Sorted association CSV saved to '{output_csv}'.")
 
-# Example usage
-input_csv = "test.csv"  # Replace with your input CSV file path
-output_csv = "sorted_associations.csv"  # Replace with your desired output CSV file path
-create_association_csv(input_csv, output_csv)
+def update_association_csv(association_csv, metadata, chunksize=tio.CHUNK_ROWS):
+    """
+    Add the associations of new metadata rows to an association CSV written by create_association_csv
+    (without top_k), so the CSV of a growing metadata file can be updated with its new rows only.
+    The result is the same as create_association_csv on all the rows.
+
+    Parameters:
+    - association_csv: Path of the association CSV, created when missing.
+    - metadata: New metadata rows, a DataFrame or a path (see count_associations).
+    - chunksize: Rows read per chunk.
+    """
+    counts = count_associations(metadata, chunksize)
+    if os.path.isfile(association_csv):
+        counts = pd.concat([pd.read_csv(association_csv), counts], ignore_index=True)
+        counts = counts.groupby(ASSOCIATION_COLUMNS)["PacketCount"].sum().reset_index()
+    counts.sort_values(by="PacketCount", ascending=False).to_csv(association_csv, index=False)
+
+def count_associations(input_csv, chunksize=tio.CHUNK_ROWS):
+    """
+    Count the packets of every (SourceIP, DestinationIP, SourcePort, DestinationPort) association,
+    reading the input in chunks.
+
+    IPs are mapped to integer codes shared by all chunks, and every association becomes a pair of
+    int64 keys (IP codes, ports). Each chunk is counted on these keys and the partial counts are
+    merged as they grow. Rows with a missing IP are skipped, as in a groupby on the string columns.
+
+    Returns:
+    - DataFrame with the key columns and PacketCount, ordered by key like a groupby on the columns.
+    """
+    ip_codes = {}  # IP -> code
+    partials = []
+    pending = 0  # Rows in partials
+    merged = 0  # Rows of the merged counts in partials[0]
+    for chunk in dc.iter_table(input_csv, columns=ASSOCIATION_COLUMNS, chunksize=chunksize, dtype=ASSOCIATION_DTYPES):
+        src = encode_ips(chunk["SourceIP"], ip_codes)
+        dst = encode_ips(chunk["DestinationIP"], ip_codes)
+        valid = (src >= 0) & (dst >= 0)
+        keys = pd.DataFrame({
+            "IPs": (src[valid] << 32) | dst[valid],
+            "Ports": (chunk["SourcePort"].to_numpy(np.int64)[valid] << 16) | chunk["DestinationPort"].to_numpy(np.int64)[valid],
+        })
+        partials.append(keys.groupby(["IPs", "Ports"]).size())
+        pending += len(partials[-1])
+
+        # Merge the partial counts once they outgrow both a chunk and the counts merged so far
+        if pending - merged > max(chunksize, merged):
+            partials = [merge_counts(partials)]
+            pending = merged = len(partials[0])
+
+    counts = merge_counts(partials)
+    ips = counts.index.get_level_values("IPs").to_numpy()
+    ports = counts.index.get_level_values("Ports").to_numpy()
+
+    names = np.array(list(ip_codes), dtype=object)
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[np.argsort(names, kind="stable")] = np.arange(len(names))
+    src, dst = ips >> 32, ips & 0xFFFFFFFF
+    sport, dport = ports >> 16, ports & 0xFFFF
+
+    # Same row order as groupby(ASSOCIATION_COLUMNS): IPs as strings, ports as numbers
+    order = np.lexsort((dport, sport, rank[dst], rank[src]))
+    return pd.DataFrame({
+        "SourceIP": names[src[order]],
+        "DestinationIP": names[dst[order]],
+        "SourcePort": sport[order],
+        "DestinationPort": dport[order],
+        "PacketCount": counts.to_numpy()[order],
+    })
+
+def encode_ips(column, ip_codes):
+    # Map a categorical IP column to the shared integer codes (-1 for missing values)
+    column = column.astype("category")
+    categories = column.cat.categories
+    lookup = np.empty(len(categories) + 1, dtype=np.int64)
+    for i, ip in enumerate(categories):
+        lookup[i] = ip_codes.setdefault(ip, len(ip_codes))
+    lookup[-1] = -1
+    return lookup[column.cat.codes.to_numpy()]
+
+def merge_counts(partials):
+    if not partials:
+        return pd.Series([], dtype=np.int64, index=pd.MultiIndex.from_arrays([np.array([], dtype=np.int64)] * 2, names=["IPs", "Ports"]))
+    if len(partials) == 1:
+        return partials[0]
+    return pd.concat(partials).groupby(level=["IPs", "Ports"]).sum()
+
+if __name__ == "__main__":
+    # Example usage
+    input_csv = "test.csv"  # Replace with your input CSV file path
+    output_csv = "sorted_associations.csv"  # Replace with your desired output CSV file path
+    create_association_csv(input_csv, output_csv)
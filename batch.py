@@ -0,0 +1,168 @@
+import csv
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import data_model as dm
+import instrumentation as ins
+import packet_filter as pf
+import packet_processing as pp
+import raw_pcap as rp
+
+CHECKPOINT_EVERY = 100000  # Packets between two saved checkpoints of a running job
+
+
+def jobs_from_glob(pattern, output_dir):
+    """
+    Build conversion jobs for every capture matching a glob pattern.
+
+    Parameters:
+    - pattern: Glob pattern of the input PCAP files, e.g. "PCAP/anonymized_*.pcap".
+    - output_dir: Directory of the outputs, named <name>_metadata.csv and <name>_payload.csv.
+
+    Returns:
+    - List of (pcap, metadata_csv, payload_csv) tuples.
+    """
+    jobs = []
+    for pcap in sorted(glob.glob(pattern)):
+        name = os.path.splitext(os.path.basename(pcap))[0]
+        jobs.append((pcap, os.path.join(output_dir, name + "_metadata.csv"), os.path.join(output_dir, name + "_payload.csv")))
+    return jobs
+
+
+def read_manifest(manifest):
+    """
+    Read conversion jobs from a manifest CSV with the columns pcap, metadata_csv, payload_csv.
+    Lines starting with # are ignored.
+
+    Returns:
+    - List of (pcap, metadata_csv, payload_csv) tuples.
+    """
+    with open(manifest, newline='') as f:
+        rows = csv.DictReader(line for line in f if not line.startswith('#'))
+        return [(row["pcap"], row["metadata_csv"], row["payload_csv"]) for row in rows]
+
+
+def run_batch(jobs, state_dir, workers=None, checkpoint_every=CHECKPOINT_EVERY, pckt_filter=None):
+    """
+    Convert a list of captures into metadata/payload CSVs in a process pool (raw backend),
+    keeping a resumable state file per capture in state_dir.
+
+    A capture whose size and mtime are unchanged since its outputs were completed (and whose
+    outputs were not modified since) is skipped.
+    A conversion that was interrupted continues from its last checkpoint: the outputs are cut
+    back to their checkpointed size and reading restarts at the next record. Any other state
+    (new or modified input, missing outputs, another filter) converts the capture from the start.
+
+    Parameters:
+    - jobs: List of (pcap, metadata_csv, payload_csv) tuples, see jobs_from_glob and read_manifest.
+    - state_dir: Directory of the job state files.
+    - workers: Number of worker processes (defaults to the CPU count).
+    - checkpoint_every: Packets converted between two checkpoints.
+    - pckt_filter: Optional filter expression, only matching packets are converted (see packet_filter.PacketFilter).
+
+    Returns:
+    - Dict mapping each input PCAP to "done", "skipped" or "failed".
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    results = {}
+    expression = pf.filter_expression(pckt_filter)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(convert_job, (pcap, metadata_csv, payload_csv, state_path(state_dir, pcap), checkpoint_every, expression)): pcap
+            for pcap, metadata_csv, payload_csv in jobs
+        }
+        for future in as_completed(futures):
+            pcap = futures[future]
+            try:
+                results[pcap] = future.result()
+            except Exception as e:
+                # The state keeps the last checkpoint, a new run resumes from there
+                print(f"Conversion of {pcap} failed: {e}")
+                results[pcap] = "failed"
+
+    print("Batch finished: " + ", ".join(f"{status} {list(results.values()).count(status)}" for status in ("done", "skipped", "failed")))
+    return results
+
+
+def state_path(state_dir, pcap):
+    # One state file per input, the path hash keeps equal file names in different directories apart
+    digest = hashlib.sha1(os.path.abspath(pcap).encode()).hexdigest()[:12]
+    return os.path.join(state_dir, f"{os.path.basename(pcap)}.{digest}.json")
+
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(path, state):
+    # Write to a temporary file first so an interruption never leaves a partial state file
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+@ins.instrumented("convert_job")
+def convert_job(task):
+    # Worker of run_batch: convert, resume or skip one capture according to its state file
+    pcap, metadata_csv, payload_csv, path, checkpoint_every, pckt_filter = task
+    stat = os.stat(pcap)
+    outputs_exist = os.path.isfile(metadata_csv) and os.path.isfile(payload_csv)
+    state = load_state(path)
+    same_job = (
+        state is not None and state["size"] == stat.st_size and state["mtime"] == stat.st_mtime
+        and state["metadata_csv"] == metadata_csv and state["payload_csv"] == payload_csv and outputs_exist
+        and state.get("filter") == pckt_filter
+    )
+
+    if (same_job and state["status"] == "done" and os.path.getsize(metadata_csv) == state["metadata_size"]
+            and os.path.getsize(payload_csv) == state["payload_size"]):
+        print(f"Skipping {pcap}, unchanged since its outputs were written")
+        return "skipped"
+
+    if same_job and os.path.getsize(metadata_csv) >= state["metadata_size"] and os.path.getsize(payload_csv) >= state["payload_size"]:
+        print(f"Resuming {pcap} after packet {state['pckt_no']}")
+        # Drop the rows written after the last checkpoint, they are converted again
+        os.truncate(metadata_csv, state["metadata_size"])
+        os.truncate(payload_csv, state["payload_size"])
+    else:
+        print(f"Converting {pcap}")
+        dm.write_csv_header(metadata_csv, dm.METADATA_COLUMNS)
+        dm.write_csv_header(payload_csv, dm.PAYLOAD_COLUMNS)
+        state = {
+            "status": "running", "size": stat.st_size, "mtime": stat.st_mtime,
+            "metadata_csv": metadata_csv, "payload_csv": payload_csv, "filter": pckt_filter,
+            "offset": rp.GLOBAL_HEADER_LEN, "pckt_no": 0,
+            "metadata_size": os.path.getsize(metadata_csv), "payload_size": os.path.getsize(payload_csv)
+        }
+        save_state(path, state)
+
+    def checkpoint(pckt_no, pckt):
+        # Called once the rows up to pckt are in both outputs
+        if pckt_no - state["pckt_no"] < checkpoint_every:
+            return
+        state.update(
+            offset=pckt.offset + rp.RECORD_HEADER_LEN + pckt.caplen, pckt_no=pckt_no,
+            metadata_size=os.path.getsize(metadata_csv), payload_size=os.path.getsize(payload_csv)
+        )
+        save_state(path, state)
+
+    with rp.RawPcapReader(pcap) as reader:
+        reader.seek(state["offset"])
+        ins.track(reader)
+        pckt_no = dm.write_metadata_payload(pf.filter_packets(reader, pckt_filter), pp.process_raw_metadata_payload, metadata_csv, payload_csv,
+                                            pckt_no=state["pckt_no"], checkpoint=checkpoint)
+
+    state.update(
+        status="done", offset=stat.st_size, pckt_no=pckt_no,
+        metadata_size=os.path.getsize(metadata_csv), payload_size=os.path.getsize(payload_csv)
+    )
+    save_state(path, state)
+    print(f"Finished {pcap}: {pckt_no} packets")
+    return "done"
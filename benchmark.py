@@ -0,0 +1,385 @@
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import constants as c
+import raw_pcap as rp
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak RSS is then not reported
+    resource = None
+
+RESULTS_VERSION = 1
+BENCH_DIR = "bench/"
+PACKETS = 200000
+SEED = 1
+START_TIME = 1719561600.0  # 28/06/2024 10:00 local capture day
+PACKET_RATE = 2000.0  # Mean packets per second of the synthetic capture
+
+# Share of the packets of every traffic kind, close to the game captures
+TRAFFIC_MIX = {"game": 0.80, "tcp": 0.15, "dns": 0.04, "icmp": 0.01}
+# Flows of a kind running at the same time, packets are drawn from them in random order
+CONCURRENT_FLOWS = {"game": 48, "tcp": 16, "dns": 4, "icmp": 2}
+
+# UDP game flows: server port range and payload size range
+GAME_PROFILES = [
+    ((9339, 9339), (20, 180)),  # Clash Royale
+    ((3659, 3659), (40, 300)),  # EAFC
+    ((7000, 7999), (30, 120)),  # Rocket League
+    ((27015, 27050), (20, 160)),  # Brawlhalla
+]
+LOCAL_HOSTS = [c.IP_PREFIX + str(i) for i in range(2, 52)]
+DNS_SERVERS = ["8.8.8.8", "1.1.1.1"]
+DNS_NAMES = ["game.clashroyale.com", "api.ea.com", "rocketleague.psyonix.com", "brawlhalla.com",
+             "lichess.org", "cdn.example.net", "update.microsoft.com", "play.googleapis.com"]
+
+BACKENDS = ("scapy", "raw", "mmap", "vector")
+# Benchmarked stages and the backends each one supports
+STAGES = {
+    "create_csv": ("scapy", "raw", "mmap"),
+    "create_data_payload_csv": ("scapy", "raw", "mmap", "vector"),
+    "anonymize_ip_by_subnet": ("scapy", "raw"),
+    "extract_pcap": ("raw",),
+    "generate_summary_table": ("raw",),
+}
+
+_global_header = struct.Struct("<IHHiIII")
+_record_header = struct.Struct("<IIII")
+_ethernet = bytes.fromhex("0200000000020200000000010800")
+_ipv4 = struct.Struct("!BBHHHBBH4s4s")
+_udp = struct.Struct("!HHHH")
+_tcp = struct.Struct("!HHIIBBHHH")
+_icmp = struct.Struct("!BBHHH")
+_dns = struct.Struct("!HHHHHH")
+
+
+def generate_pcap(path, packets=PACKETS, seed=SEED, mix=None, rate=PACKET_RATE, start_time=START_TIME):
+    """
+    Write a reproducible synthetic capture mimicking the game traffic captures.
+
+    The capture interleaves UDP game flows between the local hosts and game servers, TCP
+    sessions (handshake, data both ways, FIN teardown), DNS queries and responses and pings,
+    as Ethernet/IPv4 frames with valid IP checksums (transport checksums are left at zero).
+    The same arguments always give the same file.
+
+    Parameters:
+    - path: Output PCAP file path.
+    - packets: Number of packets.
+    - seed: Seed of the random generator.
+    - mix: Share of the packets per traffic kind (defaults to TRAFFIC_MIX).
+    - rate: Mean packets per second, the inter-arrival times are exponential.
+    - start_time: Epoch timestamp of the first packet.
+
+    Returns:
+    - The size of the capture in bytes.
+    """
+    rng = random.Random(seed)
+    mix = mix or TRAFFIC_MIX
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    pool = rng.randbytes(1 << 16)  # Payload bytes are slices of this pool
+    makers = {"game": _game_flow, "tcp": _tcp_session, "dns": _dns_exchange, "icmp": _ping}
+    active = {kind: [makers[kind](rng, pool) for _ in range(CONCURRENT_FLOWS.get(kind, 1))] for kind in kinds}
+
+    t = start_time
+    ident = 0
+    with open(path, "wb", buffering=1 << 20) as f:
+        f.write(_global_header.pack(rp.PCAP_MAGIC, 2, 4, 0, 0, 65535, rp.LINKTYPE_ETHERNET))
+        for kind in rng.choices(kinds, weights, k=packets):
+            flows = active[kind]
+            i = rng.randrange(len(flows))
+            pckt = next(flows[i], None)
+            while pckt is None:  # Flow finished, a new one takes its place
+                flows[i] = makers[kind](rng, pool)
+                pckt = next(flows[i], None)
+            src, dst, proto, l4 = pckt
+
+            ident = (ident + 1) & 0xFFFF
+            header = bytearray(_ipv4.pack(0x45, 0, 20 + len(l4), ident, 0x4000, 64, proto, 0,
+                                          socket.inet_aton(src), socket.inet_aton(dst)))
+            header[10:12] = rp.ipv4_header_checksum(header, 0, 20).to_bytes(2, "big")
+            frame = _ethernet + header + l4
+
+            t += rng.expovariate(rate)
+            sec = int(t)
+            f.write(_record_header.pack(sec, int((t - sec) * 1000000), len(frame), len(frame)))
+            f.write(frame)
+        return f.tell()
+
+
+def _payload(rng, pool, size):
+    start = rng.randrange(len(pool) - size)
+    return pool[start:start + size]
+
+
+def _public_ip(rng):
+    return f"{rng.choice((3, 13, 18, 34, 35, 52, 104, 151, 172, 185))}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def _game_flow(rng, pool):
+    # UDP game session: bursts of small packets in both directions
+    (first_port, last_port), (min_size, max_size) = rng.choice(GAME_PROFILES)
+    host, server = rng.choice(LOCAL_HOSTS), _public_ip(rng)
+    sport, dport = rng.randrange(49152, 65536), rng.randint(first_port, last_port)
+    for _ in range(rng.randint(200, 5000)):
+        load = _payload(rng, pool, rng.randint(min_size, max_size))
+        if rng.random() < 0.5:
+            yield host, server, 17, _udp.pack(sport, dport, 8 + len(load), 0) + load
+        else:
+            yield server, host, 17, _udp.pack(dport, sport, 8 + len(load), 0) + load
+
+
+def _tcp_session(rng, pool):
+    # TCP session to a web/API server: handshake, data segments, FIN teardown
+    host, server = rng.choice(LOCAL_HOSTS), _public_ip(rng)
+    sport, dport = rng.randrange(49152, 65536), rng.choice((443, 443, 443, 80, 8080))
+    seq, ack = rng.getrandbits(32), rng.getrandbits(32)
+
+    def segment(from_host, flags, load=b""):
+        nonlocal seq, ack
+        if from_host:
+            l4 = _tcp.pack(sport, dport, seq, ack, 0x50, flags, 65535, 0, 0) + load
+            seq = (seq + len(load) + (1 if flags & 0x03 else 0)) & 0xFFFFFFFF
+            return host, server, 6, l4
+        l4 = _tcp.pack(dport, sport, ack, seq, 0x50, flags, 65535, 0, 0) + load
+        ack = (ack + len(load) + (1 if flags & 0x03 else 0)) & 0xFFFFFFFF
+        return server, host, 6, l4
+
+    yield segment(True, 0x02)  # SYN
+    yield segment(False, 0x12)  # SYN/ACK
+    yield segment(True, 0x10)  # ACK
+    for _ in range(rng.randint(4, 200)):
+        from_host = rng.random() < 0.3
+        load = _payload(rng, pool, rng.randint(100, 600) if from_host else rng.randint(200, 1460))
+        yield segment(from_host, 0x18, load)  # PSH/ACK
+        if not from_host and rng.random() < 0.5:
+            yield segment(True, 0x10)
+    yield segment(True, 0x11)  # FIN/ACK
+    yield segment(False, 0x11)
+    yield segment(True, 0x10)
+
+
+def _dns_exchange(rng, pool):
+    # DNS query for an A record and its answer
+    host, server = rng.choice(LOCAL_HOSTS), rng.choice(DNS_SERVERS)
+    sport, ident = rng.randrange(49152, 65536), rng.getrandbits(16)
+    question = b"".join(bytes([len(label)]) + label.encode() for label in rng.choice(DNS_NAMES).split(".")) + b"\x00\x00\x01\x00\x01"
+    query = _dns.pack(ident, 0x0100, 1, 0, 0, 0) + question
+    answer = _dns.pack(ident, 0x8180, 1, 1, 0, 0) + question + struct.pack("!HHHIH4s", 0xC00C, 1, 1, 300, 4, socket.inet_aton(_public_ip(rng)))
+    yield host, server, 17, _udp.pack(sport, 53, 8 + len(query), 0) + query
+    yield server, host, 17, _udp.pack(53, sport, 8 + len(answer), 0) + answer
+
+
+def _ping(rng, pool):
+    # ICMP echo requests and replies
+    host, server = rng.choice(LOCAL_HOSTS), _public_ip(rng)
+    ident = rng.getrandbits(16)
+    for seq in range(rng.randint(1, 10)):
+        load = _payload(rng, pool, 56)
+        yield host, server, 1, _icmp.pack(8, 0, 0, ident, seq) + load
+        yield server, host, 1, _icmp.pack(0, 0, 0, ident, seq) + load
+
+
+def run_benchmark(output_json=None, packets=PACKETS, seed=SEED, stages=None, backends=BACKENDS, bench_dir=BENCH_DIR, repeat=1, quiet=True,
+                  instrument=False):
+    """
+    Benchmark the conversion and analysis stages on a synthetic capture (see generate_pcap).
+
+    Every run of a stage executes in a fresh process, so its peak RSS is its own. Each stage
+    is reported per backend with its wall and CPU time (best of repeat runs), packets and
+    megabytes of input per second, peak RSS and output size.
+
+    Parameters:
+    - output_json: Optional path the results are written to as JSON (see compare_results).
+    - packets: Packets of the synthetic capture.
+    - seed: Seed of the synthetic capture.
+    - stages: Names of the stages to run (defaults to all of STAGES).
+    - backends: Backends to benchmark, each stage runs the ones it supports.
+    - bench_dir: Working directory of the capture and the outputs (reused between runs).
+    - repeat: Runs per stage and backend.
+    - quiet: Hide the progress output of the stages.
+    - instrument: Also record the time of the steps inside each stage (read, decode, write...,
+      see instrumentation); adds a little overhead to the measured times.
+
+    Returns:
+    - The results as a dict.
+    """
+    os.makedirs(bench_dir, exist_ok=True)
+    pcap = os.path.join(bench_dir, f"synthetic_{packets}_{seed}.pcap")
+    start = time.perf_counter()
+    pcap_bytes = generate_pcap(pcap, packets, seed)
+    print(f"Generated {pcap} ({packets} packets, {pcap_bytes / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "capture": {"path": pcap, "packets": packets, "seed": seed, "bytes": pcap_bytes},
+        "stages": [],
+    }
+    context = get_context("spawn")
+    for stage in stages or STAGES:
+        for backend in STAGES[stage]:
+            if backend not in backends and len(STAGES[stage]) > 1:
+                continue
+            runs = []
+            for _ in range(repeat):
+                # One process per run: clean peak RSS and no state carried over (caches, imports)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    runs.append(executor.submit(run_stage, (stage, backend, pcap, bench_dir, quiet, instrument)).result())
+            best = min(runs, key=lambda run: run["seconds"])
+            result = {
+                "stage": stage, "backend": backend, "seconds": best["seconds"], "cpu_seconds": best["cpu_seconds"],
+                "packets_per_second": packets / best["seconds"],
+                "mb_per_second": best["input_bytes"] / 1e6 / best["seconds"],
+                "peak_rss_mb": max(run["peak_rss_mb"] or 0 for run in runs) or None,
+                "output_bytes": best["output_bytes"],
+                "runs": [run["seconds"] for run in runs],
+            }
+            if best["breakdown"] is not None:
+                result["breakdown"] = best["breakdown"]
+            results["stages"].append(result)
+            print(f"{stage:<24} {backend:<7} {result['seconds']:8.2f}s {result['packets_per_second']:10.0f} pkts/s "
+                  f"{result['mb_per_second']:7.1f} MB/s  peak RSS {result['peak_rss_mb'] or 0:.0f} MB")
+
+    if output_json:
+        with open(output_json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {output_json}")
+    return results
+
+
+def run_stage(task):
+    # Worker of run_benchmark: run one stage on the capture and measure it
+    stage, backend, pcap, bench_dir, quiet, instrument = task
+    import anonymization as an
+    import data_model as dm
+    import instrumentation as ins
+    import pcap_processing as pcp
+    import summary as sm
+
+    metadata_csv = os.path.join(bench_dir, "metadata.csv")
+    if stage == "generate_summary_table" and not os.path.isfile(metadata_csv):
+        run_quietly(quiet, dm.create_data_payload_csv, pcap, metadata_csv, os.path.join(bench_dir, "payload.csv"), "vector")
+
+    out = os.path.join(bench_dir, f"{stage}_{backend}")
+    if stage == "create_csv":
+        outputs = [out + ".csv"]
+        run = lambda: dm.create_csv(pcap, outputs[0], backend)
+    elif stage == "create_data_payload_csv":
+        outputs = [out + "_metadata.csv", out + "_payload.csv"]
+        run = lambda: dm.create_data_payload_csv(pcap, outputs[0], outputs[1], backend, index=False, cube=False)
+    elif stage == "anonymize_ip_by_subnet":
+        outputs = [out + ".pcap", out + "_tracking.csv"]
+        anonymize = an.anonymize_ip_by_subnet if backend == "scapy" else an.anonymize_ip_by_subnet_fast
+        run = lambda: anonymize(pcap, outputs[0], outputs[1], an.ip_groups)
+    elif stage == "extract_pcap":
+        # split_pcap_by_host works on PCAP_DIR, pointed at the benchmark directory for this process
+        c.PCAP_DIR = os.path.join(bench_dir, "")
+        outputs = [os.path.join(bench_dir, ip, ip + "_" + os.path.basename(pcap)) for ip in LOCAL_HOSTS]
+        run = lambda: pcp.split_pcap_by_host(os.path.basename(pcap), hosts=LOCAL_HOSTS)
+    elif stage == "generate_summary_table":
+        outputs = []
+        run = lambda: sm.generate_summary_table(metadata_csv, LOCAL_HOSTS)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    for path in outputs:  # Some stages append to existing outputs
+        if os.path.exists(path):
+            os.remove(path)
+
+    if instrument:
+        ins.enable(report_interval=None)
+    rss_before = peak_rss_mb()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    run_quietly(quiet, run)
+    seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+    return {
+        "seconds": seconds, "cpu_seconds": cpu_seconds,
+        "input_bytes": os.path.getsize(metadata_csv if stage == "generate_summary_table" else pcap),
+        "output_bytes": sum(os.path.getsize(path) for path in outputs if os.path.exists(path)),
+        "peak_rss_mb": peak_rss_mb(), "start_rss_mb": rss_before,
+        "breakdown": ins.state.last_run["stages"] if instrument and ins.state.last_run else None,
+    }
+
+
+def run_quietly(quiet, function, *args):
+    if not quiet:
+        return function(*args)
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            return function(*args)
+        finally:
+            sys.stdout = stdout
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process so far (kilobytes on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def compare_results(baseline_json, current_json, threshold=0.10):
+    """
+    Compare two benchmark result files stage by stage.
+
+    Parameters:
+    - baseline_json: Results of the reference run.
+    - current_json: Results of the run to check.
+    - threshold: Relative slowdown above which a stage counts as a regression.
+
+    Returns:
+    - List of (stage, backend, baseline seconds, current seconds) of the regressions.
+    """
+    with open(baseline_json) as f:
+        baseline = json.load(f)
+    with open(current_json) as f:
+        current = json.load(f)
+    if baseline["capture"]["packets"] != current["capture"]["packets"] or baseline["capture"]["seed"] != current["capture"]["seed"]:
+        print("Warning: the runs used different synthetic captures")
+
+    reference = {(r["stage"], r["backend"]): r for r in baseline["stages"]}
+    regressions = []
+    for result in current["stages"]:
+        key = (result["stage"], result["backend"])
+        if key not in reference:
+            continue
+        before, after = reference[key]["seconds"], result["seconds"]
+        change = after / before - 1
+        print(f"{key[0]:<24} {key[1]:<7} {before:8.2f}s -> {after:8.2f}s ({change:+.1%})")
+        if change > threshold:
+            regressions.append((key[0], key[1], before, after))
+    print(f"{len(regressions)} regression(s) above {threshold:.0%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the conversion pipeline on a synthetic capture")
+    parser.add_argument("--packets", type=int, default=PACKETS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES))
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--dir", default=BENCH_DIR)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--instrument", action="store_true", help="Record the steps inside every stage")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="Compare the results with an earlier run")
+    args = parser.parse_args()
+    run_benchmark(args.output, args.packets, args.seed, args.stages, args.backends, args.dir, args.repeat,
+                  instrument=args.instrument)
+    if args.compare:
+        compare_results(args.compare, args.output)
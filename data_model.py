@@ -1,64 +1,86 @@
-import pandas as pd
+import bisect
+import io
+import os
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import file_mgmt as fm
+import flows as fl
+import instrumentation as ins
+import metadata_index as mi
+import packet_filter as pf
+import payload_store as ps
+import raw_pcap as rp
+import table_io as tio
+import traffic_cube as tc
+import vector_decode as vd
 from packet_processing import *
 
-def create_csv(_pcap, output_csv):
+@ins.instrumented("create_csv")
+def create_csv(_pcap, output_csv, backend="scapy", output_format="csv", pckt_filter=None):
     columns = ["Time", "No", "SourceIP", "DestinationIP",
                "SourcePort", "DestinationPort", "SequenceNumber", "AcknowledgementNumber",
                "Protocol", "Length", "Load"]
 
-    # Open output CSV and write headers
-    with open(output_csv, 'w') as f:
-        pd.DataFrame(columns=columns).to_csv(f, index=False)
+    output = open_output(output_csv, columns, tio.CSV_TYPES, output_format)
+    write_chunk = ins.timed("write", get_chunk_writer(output))
 
-    cap = fm.open_pcap(_pcap)
+    cap = fm.open_pcap(_pcap, backend, pckt_filter)
+    process = ins.timed("decode", get_processor(process_pckt, backend))
+    clean = ins.timed("clean", clean_row)
 
     pckt_no = 0
 
     try:
         chunk = []  # Buffer to store rows temporarily
         chunk_size = 1000  # Adjust based on memory
-        for pckt in cap:
+        for pckt in ins.timed_iter("read", cap):
             pckt_no += 1
-            pckt_data = process_pckt(pckt, pckt_no)
+            pckt_data = process(pckt, pckt_no)
 
-            # Ensure no None values and force integers where needed
-            pckt_data_clean = {k: int(v) if isinstance(v, (int, float)) and v is not None else v for k, v in pckt_data.items()}
-            chunk.append(pckt_data_clean)
+            chunk.append(clean(pckt_data))
 
             if len(chunk) >= chunk_size:
                 # Write chunk to CSV
-                write_chunk_to_csv(chunk, output_csv)
+                write_chunk(chunk)
                 chunk = []  # Clear buffer
 
             if pckt_no % 10000 == 0:  # Periodic logging
                 print(f"Processed {pckt_no} packets")
+                ins.progress(pckt_no, pckt)
 
         # Write remaining packets in the buffer
         if chunk:
-            write_chunk_to_csv(chunk, output_csv)
+            write_chunk(chunk)
     finally:
         cap.close()  # Ensure file is properly closed
+        close_output(output)
 
 
-def create_data_csv(_pcap, output_csv):
+@ins.instrumented("create_data_csv")
+def create_data_csv(_pcap, output_csv, backend="scapy", pckt_filter=None):
     columns = ["Time", "Pckt_No", "Data"]
 
     # Open output CSV and write headers
-    with open(output_csv, 'w') as f:
-        pd.DataFrame(columns=columns).to_csv(f, index=False)
+    output = tio.CsvChunkWriter(output_csv, columns, int_columns=("Time", "Pckt_No"))
+    write_chunk = ins.timed("write", output.write)
 
-    cap = fm.open_pcap(_pcap)
+    cap = fm.open_pcap(_pcap, backend, pckt_filter)
+    process = ins.timed("decode", get_processor(process_data_pckt, backend))
 
     pckt_no = 0
 
     try:
         chunk = []  # Buffer to store rows temporarily
         chunk_size = 1000  # Adjust based on memory
-        for pckt in cap:
+        for pckt in ins.timed_iter("read", cap):
             pckt_no += 1
-            pckt_data = process_data_pckt(pckt, pckt_no)
-            chunk.append(pckt_data)
+            pckt_data = process(pckt, pckt_no)
 
             # Ensure no None values in the packet data
             pckt_data_clean = {k: (v if v is not None else "") for k, v in pckt_data.items()}
@@ -66,149 +88,670 @@ def create_data_csv(_pcap, output_csv):
 
             if len(chunk) >= chunk_size:
                 # Write chunk to CSV
-                pd.DataFrame(chunk).to_csv(output_csv, mode='a', index=False, header=False)
+                write_chunk(chunk)
                 chunk = []  # Clear buffer
 
             if pckt_no % 10000 == 0:  # Periodic logging
                 print(f"Processed {pckt_no} packets")
+                ins.progress(pckt_no, pckt)
 
         # Write remaining packets in the buffer
         if chunk:
-            pd.DataFrame(chunk).to_csv(output_csv, mode='a', index=False, header=False)
+            write_chunk(chunk)
     finally:
         cap.close()  # Ensure file is properly closed
+        output.close()
 
 
-def create_data_payload_csv(_pcap, _metadata_csv, _payload_csv):
-    metadata_columns = [
-        "Time", "No", "SourceIP", "DestinationIP", 
-        "SourcePort", "DestinationPort", "SequenceNumber", 
-        "AcknowledgementNumber", "Protocol", "Length"
-    ]
-    payload_columns = ["No", "Length", "Payload"]
+PIPELINE_BATCH_BYTES = 1024 * 1024  # Bytes of records per batch of the pipelined conversion
+PIPELINE_POLL = 0.1  # Seconds between two checks for a failed stage while a pipeline queue waits
+
+METADATA_COLUMNS = [
+    "Time", "No", "SourceIP", "DestinationIP",
+    "SourcePort", "DestinationPort", "SequenceNumber",
+    "AcknowledgementNumber", "Protocol", "Length"
+]
+PAYLOAD_COLUMNS = ["No", "Length", "Payload"]
 
+
+def write_csv_header(output_csv, columns):
     # Open output CSV and write headers
-    with open(_metadata_csv, 'w') as f:
-        pd.DataFrame(columns=metadata_columns).to_csv(f, index=False)
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        f.write(tio.format_csv_header(columns))
+
+
+def open_output(path, columns, types, output_format, keys=None, index=False):
+    """
+    Prepare an output table for chunked writing.
+
+    Parameters:
+    - path: Output file path.
+    - columns: CSV header columns.
+    - types: Parquet column types (see table_io).
+    - output_format: "csv" (text, header written now) or "parquet" (typed columns, row groups).
+    - keys: Packet dict keys feeding the Parquet columns, when they differ from the column names.
+    - index: Build the time/host sidecar index of a CSV output while it is written (see metadata_index).
+
+    Returns:
+    - A table_io.CsvChunkWriter, an IndexedCsvWriter or a table_io.ParquetChunkWriter.
+    """
+    if output_format == "csv":
+        writer = tio.CsvChunkWriter(path, columns)
+        return IndexedCsvWriter(writer, mi.MetadataIndexer(path, columns)) if index else writer
+    if output_format == "parquet":
+        return tio.ParquetChunkWriter(path, types, keys)
+    raise ValueError(f"Unknown output format: {output_format}")
 
-    with open(_payload_csv, 'w') as f:
-        pd.DataFrame(columns=payload_columns).to_csv(f, index=False)
 
+def open_payload_output(path, output_format, compression=None):
+    # Payload stores (.pstore paths) take raw payload bytes (compressed per block), other outputs the base64 text
+    if ps.is_payload_store(path):
+        return ps.PayloadStoreWriter(path, compression)
+    if compression is not None:
+        raise ValueError(f"Compression only applies to payload stores (.pstore), not {path}")
+    return open_output(path, PAYLOAD_COLUMNS, tio.PAYLOAD_TYPES, output_format, tio.PAYLOAD_KEYS)
 
-    cap = fm.open_pcap(_pcap)
 
-    pckt_no = 0
+class IndexedCsvWriter:
+    """
+    CSV output feeding a metadata_index.MetadataIndexer with the byte range of every chunk it writes.
 
-    try:
-        metadata_chunk = []  # Buffer to store rows temporarily
-        payload_chunk = []  
-        chunk_size = 1000  # Adjust based on memory
-        for pckt in cap:
-            pckt_no += 1
-            pckt_metadata, pckt_payload = process_metadata_payload(pckt, pckt_no)
+    Parameters:
+    - writer: table_io.CsvChunkWriter of the CSV.
+    - indexer: metadata_index.MetadataIndexer of the same CSV.
+    """
 
-            # Ensure no None values and force integers where needed
-            pckt_metadata_clean = {k: int(v) if isinstance(v, (int, float)) and v is not None else v for k, v in pckt_metadata.items()}
-            pckt_payload_clean = {k: int(v) if isinstance(v, (int, float)) and v is not None else v for k, v in pckt_payload.items()}
+    def __init__(self, writer, indexer):
+        self.writer = writer
+        self.indexer = indexer
 
-            if pckt_metadata_clean:
-                metadata_chunk.append(pckt_metadata_clean)
-                payload_chunk.append(pckt_payload_clean)
-            else: pckt_no -= 1
+    def write(self, chunk):
+        start = self.writer.position
+        self.writer.write(chunk)
+        self.indexer.add_rows(start, self.writer.position, chunk)
 
-            if len(metadata_chunk) >= chunk_size:
-                # Write chunk to CSV
-                write_chunk_to_csv(metadata_chunk, _metadata_csv)
-                metadata_chunk = []  # Clear buffer
+    def write_frame(self, frame):
+        # One write per index block keeps the blocks at the size of the row-wise conversions
+        for first in range(0, len(frame), self.indexer.block_rows):
+            part = frame.iloc[first:first + self.indexer.block_rows]
+            start = self.writer.position
+            self.writer.write_frame(part)
+            self.indexer.add_frame(start, self.writer.position, part)
 
-            if len(payload_chunk) >= chunk_size:
-                # Write chunk to CSV
-                write_chunk_to_csv(payload_chunk, _payload_csv)
-                payload_chunk = []  # Clear buffer
+    def flush(self):
+        self.writer.flush()
 
-            if pckt_no % 10000 == 0:  # Periodic logging
-                print(f"Processed {pckt_no} packets")
+    def close(self):
+        self.writer.close()  # Flushed before the index records the file size
+        self.indexer.close()
 
-        # Write remaining packets in the buffer
-        if metadata_chunk:
-            write_chunk_to_csv(metadata_chunk, _metadata_csv)
-        if payload_chunk:
-            write_chunk_to_csv(payload_chunk, _payload_csv)
 
-    finally:
-        cap.close()  # Ensure file is properly closed
+class CubeOutput:
+    """
+    Output passing the rows it writes on to a traffic_cube.CubeBuilder, which saves the cube of
+    the table once the output is closed.
 
-def create_data_payload_csv_timed(_pcap, _metadata_csv, _payload_csv, stop_timestamp):
-    metadata_columns = [
-        "Time", "No", "SourceIP", "DestinationIP", 
-        "SourcePort", "DestinationPort", "SequenceNumber", 
-        "AcknowledgementNumber", "Protocol", "Length"
-    ]
-    payload_columns = ["No", "Length", "Payload"]
+    Parameters:
+    - output: Output of the table (see open_output).
+    - builder: traffic_cube.CubeBuilder of the cube.
+    - path: Path of the table, recorded in the cube.
+    """
 
-    # Open output CSV and write headers
-    with open(_metadata_csv, 'w') as f:
-        pd.DataFrame(columns=metadata_columns).to_csv(f, index=False)
+    def __init__(self, output, builder, path):
+        self.output = output
+        self.builder = builder
+        self.path = path
 
-    with open(_payload_csv, 'w') as f:
-        pd.DataFrame(columns=payload_columns).to_csv(f, index=False)
+    def write(self, chunk):
+        self.output.write(chunk)
+        self.builder.add_rows(chunk)
 
-    cap = fm.open_pcap(_pcap)
+    def write_frame(self, frame):
+        self.output.write_frame(frame)
+        self.builder.add_frame(frame)
 
-    pckt_no = 0
+    def flush(self):
+        flush_output(self.output)
 
-    try:
-        metadata_chunk = []  # Buffer to store rows temporarily
-        payload_chunk = []  
-        chunk_size = 1000  # Adjust based on memory
-        for pckt in cap:
-            # Stop processing if packet timestamp exceeds stop_timestamp
-            if pckt.time > stop_timestamp:
-                print(f"Stopping processing as packet timestamp {pckt.time} exceeds stop_timestamp {stop_timestamp}")
-                break
+    def close(self):
+        self.output.close()  # Complete before the cube records the table
+        self.builder.save(self.path)
 
-            pckt_no += 1
-            pckt_metadata, pckt_payload = process_metadata_payload(pckt, pckt_no)
 
-            # Ensure no None values and force integers where needed
-            pckt_metadata_clean = {k: int(v) if isinstance(v, (int, float)) and v is not None else v for k, v in pckt_metadata.items()}
-            pckt_payload_clean = {k: int(v) if isinstance(v, (int, float)) and v is not None else v for k, v in pckt_payload.items()}
+def open_cube_output(output, path, cube):
+    # Feed the rows written to output into the traffic cube of path when cube is set
+    return CubeOutput(output, tc.CubeBuilder(tc.cube_path(path)), path) if cube else output
 
-            if pckt_metadata_clean:
-                metadata_chunk.append(pckt_metadata_clean)
-                payload_chunk.append(pckt_payload_clean)
-            else: pckt_no -= 1
 
-            if len(metadata_chunk) >= chunk_size:
-                # Write chunk to CSV
-                write_chunk_to_csv(metadata_chunk, _metadata_csv)
-                metadata_chunk = []  # Clear buffer
+def get_chunk_writer(output):
+    # CSV paths are appended to with write_chunk_to_csv, writer objects are used directly
+    if isinstance(output, str):
+        return lambda chunk: write_chunk_to_csv(chunk, output)
+    return output.write
 
-            if len(payload_chunk) >= chunk_size:
-                # Write chunk to CSV
-                write_chunk_to_csv(payload_chunk, _payload_csv)
-                payload_chunk = []  # Clear buffer
 
-            if pckt_no % 10000 == 0:  # Periodic logging
-                print(f"Processed {pckt_no} packets")
+def get_frame_writer(output):
+    # DataFrame counterpart of get_chunk_writer, used by the block-wise conversions
+    if isinstance(output, str):
+        return lambda frame: write_frame_to_csv(frame, output)
+    return output.write_frame
+
+
+def open_appended(output, columns):
+    # Writer appending to a CSV path for the duration of a conversion, other outputs as they are
+    return tio.CsvChunkWriter(output, columns, append=True) if isinstance(output, str) else output
+
+
+def close_appended(writer, output):
+    if writer is not output:
+        writer.close()
+
+
+def flush_output(output):
+    # Write the buffered text of a CSV output to its file
+    if isinstance(output, (tio.CsvChunkWriter, IndexedCsvWriter, CubeOutput)):
+        output.flush()
 
-        # Write remaining packets in the buffer
-        if metadata_chunk:
-            write_chunk_to_csv(metadata_chunk, _metadata_csv)
-        if payload_chunk:
-            write_chunk_to_csv(payload_chunk, _payload_csv)
 
+def close_output(output):
+    if not isinstance(output, str):
+        output.close()
+
+
+@ins.instrumented("create_data_payload_csv")
+def create_data_payload_csv(_pcap, _metadata_csv, _payload_csv, backend="scapy", output_format="csv", flow_csv=None, index=True, cube=True, pckt_filter=None, compression=None):
+    metadata_out = open_output(_metadata_csv, METADATA_COLUMNS, tio.METADATA_TYPES, output_format, index=index)
+    metadata_out = open_cube_output(metadata_out, _metadata_csv, cube)
+    payload_out = open_payload_output(_payload_csv, output_format, compression)
+
+    cap = fm.open_pcap(_pcap, backend, pckt_filter if backend != "vector" else None)
+    process = get_processor(process_metadata_payload, backend)
+    flow_writer, flows = open_flows(flow_csv)
+
+    try:
+        if backend == "vector":
+            write_metadata_payload_blocks(filter_blocks(vd.iter_blocks(cap), pckt_filter), metadata_out, payload_out, flows=flows)
+        else:
+            write_metadata_payload(cap, process, metadata_out, payload_out, flows=flows)
     finally:
         cap.close()  # Ensure file is properly closed
+        close_output(metadata_out)
+        close_output(payload_out)
+        close_flows(flow_writer, flows)
+
+@ins.instrumented("create_data_payload_csv_timed")
+def create_data_payload_csv_timed(_pcap, _metadata_csv, _payload_csv, stop_timestamp, backend="scapy", output_format="csv", flow_csv=None, index=True, cube=True, start_timestamp=None, pckt_filter=None, compression=None):
+    metadata_out = open_output(_metadata_csv, METADATA_COLUMNS, tio.METADATA_TYPES, output_format, index=index)
+    metadata_out = open_cube_output(metadata_out, _metadata_csv, cube)
+    payload_out = open_payload_output(_payload_csv, output_format, compression)
+
+    if backend == "vector":
+        cap = fm.open_pcap(_pcap, backend)
+        if start_timestamp is not None:
+            cap.seek(rp.load_packet_index(_pcap).offset_for_time(start_timestamp))
+        pckts = filter_blocks(vd.iter_blocks(cap), pckt_filter)
+    elif start_timestamp is None and pckt_filter is None:
+        cap = fm.open_pcap(_pcap, backend)
+        pckts = cap
+    else:
+        # Start close to start_timestamp through the packet index instead of at the first packet,
+        # and match the filter on the raw records up to stop_timestamp (a filtered reader, see
+        # file_mgmt.open_pcap; Scapy reads them with the mmap reader, which also takes pcapng files)
+        if pckt_filter is not None:
+            cap = fm.open_pcap(_pcap, backend, pckt_filter)
+            pckts = cap.read_time_range(start_timestamp, stop_timestamp)
+        else:
+            cap = fm.open_pcap(_pcap, "mmap" if backend == "scapy" else backend)
+            pckts = cap.read_time_range(start_timestamp, stop_timestamp)
+            if backend == "scapy":
+                pckts = (pckt.to_scapy() for pckt in pckts)
+    process = get_processor(process_metadata_payload, backend)
+    flow_writer, flows = open_flows(flow_csv)
 
+    try:
+        if backend == "vector":
+            write_metadata_payload_blocks(pckts, metadata_out, payload_out, stop_timestamp, flows=flows, start_timestamp=start_timestamp)
+        else:
+            write_metadata_payload(pckts, process, metadata_out, payload_out, stop_timestamp, flows=flows)
+    finally:
+        cap.close()  # Ensure file is properly closed
+        close_output(metadata_out)
+        close_output(payload_out)
+        close_flows(flow_writer, flows)
+
+@ins.instrumented("create_data_payload_csv_parallel")
+def create_data_payload_csv_parallel(_pcap, _metadata_csv, _payload_csv, workers=None, shards_per_worker=4, pckt_filter=None):
+    """
+    Multi-process version of create_data_payload_csv producing the same files.
+
+    The record offsets of the PCAP are scanned first, the file is cut into byte-range
+    shards on record boundaries and every shard is decoded (raw backend) by a process
+    pool into temporary part files. The parts are then concatenated in file order,
+    renumbering "No" so that it stays global and gap-free.
+
+    Parameters:
+    - _pcap: Input PCAP file path.
+    - _metadata_csv: Output metadata CSV path.
+    - _payload_csv: Output payload CSV path.
+    - workers: Number of worker processes (defaults to the CPU count).
+    - shards_per_worker: Shards per worker, more shards balance uneven packet sizes better.
+    - pckt_filter: Optional filter expression, see packet_filter.PacketFilter.
+    """
+    workers = workers or os.cpu_count()
+
+    write_csv_header(_metadata_csv, METADATA_COLUMNS)
+    write_csv_header(_payload_csv, PAYLOAD_COLUMNS)
+
+    offsets = rp.scan_record_offsets(_pcap)
+    print(f"Found {len(offsets)} records in {_pcap}")
+    if not offsets:
+        return
+
+    shards = split_shards(offsets, os.path.getsize(_pcap), workers * shards_per_worker)
+    tmp_dir = tempfile.mkdtemp(prefix="shards_", dir=os.path.dirname(os.path.abspath(_metadata_csv)))
+    try:
+        tasks = [
+            (_pcap, start, end, os.path.join(tmp_dir, f"metadata_{i}.csv"), os.path.join(tmp_dir, f"payload_{i}.csv"),
+             pf.filter_expression(pckt_filter))
+            for i, (start, end) in enumerate(shards)
+        ]
+        print(f"Converting {len(tasks)} shards with {workers} workers")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(convert_shard, tasks))
+
+        # Merge the parts in file order, shifting the shard-local packet numbers
+        pckt_no = 0
+        with open(_metadata_csv, 'a', newline='') as metadata_out, open(_payload_csv, 'a', newline='') as payload_out:
+            for (_, _, _, metadata_part, payload_part, _), count in zip(tasks, counts):
+                append_renumbered_csv(metadata_part, metadata_out, METADATA_COLUMNS.index("No"), pckt_no)
+                append_renumbered_csv(payload_part, payload_out, PAYLOAD_COLUMNS.index("No"), pckt_no)
+                pckt_no += count
+        print(f"Processed {pckt_no} packets")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def split_shards(offsets, file_end, count):
+    """
+    Cut a PCAP into at most count byte ranges of similar size, aligned on record offsets.
+
+    Returns:
+    - List of (start, end) byte ranges covering all records.
+    """
+    first = offsets[0]
+    step = max(1, (file_end - first) // count)
+    starts = [first]
+    for i in range(1, count):
+        idx = bisect.bisect_left(offsets, first + i * step)
+        if idx < len(offsets) and offsets[idx] > starts[-1]:
+            starts.append(offsets[idx])
+    return list(zip(starts, starts[1:] + [file_end]))
+
+def convert_shard(task):
+    # Worker of create_data_payload_csv_parallel: decode one byte range into headerless part files
+    _pcap, start, end, metadata_part, payload_part, pckt_filter = task
+    open(metadata_part, 'w').close()
+    open(payload_part, 'w').close()
+    with rp.RawPcapReader(_pcap) as reader:
+        pckts = pf.filter_packets(reader.read_range(start, end), pckt_filter)
+        return write_metadata_payload(pckts, process_raw_metadata_payload, metadata_part, payload_part)
+
+def append_renumbered_csv(part_csv, out, column, offset):
+    # Copy a headerless part CSV to out, adding offset to the packet number in the given column
+    with open(part_csv, newline='') as f:
+        out.writelines(renumber_csv_lines(f, column, offset))
+
+def renumber_csv_lines(lines, column, offset):
+    for line in lines:
+        fields = line.split(',', column + 1)
+        fields[column] = str(int(fields[column]) + offset)
+        yield ','.join(fields)
+
+@ins.instrumented("create_data_payload_csv_pipelined")
+def create_data_payload_csv_pipelined(_pcap, _metadata_csv, _payload_csv, backend="raw", decoders=None,
+                                      batch_bytes=PIPELINE_BATCH_BYTES, queue_batches=None, pckt_filter=None):
+    """
+    Pipelined version of create_data_payload_csv producing the same CSV files, with reading,
+    decoding and writing overlapping.
+
+    A reader thread cuts the capture into batches of whole records, a pool of decoder
+    processes turns each batch into the CSV text of its rows, and one writer thread per
+    output appends the text, renumbering "No" so that it stays global and gap-free. The
+    stages are connected by bounded queues, so a slow stage holds back the ones before it
+    instead of filling the memory, and the batches are written in file order whatever order
+    the decoders finish in. An error in any stage stops the others and is raised.
+
+    Parameters:
+    - _pcap: Input PCAP file path (libpcap).
+    - _metadata_csv: Output metadata CSV path.
+    - _payload_csv: Output payload CSV path.
+    - backend: "raw" or "scapy", the decoding done by the workers (see packet_processing.get_processor).
+    - decoders: Number of decoder processes (defaults to the CPU count).
+    - batch_bytes: Bytes of records per batch.
+    - queue_batches: Batches each queue holds, and batches decoded at the same time (defaults to 2 * decoders).
+    - pckt_filter: Optional filter expression, see packet_filter.PacketFilter.
+
+    Returns:
+    - The number of the last packet written.
+    """
+    decoders = decoders or os.cpu_count()
+    queue_batches = queue_batches or 2 * decoders
+    if backend not in ("raw", "scapy"):
+        raise ValueError(f"Unknown pipeline backend: {backend}")
+
+    write_csv_header(_metadata_csv, METADATA_COLUMNS)
+    write_csv_header(_payload_csv, PAYLOAD_COLUMNS)
+
+    stop = threading.Event()  # Set when a stage fails, the others return
+    errors = []
+    batches = queue.Queue(queue_batches)
+    outputs = [queue.Queue(queue_batches), queue.Queue(queue_batches)]
+
+    reader = rp.RawPcapReader(_pcap)
+    ins.track(reader)
+    decode_info = (reader.record_header.format, reader.tsresol, reader.linktype, backend, pf.filter_expression(pckt_filter))
+    threads = [
+        threading.Thread(target=read_batches, args=(reader, batch_bytes, batches, stop, errors), name="pipeline-reader"),
+        threading.Thread(target=write_batches, args=(_metadata_csv, METADATA_COLUMNS.index("No"), outputs[0], stop, errors),
+                         name="pipeline-metadata-writer"),
+        threading.Thread(target=write_batches, args=(_payload_csv, PAYLOAD_COLUMNS.index("No"), outputs[1], stop, errors),
+                         name="pipeline-payload-writer"),
+    ]
+    for thread in threads:
+        thread.start()
 
+    pckt_no = 0
+    executor = ProcessPoolExecutor(max_workers=decoders)
+    try:
+        pending = deque()  # Futures of the batches being decoded, in file order
+        done = False
+        while (not done or pending) and not stop.is_set():
+            if not done and len(pending) < queue_batches:
+                batch = get_or_stop(batches, stop)
+                if batch is None:
+                    done = True
+                else:
+                    pending.append(executor.submit(decode_batch, decode_info + batch))
+                continue
+            # Oldest batch first keeps the output in file order
+            count, metadata_text, payload_text = pending.popleft().result()
+            put_or_stop(outputs[0], (metadata_text, pckt_no), stop)
+            put_or_stop(outputs[1], (payload_text, pckt_no), stop)
+            pckt_no += count
+            log_batch_progress(pckt_no, count)
+    except BaseException as e:
+        stop.set()
+        errors.append(e)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        for output in outputs:
+            put_or_stop(output, None, stop)
+        for thread in threads:
+            thread.join()
+        reader.close()
+    if errors:
+        raise errors[0]
+    return pckt_no
+
+def read_batches(reader, batch_bytes, batches, stop, errors):
+    # Reader stage of create_data_payload_csv_pipelined: queue (offset, record bytes) batches, then None
+    try:
+        for batch in ins.timed_iter("read", rp.iter_record_chunks(reader, batch_bytes)):
+            if not put_or_stop(batches, batch, stop):
+                return
+        put_or_stop(batches, None, stop)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+
+def decode_batch(task):
+    # Decoder stage of create_data_payload_csv_pipelined: CSV text of the rows of one batch, numbered from 1
+    record_format, tsresol, linktype, backend, pckt_filter, offset, data = task
+    pckts = pf.filter_packets(rp.iter_buffer_records(data, struct.Struct(record_format), tsresol, linktype, offset), pckt_filter)
+    if backend == "scapy":
+        pckts = (pckt.to_scapy() for pckt in pckts)
+    metadata_text, payload_text = CsvTextWriter(), CsvTextWriter()
+    count = write_metadata_payload(pckts, get_processor(process_metadata_payload, backend), metadata_text, payload_text)
+    return count, metadata_text.getvalue(), payload_text.getvalue()
+
+def write_batches(output_csv, column, batches, stop, errors):
+    # Writer stage of create_data_payload_csv_pipelined: append (text, first number) batches until None
+    try:
+        with open(output_csv, 'a', newline='') as out:
+            while True:
+                batch = get_or_stop(batches, stop)
+                if batch is None:
+                    return
+                text, offset = batch
+                with ins.stage("write"):
+                    out.writelines(renumber_csv_lines(text.splitlines(True), column, offset) if offset else text)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+
+def log_batch_progress(pckt_no, count, position=None):
+    # Periodic logging of write_metadata_payload for loops advancing by batches of count packets:
+    # print once per 10000 packets crossed, report progress after every batch
+    if pckt_no // 10000 > (pckt_no - count) // 10000:
+        print(f"Processed {pckt_no} packets")
+    ins.progress(pckt_no, position)
+
+def put_or_stop(q, item, stop):
+    # Put with backpressure, giving up once stop is set; returns whether the item was queued
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=PIPELINE_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def get_or_stop(q, stop):
+    # Next item of a queue, None once stop is set
+    while not stop.is_set():
+        try:
+            return q.get(timeout=PIPELINE_POLL)
+        except queue.Empty:
+            pass
+    return None
+
+class CsvTextWriter:
+    # Output collecting the CSV text of the written chunks in memory
+    def __init__(self):
+        self.buffer = io.StringIO()
+
+    def write(self, chunk):
+        self.buffer.write(tio.format_csv_rows(chunk))
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+def filter_blocks(blocks, pckt_filter):
+    # Record blocks reduced to the records matching pckt_filter (unchanged when None)
+    pckt_filter = pf.compile_filter(pckt_filter)
+    return blocks if pckt_filter is None else pckt_filter.filter_blocks(blocks)
+
+def open_flows(flow_csv):
+    """
+    Create the flow table fed by the metadata conversions when a flow CSV is requested.
+
+    Returns:
+    - (writer, table), both None when flow_csv is None.
+    """
+    if flow_csv is None:
+        return None, None
+    writer = fl.FlowCsvWriter(flow_csv)
+    return writer, fl.FlowTable(writer)
+
+def close_flows(writer, table):
+    if table is not None:
+        table.flush()
+        writer.close()
+
+def write_metadata_payload(cap, process, _metadata_csv, _payload_csv, stop_timestamp=None, pckt_no=0, checkpoint=None, flows=None):
+    """
+    Decode packets and append their rows to already created metadata and payload outputs.
+    Packets without TCP/UDP metadata are skipped and do not consume a packet number.
+
+    Parameters:
+    - cap: Iterable of packets (PcapReader, RawPcapReader or a range of it).
+    - process: Packet processing function, see packet_processing.get_processor.
+    - _metadata_csv: Metadata output, a CSV path to append to or a writer (see open_output).
+    - _payload_csv: Payload output, a CSV path to append to or a writer (see open_output).
+    - stop_timestamp: Optional epoch timestamp after which processing stops.
+    - pckt_no: Number of the last packet already written (when resuming a conversion).
+    - checkpoint: Optional function called as checkpoint(pckt_no, pckt) each time the rows up to
+      pckt have been written to both outputs.
+    - flows: Optional flows.FlowTable updated with every packet written.
+
+    Returns:
+    - The number of the last packet written.
+    """
+    if isinstance(_metadata_csv, str) or isinstance(_payload_csv, str):
+        # CSV paths are kept open for the whole conversion
+        metadata_out = open_appended(_metadata_csv, METADATA_COLUMNS)
+        payload_out = open_appended(_payload_csv, PAYLOAD_COLUMNS)
+        try:
+            return write_metadata_payload(cap, process, metadata_out, payload_out, stop_timestamp, pckt_no, checkpoint, flows)
+        finally:
+            close_appended(metadata_out, _metadata_csv)
+            close_appended(payload_out, _payload_csv)
+
+    write_metadata = ins.timed("write", get_chunk_writer(_metadata_csv))
+    write_payload = ins.timed("write", get_chunk_writer(_payload_csv))
+    process = ins.timed("decode", process)
+    clean = ins.timed("clean", clean_row)
+
+    metadata_chunk = []  # Buffer to store rows temporarily
+    payload_chunk = []
+    chunk_size = 1000  # Adjust based on memory
+    for pckt in ins.timed_iter("read", cap):
+        # Stop processing if packet timestamp exceeds stop_timestamp
+        if stop_timestamp is not None and pckt.time > stop_timestamp:
+            print(f"Stopping processing as packet timestamp {pckt.time} exceeds stop_timestamp {stop_timestamp}")
+            break
+
+        pckt_no += 1
+        pckt_metadata, pckt_payload = process(pckt, pckt_no)
+        pckt_metadata_clean = clean(pckt_metadata)
+        pckt_payload_clean = clean(pckt_payload)
+
+        if pckt_metadata_clean:
+            metadata_chunk.append(pckt_metadata_clean)
+            payload_chunk.append(pckt_payload_clean)
+            if flows is not None:
+                fl.update_from_metadata(flows, pckt, pckt_metadata_clean)
+        else:
+            pckt_no -= 1
+            ins.count("skipped")
+
+        if len(metadata_chunk) >= chunk_size:
+            # Write chunk to CSV
+            write_metadata(metadata_chunk)
+            metadata_chunk = []  # Clear buffer
+
+        if len(payload_chunk) >= chunk_size:
+            # Write chunk to CSV
+            write_payload(payload_chunk)
+            payload_chunk = []  # Clear buffer
+            if checkpoint is not None:
+                flush_output(_metadata_csv)  # The checkpoint may record the file sizes
+                flush_output(_payload_csv)
+                checkpoint(pckt_no, pckt)
+
+        if pckt_no % 10000 == 0:  # Periodic logging
+            print(f"Processed {pckt_no} packets")
+            ins.progress(pckt_no, pckt)
+
+    # Write remaining packets in the buffer
+    if metadata_chunk:
+        write_metadata(metadata_chunk)
+    if payload_chunk:
+        write_payload(payload_chunk)
+
+    return pckt_no
+
+
+def write_metadata_payload_blocks(blocks, _metadata_csv, _payload_csv, stop_timestamp=None, pckt_no=0, flows=None, start_timestamp=None):
+    """
+    Block-wise version of write_metadata_payload for the "vector" backend: the headers of a
+    whole block of records are decoded at once (see vector_decode) and each output receives
+    one DataFrame per block instead of one dict per packet. The rows are the same.
+
+    Parameters:
+    - blocks: Iterable of vector_decode.RecordBlock, see vector_decode.iter_blocks.
+    - _metadata_csv: Metadata output, a CSV path to append to or a writer (see open_output).
+    - _payload_csv: Payload output, a CSV path to append to or a writer (see open_output).
+    - stop_timestamp: Optional epoch timestamp after which processing stops.
+    - pckt_no: Number of the last packet already written.
+    - flows: Optional flows.FlowTable updated with every packet written.
+    - start_timestamp: Optional epoch timestamp, earlier records are skipped.
+
+    Returns:
+    - The number of the last packet written.
+    """
+    if isinstance(_metadata_csv, str) or isinstance(_payload_csv, str):
+        # CSV paths are kept open for the whole conversion
+        metadata_out = open_appended(_metadata_csv, METADATA_COLUMNS)
+        payload_out = open_appended(_payload_csv, PAYLOAD_COLUMNS)
+        try:
+            return write_metadata_payload_blocks(blocks, metadata_out, payload_out, stop_timestamp, pckt_no, flows, start_timestamp)
+        finally:
+            close_appended(metadata_out, _metadata_csv)
+            close_appended(payload_out, _payload_csv)
+
+    write_metadata = ins.timed("write", get_frame_writer(_metadata_csv))
+    write_payload = ins.timed("write", get_frame_writer(_payload_csv))
+    convert = ins.timed("decode", vd.convert_block)
+
+    for block in ins.timed_iter("read", blocks):
+        times = block.times()
+        if start_timestamp is not None:
+            block = block.select(times >= start_timestamp)
+            times = block.times()
+        late = np.flatnonzero(times > stop_timestamp) if stop_timestamp is not None else []
+        if len(late):
+            block = block.select(slice(0, late[0]))
+
+        metadata, payload, pckt_times = convert(block, pckt_no)
+        write_metadata(metadata)
+        write_payload(payload)
+        pckt_no += len(metadata)
+        if flows is not None:
+            for row in zip(pckt_times.tolist(), metadata["SourceIP"].tolist(), metadata["DestinationIP"].tolist(),
+                           metadata["SourcePort"].tolist(), metadata["DestinationPort"].tolist(),
+                           metadata["Protocol"].tolist(), metadata["Length"].tolist()):
+                flows.update(*row)
+        log_batch_progress(pckt_no, len(metadata), int(block.offset[-1]) if len(block) else None)
+
+        if len(late):
+            print(f"Stopping processing as packet timestamp {times[late[0]]} exceeds stop_timestamp {stop_timestamp}")
+            break
+
+    return pckt_no
+
+
+PLAIN_TYPES = frozenset((int, str, bytes, memoryview, type(None)))  # Values clean_row leaves unchanged
+
+def clean_row(row):
+    # Ensure no None values and force integers where needed (rows of plain values are returned as they are)
+    if PLAIN_TYPES.issuperset(map(type, row.values())):
+        return row
+    return {k: int(v) if isinstance(v, (int, float)) and v is not None else v for k, v in row.items()}
+
+def write_frame_to_csv(frame, output_csv):
+    # Append a DataFrame of packet rows to a CSV, encoding raw payloads like write_chunk_to_csv
+    append_csv_text(tio.format_csv_frame(frame), output_csv)
 
 
 def write_chunk_to_csv(chunk, output_csv):
-    # Write processed chunk to CSV, ensuring integers are written properly
-    df = pd.DataFrame(chunk)
-    numeric_columns = ["Time", "No", "SourcePort", "DestinationPort", "SequenceNumber", "AcknowledgementNumber", "Length"]
-    for col in numeric_columns:
-        if col in df.columns:
-            df[col] = df[col].fillna(0).astype(int)
-    df.to_csv(output_csv, mode='a', index=False, header=False)
\ No newline at end of file
+    # Write processed chunk to CSV, ensuring integers are written properly (see table_io.format_csv_rows)
+    append_csv_text(tio.format_csv_rows(chunk), output_csv)
+
+
+def append_csv_text(text, output_csv):
+    # Append CSV lines to a path or a text file object
+    if isinstance(output_csv, str):
+        with open(output_csv, 'a', newline='', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        output_csv.write(text)
\ No newline at end of file
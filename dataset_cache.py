@@ -0,0 +1,183 @@
+import os
+from collections import OrderedDict
+import pandas as pd
+import table_io as tio
+
+CACHE_BUDGET = 2 * 1024 ** 3  # Bytes of DataFrames kept in memory by the shared cache
+
+# Column types of the known packet table columns when read from CSV; text columns stay strings
+CSV_DTYPES = {
+    "Time": "uint32", "No": "uint32", "SourcePort": "uint16", "DestinationPort": "uint16",
+    "SequenceNumber": "uint32", "AcknowledgementNumber": "uint32", "Protocol": "category",
+    "Length": "uint16", "PacketCount": "uint32",
+}
+
+
+class DatasetCache:
+    """
+    In-process cache of packet tables (CSV, Parquet or PCAP) shared by the analysis modules.
+
+    Tables are keyed on their path and checked against the file's size and mtime on every
+    access, so a rewritten file is read again. Columns are loaded on demand and added to the
+    cached table of the file, so each column of a file is parsed once. The least recently
+    used tables are dropped once the cached DataFrames exceed budget bytes.
+
+    Parameters:
+    - budget: Maximum memory of the cached DataFrames in bytes (0 disables caching).
+    """
+
+    def __init__(self, budget=CACHE_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()  # abspath -> [(size, mtime), frame, complete, bytes]
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path, columns=None):
+        """
+        Return the requested columns (all when None) of a table, reading only what is not cached.
+        """
+        frame = self.cached(path, columns)
+        key = os.path.abspath(path)
+        if frame is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return frame
+
+        self.misses += 1
+        stat = os.stat(path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version or columns is None:
+            frame = read_typed(path, columns)
+            complete = columns is None
+        else:
+            # Read the missing columns only and add them to the cached ones
+            missing = [name for name in columns if name not in entry[1].columns]
+            frame = pd.concat([entry[1], read_typed(path, missing)], axis=1)
+            complete = entry[2]
+        self.store(key, version, frame, complete)
+        return frame[list(frame.columns if columns is None else columns)]
+
+    def store(self, key, version, frame, complete):
+        self.drop(key)
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        if size > self.budget:
+            return  # Larger than the whole budget, returned without caching
+        self.entries[key] = [version, frame, complete, size]
+        self.nbytes += size
+        while self.nbytes > self.budget:
+            self.drop(next(iter(self.entries)))
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[3]
+
+    def cached(self, path, columns=None):
+        # The requested columns of a file if they are cached and up to date, else None
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if entry[0] != (stat.st_size, stat.st_mtime_ns):
+            return None
+        frame = entry[1]
+        if columns is None:
+            return frame[list(frame.columns)] if entry[2] else None
+        return frame[list(columns)] if set(columns) <= set(frame.columns) else None
+
+    def invalidate(self, path=None):
+        """
+        Drop the cached table of a file, or every cached table when path is None.
+        """
+        if path is None:
+            self.entries.clear()
+            self.nbytes = 0
+        else:
+            self.drop(os.path.abspath(path))
+
+    def set_budget(self, budget):
+        self.budget = budget
+        while self.entries and self.nbytes > self.budget:
+            self.drop(next(iter(self.entries)))
+
+
+shared_cache = DatasetCache()  # Used by the analysis modules
+
+
+class Dataset:
+    """
+    Handle on a packet table to pass to the analysis functions instead of a path; the table is
+    loaded once through a DatasetCache and every function reuses it.
+
+    Parameters:
+    - path: Path to a .csv, .parquet or .pcap file.
+    - columns: Optional list of columns to load right away.
+    - cache: DatasetCache holding the table (defaults to the shared cache).
+    """
+
+    def __init__(self, path, columns=None, cache=None):
+        self.path = path
+        self.cache = cache or shared_cache
+        if columns is not None:
+            self.load(columns)
+
+    def load(self, columns=None):
+        return self.cache.load(self.path, columns)
+
+    def __repr__(self):
+        return f"Dataset({self.path!r})"
+
+
+def open_dataset(path, columns=None):
+    """
+    Return a Dataset handle on path using the shared cache, optionally preloading columns.
+    """
+    return Dataset(path, columns)
+
+
+def read_typed(path, columns=None):
+    # Read a table with the known numeric columns of a CSV narrowed to CSV_DTYPES
+    if tio.is_parquet(path) or tio.is_pcap(path):
+        return tio.read_table(path, columns=columns)
+    try:
+        return pd.read_csv(path, usecols=columns, dtype=CSV_DTYPES)
+    except (ValueError, TypeError):  # Missing values in a typed column
+        return pd.read_csv(path, usecols=columns)
+
+
+def load_table(source, columns=None):
+    """
+    Load a packet table for analysis through the shared cache.
+
+    Parameters:
+    - source: Path of a .csv, .parquet or .pcap file, a Dataset or an already loaded DataFrame.
+    - columns: Optional list of columns to load.
+    """
+    if isinstance(source, Dataset):
+        return source.load(columns)
+    if isinstance(source, pd.DataFrame):
+        return source if columns is None else source[list(columns)]
+    return shared_cache.load(source, columns)
+
+
+def iter_table(source, columns=None, chunksize=tio.CHUNK_ROWS, dtype=None):
+    """
+    Chunked counterpart of load_table. Dataset handles, DataFrames and files the shared cache
+    already holds columns of are loaded through the cache and sliced; other files are streamed
+    with table_io.iter_table without being cached, so they are never held in memory whole.
+    """
+    if isinstance(source, Dataset):
+        frame = source.load(columns)
+    elif isinstance(source, pd.DataFrame):
+        frame = source if columns is None else source[list(columns)]
+    elif os.path.abspath(source) in shared_cache.entries:
+        frame = shared_cache.load(source, columns)
+    else:
+        yield from tio.iter_table(source, columns, chunksize, dtype)
+        return
+
+    for start in range(0, len(frame), chunksize):
+        chunk = frame.iloc[start:start + chunksize]
+        yield chunk if dtype is None else chunk.astype(dtype)
@@ -1,9 +1,23 @@
 from scapy.all import PcapReader
+import instrumentation as ins
+import packet_filter as pf
+import raw_pcap as rp
 
-def open_pcap(name):
+def open_pcap(name, backend="scapy", pckt_filter=None):
+    if pckt_filter is not None:
+        # Match the raw records first, Scapy only dissects the selected ones
+        reader = open_pcap(name, "mmap" if backend == "scapy" else backend)
+        return pf.FilteredReader(reader, pckt_filter, to_scapy=backend == "scapy")
     print("Opening PCAP file: " + name)
-    try:
-        cap = PcapReader(name)
-    except NameError:
-        print("Error: current_cap is not defined.")
+    with ins.stage("open_pcap"):
+        try:
+            if backend == "raw":
+                cap = rp.RawPcapReader(name)
+            elif backend in ("mmap", "vector"):
+                cap = rp.MmapPcapReader(name)
+            else:
+                cap = PcapReader(name)
+        except NameError:
+            print("Error: current_cap is not defined.")
+    ins.track(cap)
     return cap
\ No newline at end of file
@@ -0,0 +1,216 @@
+import csv
+import math
+from collections import OrderedDict
+import file_mgmt as fm
+import instrumentation as ins
+from packet_processing import get_processor, process_metadata_payload
+
+IDLE_TIMEOUT = 60  # Seconds without packets after which a flow is finished
+ACTIVE_TIMEOUT = 1800  # Maximum duration of a flow record, longer flows are split
+
+FLOW_COLUMNS = ["FirstSeen", "LastSeen", "Duration", "SourceIP", "SourcePort", "DestinationIP", "DestinationPort",
+                "Protocol", "Packets", "Bytes", "PacketsForward", "BytesForward", "PacketsBackward", "BytesBackward",
+                "MeanIAT", "StdIAT", "MinIAT", "MaxIAT", "EndReason"]
+
+
+class Flow:
+    """
+    Statistics of one bidirectional flow. The source is the endpoint that sent the first packet,
+    "forward" counts the packets it sent and "backward" the ones it received. Inter-arrival
+    times are over both directions and kept with Welford's running mean/variance.
+    """
+    __slots__ = ("src", "sport", "dst", "dport", "proto", "first", "last",
+                 "packets_fwd", "bytes_fwd", "packets_bwd", "bytes_bwd",
+                 "iat_mean", "iat_m2", "iat_min", "iat_max")
+
+    def __init__(self, time, src, sport, dst, dport, proto):
+        self.src = src
+        self.sport = sport
+        self.dst = dst
+        self.dport = dport
+        self.proto = proto
+        self.first = time
+        self.last = time
+        self.packets_fwd = 0
+        self.bytes_fwd = 0
+        self.packets_bwd = 0
+        self.bytes_bwd = 0
+        self.iat_mean = 0.0
+        self.iat_m2 = 0.0
+        self.iat_min = math.inf
+        self.iat_max = 0.0
+
+    def add(self, time, forward, length):
+        if self.packets_fwd or self.packets_bwd:
+            iat = max(time - self.last, 0.0)
+            n = self.packets_fwd + self.packets_bwd  # Number of gaps including this one
+            delta = iat - self.iat_mean
+            self.iat_mean += delta / n
+            self.iat_m2 += delta * (iat - self.iat_mean)
+            self.iat_min = min(self.iat_min, iat)
+            self.iat_max = max(self.iat_max, iat)
+            self.last = max(self.last, time)
+        if forward:
+            self.packets_fwd += 1
+            self.bytes_fwd += length
+        else:
+            self.packets_bwd += 1
+            self.bytes_bwd += length
+
+    @property
+    def packets(self):
+        return self.packets_fwd + self.packets_bwd
+
+    def iat_std(self):
+        # Sample standard deviation, as pandas' std()
+        gaps = self.packets - 1
+        return math.sqrt(self.iat_m2 / (gaps - 1)) if gaps > 1 else 0.0
+
+    def to_row(self, reason):
+        gaps = self.packets > 1
+        return [
+            self.first, self.last, self.last - self.first, self.src, self.sport, self.dst, self.dport,
+            self.proto, self.packets, self.bytes_fwd + self.bytes_bwd, self.packets_fwd, self.bytes_fwd,
+            self.packets_bwd, self.bytes_bwd, self.iat_mean if gaps else 0.0, self.iat_std(),
+            self.iat_min if gaps else 0.0, self.iat_max, reason
+        ]
+
+
+class FlowTable:
+    """
+    Streaming flow tracker keyed on the normalized bidirectional 5-tuple.
+
+    Flows are finished and passed to emit(flow, reason) when no packet was seen for idle_timeout
+    seconds ("idle"), when they last longer than active_timeout ("active", the next packet starts
+    a new record), when max_flows is exceeded ("capacity", least recently seen first) or on
+    flush() ("end"). Memory therefore only depends on the number of concurrent flows.
+
+    Parameters:
+    - emit: Function called as emit(flow, reason) for every finished flow.
+    - idle_timeout: Seconds of inactivity after which a flow is finished.
+    - active_timeout: Maximum duration of a flow record in seconds.
+    - max_flows: Optional maximum number of flows kept in memory.
+    """
+
+    def __init__(self, emit, idle_timeout=IDLE_TIMEOUT, active_timeout=ACTIVE_TIMEOUT, max_flows=None):
+        self.emit = emit
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.flows = OrderedDict()  # key -> Flow, least recently seen first
+        self.next_sweep = -math.inf
+
+    def update(self, time, src, dst, sport, dport, proto, length):
+        """
+        Account one packet, time in epoch seconds and length in bytes.
+        """
+        if (src, sport) <= (dst, dport):
+            key = (src, sport, dst, dport, proto)
+        else:
+            key = (dst, dport, src, sport, proto)
+
+        flows = self.flows
+        flow = flows.get(key)
+        if flow is not None and time - flow.first > self.active_timeout:
+            del flows[key]
+            self.emit(flow, "active")
+            flow = None
+
+        if flow is None:
+            flow = Flow(time, src, sport, dst, dport, proto)
+            flows[key] = flow
+            if self.max_flows is not None and len(flows) > self.max_flows:
+                _, oldest = flows.popitem(last=False)
+                self.emit(oldest, "capacity")
+        else:
+            flows.move_to_end(key)
+        flow.add(time, src == flow.src and sport == flow.sport, length)
+
+        if time >= self.next_sweep:
+            self.expire(time)
+
+    def expire(self, now):
+        """
+        Finish every flow idle for longer than idle_timeout at time now.
+        """
+        flows = self.flows
+        while flows:
+            key, flow = next(iter(flows.items()))
+            if now - flow.last <= self.idle_timeout:
+                break
+            del flows[key]
+            self.emit(flow, "idle")
+        self.next_sweep = now + 1  # Sweep at most once per second of capture time
+
+    def flush(self):
+        """
+        Finish all remaining flows.
+        """
+        while self.flows:
+            _, flow = self.flows.popitem(last=False)
+            self.emit(flow, "end")
+
+
+class FlowCsvWriter:
+    """
+    Append finished flows to a CSV with FLOW_COLUMNS, to be used as FlowTable emit function.
+    """
+
+    def __init__(self, path):
+        self.f = open(path, 'w', newline='')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(FLOW_COLUMNS)
+        self.count = 0
+
+    def __call__(self, flow, reason):
+        self.writer.writerow(flow.to_row(reason))
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+
+
+def update_from_metadata(table, pckt, pckt_metadata):
+    # Feed a packet to a FlowTable using the row produced by a metadata processor
+    table.update(float(pckt.time), pckt_metadata["SourceIP"], pckt_metadata["DestinationIP"],
+                 pckt_metadata["SourcePort"], pckt_metadata["DestinationPort"],
+                 pckt_metadata["Protocol"], pckt_metadata["Length"])
+
+
+@ins.instrumented("create_flow_csv")
+def create_flow_csv(_pcap, flow_csv, backend="raw", idle_timeout=IDLE_TIMEOUT, active_timeout=ACTIVE_TIMEOUT, pckt_filter=None):
+    """
+    Summarize the TCP/UDP flows of a PCAP into a CSV in a single pass.
+
+    Parameters:
+    - _pcap: Input PCAP file path.
+    - flow_csv: Output flow CSV path.
+    - backend: "raw" or "scapy", see packet_processing.get_processor.
+    - idle_timeout: Seconds of inactivity after which a flow is finished.
+    - active_timeout: Maximum duration of a flow record in seconds.
+    - pckt_filter: Optional filter expression selecting the packets, see packet_filter.PacketFilter.
+    """
+    writer = FlowCsvWriter(flow_csv)
+    table = FlowTable(writer, idle_timeout, active_timeout)
+    cap = fm.open_pcap(_pcap, backend, pckt_filter)
+    process = ins.timed("decode", get_processor(process_metadata_payload, backend))
+    update = ins.timed("flows", update_from_metadata)
+
+    pckt_no = 0
+    try:
+        for pckt in ins.timed_iter("read", cap):
+            pckt_metadata, _ = process(pckt, pckt_no + 1)
+            if not pckt_metadata:
+                continue
+            pckt_no += 1
+            update(table, pckt, pckt_metadata)
+
+            if pckt_no % 10000 == 0:  # Periodic logging
+                print(f"Processed {pckt_no} packets, {len(table.flows)} active flows")
+                ins.progress(pckt_no, pckt)
+        table.flush()
+    finally:
+        cap.close()
+        writer.close()
+
+    print(f"Finished writing {writer.count} flows to {flow_csv}")
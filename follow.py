@@ -0,0 +1,219 @@
+import argparse
+import hashlib
+import os
+import time
+import associations as asc
+import batch
+import data_model as dm
+import instrumentation as ins
+import metadata_index as mi
+import packet_filter as pf
+import packet_processing as pp
+import raw_pcap as rp
+import summary as sm
+import table_io as tio
+
+FOLLOW_STATE_DIR = ".follow_state"
+FOLLOW_INTERVAL = 5.0  # Seconds between two updates of a followed capture
+HEAD_BYTES = 64 * 1024  # Bytes at the start of a capture whose digest tells an appended capture from a new one
+AGGREGATE_ROWS = 1000000  # Metadata rows added to the aggregates at a time
+
+# Aggregate kind -> (metadata columns it needs, function adding a DataFrame of new rows to its CSV)
+AGGREGATES = {
+    "associations": (asc.ASSOCIATION_COLUMNS, asc.update_association_csv),
+    "pairs": (sm.SUMMARY_COLUMNS, sm.update_pair_csv),
+}
+
+
+@ins.instrumented("follow_update")
+def update(pcap, metadata_csv, payload_csv, state_dir=FOLLOW_STATE_DIR, association_csv=None, pair_csv=None,
+           index=True, checkpoint_every=batch.CHECKPOINT_EVERY, pckt_filter=None):
+    """
+    Convert the records appended to a growing capture since the previous update, append their rows
+    to the metadata and payload CSVs and add them to the aggregates (raw backend).
+
+    The state file of the capture keeps the byte offset after the last record converted, the last
+    packet number and the sizes of the outputs, so an update only reads the new records. A record
+    still being written (truncated) is left for the next update. The conversion starts over, with
+    new outputs, when the first bytes of the capture changed or it shrank (a new capture under the
+    same name), when an output is missing or shorter than recorded, or with another filter. An
+    interrupted update is cut back to its last checkpoint and continued by the next one.
+
+    Parameters:
+    - pcap: Input PCAP file path (libpcap), possibly still being written.
+    - metadata_csv: Output metadata CSV path, created by the first update.
+    - payload_csv: Output payload CSV path, created by the first update.
+    - state_dir: Directory of the follow state files.
+    - association_csv: Optional association CSV (see associations.update_association_csv) kept up to date.
+    - pair_csv: Optional pair CSV (see summary.update_pair_csv) kept up to date, the input of
+      summary.generate_pair_summary_tables.
+    - index: Keep the sidecar index of the metadata CSV up to date (see metadata_index).
+    - checkpoint_every: Packets converted between two saved checkpoints.
+    - pckt_filter: Optional filter expression, only matching packets are converted (see packet_filter.PacketFilter).
+
+    Returns:
+    - The number of packets added to the outputs.
+    """
+    size = os.path.getsize(pcap)
+    if size < rp.GLOBAL_HEADER_LEN:
+        print(f"Waiting for the header of {pcap}")
+        return 0
+
+    os.makedirs(state_dir, exist_ok=True)
+    path = batch.state_path(state_dir, pcap)
+    expression = pf.filter_expression(pckt_filter)
+    state = batch.load_state(path)
+    if same_capture(state, pcap, size, metadata_csv, payload_csv, expression):
+        # Drop the rows written after the last checkpoint of an interrupted update
+        if os.path.getsize(metadata_csv) > state["metadata_size"]:
+            os.truncate(metadata_csv, state["metadata_size"])
+        if os.path.getsize(payload_csv) > state["payload_size"]:
+            os.truncate(payload_csv, state["payload_size"])
+    else:
+        print(f"Following {pcap} from its first record")
+        dm.write_csv_header(metadata_csv, dm.METADATA_COLUMNS)
+        dm.write_csv_header(payload_csv, dm.PAYLOAD_COLUMNS)
+        head_bytes = min(size, HEAD_BYTES)
+        state = {
+            "head_bytes": head_bytes, "head": head_digest(pcap, head_bytes),
+            "metadata_csv": metadata_csv, "payload_csv": payload_csv, "filter": expression,
+            "offset": rp.GLOBAL_HEADER_LEN, "pckt_no": 0,
+            "metadata_size": os.path.getsize(metadata_csv), "payload_size": os.path.getsize(payload_csv),
+            "aggregated": {},  # aggregate CSV -> size of the metadata CSV it covers
+        }
+        batch.save_state(path, state)
+
+    first = state["pckt_no"]
+    if size > state["offset"]:
+        convert_appended(pcap, metadata_csv, payload_csv, state, path, index, checkpoint_every, expression)
+
+    aggregates = [("associations", association_csv), ("pairs", pair_csv)]
+    update_aggregates(state, path, metadata_csv, [(kind, csv) for kind, csv in aggregates if csv is not None])
+    print(f"{pcap}: {state['pckt_no'] - first} new packets, {state['pckt_no']} in total")
+    return state["pckt_no"] - first
+
+
+def follow(pcap, metadata_csv, payload_csv, interval=FOLLOW_INTERVAL, idle_timeout=None, **kwargs):
+    """
+    Keep the outputs of a capture that is still being written up to date: update every interval
+    seconds until no record was added for idle_timeout seconds (forever when None, stop with Ctrl-C).
+    The other arguments are those of update.
+
+    Returns:
+    - The number of packets added to the outputs.
+    """
+    added = 0
+    last_growth = time.monotonic()
+    try:
+        while True:
+            new = update(pcap, metadata_csv, payload_csv, **kwargs)
+            added += new
+            if new:
+                last_growth = time.monotonic()
+            elif idle_timeout is not None and time.monotonic() - last_growth >= idle_timeout:
+                print(f"No new packets in {pcap} for {idle_timeout}s, stopping")
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print(f"Stopped following {pcap}")
+    return added
+
+
+def same_capture(state, pcap, size, metadata_csv, payload_csv, pckt_filter):
+    # Whether state describes the conversion of the beginning of pcap into these outputs
+    return (
+        state is not None and "head" in state and size >= state["offset"] and size >= state["head_bytes"]
+        and state["metadata_csv"] == metadata_csv and state["payload_csv"] == payload_csv and state["filter"] == pckt_filter
+        and os.path.isfile(metadata_csv) and os.path.isfile(payload_csv)
+        and os.path.getsize(metadata_csv) >= state["metadata_size"] and os.path.getsize(payload_csv) >= state["payload_size"]
+        and head_digest(pcap, state["head_bytes"]) == state["head"]
+    )
+
+
+def head_digest(pcap, length):
+    with open(pcap, 'rb') as f:
+        return hashlib.sha1(f.read(length)).hexdigest()
+
+
+def convert_appended(pcap, metadata_csv, payload_csv, state, path, index, checkpoint_every, pckt_filter):
+    # Append the rows of the records after state["offset"] to the outputs and save the new state
+    metadata_out = tio.CsvChunkWriter(metadata_csv, dm.METADATA_COLUMNS, append=True)
+    if index:
+        metadata_out = dm.IndexedCsvWriter(metadata_out, mi.open_indexer(metadata_csv))
+    payload_out = tio.CsvChunkWriter(payload_csv, dm.PAYLOAD_COLUMNS, append=True)
+    position = [state["offset"]]  # Offset after the last complete record read
+
+    def checkpoint(pckt_no, pckt):
+        # Called once the rows up to pckt are in both outputs
+        if pckt_no - state["pckt_no"] < checkpoint_every:
+            return
+        state.update(
+            offset=pckt.offset + rp.RECORD_HEADER_LEN + pckt.caplen, pckt_no=pckt_no,
+            metadata_size=os.path.getsize(metadata_csv), payload_size=os.path.getsize(payload_csv)
+        )
+        batch.save_state(path, state)
+
+    try:
+        with rp.RawPcapReader(pcap) as reader:
+            reader.seek(state["offset"])
+            ins.track(reader)
+            pckts = pf.filter_packets(read_records(reader, position), pckt_filter)
+            pckt_no = dm.write_metadata_payload(pckts, pp.process_raw_metadata_payload, metadata_out, payload_out,
+                                                pckt_no=state["pckt_no"], checkpoint=checkpoint)
+    finally:
+        dm.close_output(metadata_out)
+        dm.close_output(payload_out)
+
+    state.update(
+        offset=position[0], pckt_no=pckt_no,
+        metadata_size=os.path.getsize(metadata_csv), payload_size=os.path.getsize(payload_csv)
+    )
+    batch.save_state(path, state)
+
+
+def read_records(reader, position):
+    # Records of reader, keeping the offset after the last one in position[0]
+    for pckt in reader:
+        position[0] = pckt.offset + rp.RECORD_HEADER_LEN + pckt.caplen
+        yield pckt
+
+
+def update_aggregates(state, path, metadata_csv, aggregates):
+    """
+    Add the metadata rows an aggregate CSV does not cover yet to it. An aggregate CSV that is
+    missing or not covered by the state (new aggregate, conversion started over) is built again
+    from the first row.
+    """
+    covered = state["aggregated"]
+    for kind, aggregate_csv in aggregates:
+        start = covered.get(aggregate_csv) if os.path.isfile(aggregate_csv) else None
+        if start is None:
+            if os.path.isfile(aggregate_csv):
+                os.remove(aggregate_csv)
+            start = len(tio.format_csv_header(dm.METADATA_COLUMNS).encode())
+        columns, add_rows = AGGREGATES[kind]
+        for end, rows in mi.read_rows(metadata_csv, start, state["metadata_size"], columns, AGGREGATE_ROWS):
+            add_rows(aggregate_csv, rows)
+            covered[aggregate_csv] = end
+            batch.save_state(path, state)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the metadata/payload CSVs of a growing capture up to date.")
+    parser.add_argument("pcap")
+    parser.add_argument("metadata_csv")
+    parser.add_argument("payload_csv")
+    parser.add_argument("--associations", help="Association CSV updated with the new rows")
+    parser.add_argument("--pairs", help="Pair CSV updated with the new rows (input of the session summaries)")
+    parser.add_argument("--state-dir", default=FOLLOW_STATE_DIR)
+    parser.add_argument("--interval", type=float, default=FOLLOW_INTERVAL, help="Seconds between two updates")
+    parser.add_argument("--idle-timeout", type=float, help="Stop after this many seconds without new packets")
+    parser.add_argument("--filter", help="Packet filter expression")
+    parser.add_argument("--once", action="store_true", help="Run a single update")
+    args = parser.parse_args()
+
+    options = dict(state_dir=args.state_dir, association_csv=args.associations, pair_csv=args.pairs, pckt_filter=args.filter)
+    if args.once:
+        update(args.pcap, args.metadata_csv, args.payload_csv, **options)
+    else:
+        follow(args.pcap, args.metadata_csv, args.payload_csv, args.interval, args.idle_timeout, **options)
@@ -0,0 +1,357 @@
+import cProfile
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+import raw_pcap as rp
+
+REPORT_INTERVAL = 10.0  # Seconds between two progress reports of a run
+PROFILE_DIR = "profiles/"
+SAMPLE_INTERVAL = 0.005  # Seconds between two stack samples of the sampling profiler
+ENV_VARIABLE = "PCAP_INSTRUMENT"  # "1", "sampling" or "cprofile" enables instrumentation at import
+
+
+class State:
+    # Instrumentation settings and the measurements of the current run
+    enabled = False
+    report_interval = REPORT_INTERVAL
+    profile = None
+    profile_dir = PROFILE_DIR
+    run = None  # Name of the current run, None outside of runs
+    depth = 0  # Nesting of instrumented functions, only the outermost one is a run
+    stages = {}  # stage -> [seconds, calls]
+    counters = Counter()
+    source_bytes = None
+    reader = None
+    profiler = None
+    start_position = 0
+    start = 0.0
+    last_report = 0.0
+    last_run = None  # Summary of the last finished run (see summary)
+
+
+state = State()
+
+
+def enable(report_interval=REPORT_INTERVAL, profile=None, profile_dir=PROFILE_DIR):
+    """
+    Turn on the instrumentation of the conversion and anonymization functions.
+
+    Every instrumented function call becomes a run: the time spent in each stage (open_pcap,
+    read, decode, clean, write, anonymize...) and the counters are accumulated, progress with
+    rate and ETA is printed every report_interval seconds and a stage breakdown at the end.
+    Instrumentation is set up when a run starts; while disabled the hot loops run the
+    uninstrumented functions.
+
+    Parameters:
+    - report_interval: Seconds between two progress reports (None for the final report only).
+    - profile: Optional profiler run alongside: "sampling" (stack samples every SAMPLE_INTERVAL
+      seconds, written as folded stacks for flame graphs) or "cprofile" (pstats file).
+    - profile_dir: Directory of the profile files, one per run.
+    """
+    if profile not in (None, "sampling", "cprofile"):
+        raise ValueError(f"Unknown profiler: {profile}")
+    state.enabled = True
+    state.report_interval = report_interval
+    state.profile = profile
+    state.profile_dir = profile_dir
+
+
+def disable():
+    state.enabled = False
+
+
+def is_enabled():
+    return state.enabled
+
+
+def instrumented(name):
+    """
+    Decorator making every call of a conversion function a run named name. The first
+    positional argument (or the first item of a worker task tuple), when it is a path, gives
+    the input size used for the ETA. Costs a single flag check per call while disabled.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not state.enabled or state.depth:
+                return function(*args, **kwargs)
+            source = args[0][0] if args and isinstance(args[0], tuple) else args[0] if args else None
+            source = source if isinstance(source, str) else None
+            begin_run(name, source)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end_run()
+        return wrapper
+    return decorate
+
+
+def begin_run(name, source=None):
+    state.run = name
+    state.depth = 1
+    state.stages = {}
+    state.counters = Counter()
+    state.source_bytes = os.path.getsize(source) if source and os.path.isfile(source) else None
+    state.reader = None
+    state.start_position = 0
+    state.start = state.last_report = time.perf_counter()
+    state.profiler = start_profiler(state.profile)
+
+
+def end_run():
+    profile_path = stop_profiler(state.profiler, state.run)
+    state.last_run = summary()
+    state.depth = 0
+    state.run = None
+    print_summary(state.last_run)
+    if profile_path:
+        print(f"Profile saved to {profile_path}")
+
+
+def timed(stage, function):
+    """
+    Return function wrapped to add its time and calls to stage, or function itself when no
+    instrumented run is active. Meant to wrap the per-packet functions once, before the loop.
+    """
+    if state.run is None:
+        return function
+    cell = state.stages.setdefault(stage, [0.0, 0])
+    clock = time.perf_counter
+
+    def wrapper(*args):
+        start = clock()
+        try:
+            return function(*args)
+        finally:
+            cell[0] += clock() - start
+            cell[1] += 1
+    return wrapper
+
+
+def timed_iter(stage, iterable):
+    """
+    Return iterable with the time spent producing each item added to stage (the iterable
+    itself when no instrumented run is active).
+    """
+    if state.run is None:
+        return iterable
+    return _timed_iter(state.stages.setdefault(stage, [0.0, 0]), iterable)
+
+
+def _timed_iter(cell, iterable):
+    clock = time.perf_counter
+    iterator = iter(iterable)
+    while True:
+        start = clock()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            cell[0] += clock() - start
+            return
+        cell[0] += clock() - start
+        cell[1] += 1
+        yield item
+
+
+def stage(name):
+    """
+    Context manager adding the time of its block to stage name (no-op outside of runs).
+    """
+    if state.run is None:
+        return nullcontext()
+    return _Stage(state.stages.setdefault(name, [0.0, 0]))
+
+
+class _Stage:
+    __slots__ = ("cell", "start")
+
+    def __init__(self, cell):
+        self.cell = cell
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cell[0] += time.perf_counter() - self.start
+        self.cell[1] += 1
+
+
+def count(name, n=1):
+    if state.run is not None:
+        state.counters[name] += n
+
+
+def track(reader):
+    """
+    Register the reader of the current run, its file position gives the progress of packets
+    that do not carry their offset (Scapy packets) and its file the input size.
+    """
+    if state.run is None:
+        return
+    state.reader = reader
+    state.start_position = reader_position(reader) or 0
+    name = getattr(reader, "name", None) or getattr(reader, "filename", None)
+    if state.source_bytes is None and isinstance(name, str) and os.path.isfile(name):
+        state.source_bytes = os.path.getsize(name)
+
+
+def reader_position(reader):
+    reader = getattr(reader, "reader", reader)  # packet_filter.FilteredReader
+    f = getattr(reader, "f", None)
+    try:
+        return f.tell() if f is not None else None
+    except (OSError, ValueError):
+        return None
+
+
+def progress(pckt_no, pckt=None):
+    """
+    Print the progress of the current run (packets, share of the input, rates, ETA and stage
+    shares) if report_interval seconds passed since the last report. Called from the periodic
+    logging of the conversion loops.
+
+    Parameters:
+    - pckt_no: Packets processed so far.
+    - pckt: Last packet processed (raw_pcap.RawPacket gives its offset) or a file offset.
+    """
+    if state.run is None or state.report_interval is None:
+        return
+    now = time.perf_counter()
+    if now - state.last_report < state.report_interval:
+        return
+    state.last_report = now
+    elapsed = now - state.start
+
+    if isinstance(pckt, int):
+        position = pckt
+    elif isinstance(pckt, rp.RawPacket):
+        position = pckt.offset
+    else:
+        position = reader_position(state.reader)
+
+    line = f"[{state.run}] {pckt_no} packets, {pckt_no / elapsed:.0f} pkts/s"
+    if position is not None:
+        done = position - state.start_position
+        line += f", {done / 1e6 / elapsed:.1f} MB/s"
+        if state.source_bytes and done > 0:
+            remaining = max(state.source_bytes - position, 0) * elapsed / done
+            line += f", {100 * position / state.source_bytes:.1f}% of input, ETA {format_seconds(remaining)}"
+    shares = stage_shares(elapsed)
+    if shares:
+        line += " | " + " ".join(f"{name} {share:.0%}" for name, _, share, _ in shares)
+    print(line)
+
+
+def stage_shares(elapsed):
+    # (stage, seconds, share of elapsed, calls), the slowest stage first
+    stages = sorted(state.stages.items(), key=lambda item: -item[1][0])
+    return [(name, seconds, seconds / elapsed if elapsed else 0.0, calls) for name, (seconds, calls) in stages]
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def summary():
+    """
+    Return the measurements of the current (or just finished) run as a dict.
+    """
+    elapsed = time.perf_counter() - state.start
+    return {
+        "run": state.run, "seconds": elapsed, "input_bytes": state.source_bytes,
+        "stages": {name: {"seconds": seconds, "share": share, "calls": calls}
+                   for name, seconds, share, calls in stage_shares(elapsed)},
+        "counters": dict(state.counters),
+    }
+
+
+def print_summary(run):
+    print(f"[{run['run']}] finished in {run['seconds']:.2f}s")
+    measured = 0.0
+    for name, values in run["stages"].items():
+        measured += values["seconds"]
+        print(f"  {name:<12} {values['seconds']:9.3f}s {values['share']:6.1%} {values['calls']:>10} calls")
+    print(f"  {'other':<12} {max(run['seconds'] - measured, 0):9.3f}s")
+    for name, value in run["counters"].items():
+        print(f"  {name}: {value}")
+
+
+def start_profiler(kind):
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if kind == "sampling":
+        profiler = SamplingProfiler()
+        profiler.start()
+        return profiler
+    return None
+
+
+def stop_profiler(profiler, name):
+    # Stop the profiler of a run and write its profile, returns the file path
+    if profiler is None:
+        return None
+    os.makedirs(state.profile_dir, exist_ok=True)
+    base = os.path.join(state.profile_dir, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}")
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(base + ".prof")
+        return base + ".prof"
+    profiler.stop()
+    profiler.save(base + ".folded")
+    return base + ".folded"
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of a thread at a fixed interval from a background thread. The samples
+    are counted per call stack and saved as folded stacks ("a;b;c count" lines), the input of
+    flamegraph.pl and speedscope.
+
+    Parameters:
+    - interval: Seconds between two samples.
+    - thread_id: Thread to sample (defaults to the calling thread).
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for stack, samples in self.samples.most_common():
+                f.write(f"{stack} {samples}\n")
+
+
+_profile = os.environ.get(ENV_VARIABLE)
+if _profile in ("1", "sampling", "cprofile"):
+    # Also reaches the worker processes of the parallel and batch conversions (other values, such as 0, leave it off)
+    enable(profile=None if _profile == "1" else _profile)
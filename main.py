@@ -2,18 +2,35 @@ from port_extraction import *
 from pcap_processing import *
 from data_model import *
 import sys
+from batch import *
 import constants as c
 
+CAPTURES = [
+    ("PCAP/anonymized_28_06_1000-1330.pcap", "anon/anon_metadata_28_06_1000-1330.csv", "anon/anon_payload_28_06_1000-1330.csv"),
+    ("PCAP/anonymized_28_06_1330-1830.pcap", "anon/anon_metadata_28_06_1330-1830.csv", "anon/anon_payload_28_06_1330-1830.csv"),
+    ("PCAP/anonymized_29_06_1000-1330.pcap", "anon/anon_metadata_29_06_1000-1330.csv", "anon/anon_payload_29_06_1000-1330.csv"),
+    ("PCAP/anonymized_29_06_1330-1830.pcap", "anon/anon_metadata_29_06_1330-1830.csv", "anon/anon_payload_29_06_1330-1830.csv"),
+]
+BATCH_STATE_DIR = "anon/.batch_state"  # Per-capture progress, lets an interrupted run resume
+
 def main():
     print("Hello World!")
     print("Pcap directory: " + c.PCAP_DIR)
     print("Scapy Version: " + str(scapy.__version__))
     print("Python Version: " + str(sys.version))
 
-    create_data_payload_csv("PCAP/anonymized_28_06_1000-1330.pcap", "anon/anon_metadata_28_06_1000-1330.csv", "anon/anon_payload_28_06_1000-1330.csv")
-    create_data_payload_csv("PCAP/anonymized_28_06_1330-1830.pcap", "anon/anon_metadata_28_06_1330-1830.csv", "anon/anon_payload_28_06_1330-1830.csv")
-    create_data_payload_csv("PCAP/anonymized_29_06_1000-1330.pcap", "anon/anon_metadata_29_06_1000-1330.csv", "anon/anon_payload_29_06_1000-1330.csv")
-    create_data_payload_csv("PCAP/anonymized_29_06_1330-1830.pcap", "anon/anon_metadata_29_06_1330-1830.csv", "anon/anon_payload_29_06_1330-1830.csv")
+    # python main.py [<manifest.csv | "glob pattern"> [output_dir]], options such as -i are not sources
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("-")]
+    if args:
+        source = args[0]
+        jobs = read_manifest(source) if source.endswith(".csv") else jobs_from_glob(source, args[1] if len(args) > 1 else "anon")
+        if not jobs:
+            print(f"Error: no captures found for {source}")
+            sys.exit(1)
+    else:
+        jobs = CAPTURES
+
+    run_batch(jobs, BATCH_STATE_DIR)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,279 @@
+import hashlib
+import io
+import itertools
+import json
+import os
+import pandas as pd
+import dataset_cache as dc
+import table_io as tio
+
+BLOCK_ROWS = 10000  # Rows per index block
+INDEX_SUFFIX = ".idx.json"
+INDEX_COLUMNS = ["Time", "SourceIP", "DestinationIP", "SourcePort", "DestinationPort"]
+DIGEST_BYTES = 64 * 1024  # Bytes at the start and end of the CSV whose digests tell a rewritten CSV of the same size
+
+_loaded = {}  # csv path -> (size, mtime, index), indexes already read in this session
+
+
+class MetadataIndexer:
+    """
+    Build the sidecar index of a packet CSV while its rows are written.
+
+    The rows are grouped into blocks of about block_rows consecutive rows. For every block the
+    index keeps its byte range in the CSV, its row count and its time range, and for every IP and
+    port (source or destination) the list of blocks it appears in.
+
+    Parameters:
+    - csv_path: Path of the CSV being indexed.
+    - columns: Column names of the CSV header.
+    - block_rows: Rows per index block.
+    """
+
+    def __init__(self, csv_path, columns, block_rows=BLOCK_ROWS):
+        self.csv_path = csv_path
+        self.columns = list(columns)
+        self.block_rows = block_rows
+        self.blocks = []  # [start, end, rows, min time, max time]
+        self.ips = {}  # ip -> block ids
+        self.ports = {}  # port -> block ids
+
+    def add(self, start, end, times, source_ips, destination_ips, source_ports, destination_ports):
+        """
+        Index the rows written between byte offsets start and end of the CSV.
+        """
+        times = list(times)
+        if not times:
+            return
+        block = self.blocks[-1] if self.blocks else None
+        if block is None or block[2] >= self.block_rows or block[1] != start:
+            block = [start, end, 0, min(times), max(times)]
+            self.blocks.append(block)
+        block[1] = end
+        block[2] += len(times)
+        block[3] = min(block[3], min(times))
+        block[4] = max(block[4], max(times))
+
+        block_id = len(self.blocks) - 1
+        for postings, values in ((self.ips, itertools.chain(source_ips, destination_ips)),
+                                 (self.ports, itertools.chain(source_ports, destination_ports))):
+            for value in set(values):
+                if value is None or value != value or value == "":  # Missing values (None, NaN, "")
+                    continue
+                ids = postings.setdefault(value, [])
+                if not ids or ids[-1] != block_id:
+                    ids.append(block_id)
+
+    def add_rows(self, start, end, rows):
+        """
+        Index a chunk of metadata dicts (as produced by packet_processing) written between start and end.
+        """
+        self.add(start, end, [row["Time"] for row in rows],
+                 [row["SourceIP"] for row in rows], [row["DestinationIP"] for row in rows],
+                 [row["SourcePort"] for row in rows], [row["DestinationPort"] for row in rows])
+
+    def add_frame(self, start, end, frame):
+        """
+        Index a DataFrame of metadata rows written between start and end.
+        """
+        self.add(start, end, frame["Time"].tolist(), frame["SourceIP"].tolist(), frame["DestinationIP"].tolist(),
+                 frame["SourcePort"].tolist(), frame["DestinationPort"].tolist())
+
+    def save(self):
+        size = os.path.getsize(self.csv_path)
+        index = {
+            "columns": self.columns,
+            "size": size,
+            "digest": csv_digest(self.csv_path, size),
+            "blocks": self.blocks,
+            "ips": self.ips,
+            "ports": {str(port): ids for port, ids in self.ports.items()},
+        }
+        with open(index_path(self.csv_path), 'w') as f:
+            json.dump(index, f)
+        _loaded.pop(self.csv_path, None)
+        return index
+
+    def close(self):
+        self.save()
+
+
+def index_path(csv_path):
+    return csv_path + INDEX_SUFFIX
+
+
+def csv_digest(csv_path, size):
+    # Digests of the first and last DIGEST_BYTES of the CSV
+    with open(csv_path, 'rb') as f:
+        head = hashlib.sha1(f.read(min(size, DIGEST_BYTES))).hexdigest()
+        f.seek(size - min(size, DIGEST_BYTES))
+        tail = hashlib.sha1(f.read(min(size, DIGEST_BYTES))).hexdigest()
+    return {"head": head, "tail": tail}
+
+
+def build_index(csv_path, block_rows=BLOCK_ROWS):
+    """
+    Build (or rebuild) the sidecar index of an existing packet CSV in one pass.
+
+    Parameters:
+    - csv_path: Path of a CSV with Time, SourceIP, DestinationIP, SourcePort and DestinationPort columns.
+    - block_rows: Rows per index block.
+
+    Returns:
+    - The index dict, also saved next to the CSV as <csv_path>.idx.json.
+    """
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        indexer = MetadataIndexer(csv_path, header.decode().strip().split(','), block_rows)
+        offset = len(header)
+        while True:
+            data = b"".join(itertools.islice(f, block_rows))
+            if not data:
+                break
+            df = pd.read_csv(io.BytesIO(data), header=None, names=indexer.columns, usecols=INDEX_COLUMNS)
+            indexer.add(offset, offset + len(data), df["Time"].tolist(), df["SourceIP"].tolist(), df["DestinationIP"].tolist(),
+                        df["SourcePort"].tolist(), df["DestinationPort"].tolist())
+            offset += len(data)
+    print(f"Indexed {sum(block[2] for block in indexer.blocks)} rows of {csv_path} in {len(indexer.blocks)} blocks")
+    return indexer.save()
+
+
+def load_index(csv_path):
+    """
+    Return the index of a packet CSV, building it when it is missing or does not match the CSV
+    (size and digests of its first and last bytes).
+    Indexes are kept in memory for the following queries of the session.
+    """
+    stat = os.stat(csv_path)
+    cached = _loaded.get(csv_path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime):
+        return cached[2]
+
+    index = None
+    try:
+        with open(index_path(csv_path)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if index is None or index["size"] != stat.st_size or index.get("digest") != csv_digest(csv_path, stat.st_size):
+        index = build_index(csv_path)
+
+    index["ports"] = {int(port): ids for port, ids in index["ports"].items()}
+    _loaded[csv_path] = (stat.st_size, stat.st_mtime, index)
+    return index
+
+
+def open_indexer(csv_path, block_rows=BLOCK_ROWS):
+    """
+    Return a MetadataIndexer holding the current index of a packet CSV, to index the rows appended
+    to it next (the last block is continued while it has less than block_rows rows).
+    """
+    index = load_index(csv_path)
+    indexer = MetadataIndexer(csv_path, index["columns"], block_rows)
+    indexer.blocks = [list(block) for block in index["blocks"]]
+    indexer.ips = {ip: list(ids) for ip, ids in index["ips"].items()}
+    indexer.ports = {port: list(ids) for port, ids in index["ports"].items()}
+    return indexer
+
+
+def candidate_blocks(index, start_time=None, end_time=None, ips=None, ports=None):
+    # Ids of the blocks that may hold rows in the time window with one of the IPs and ports
+    blocks = index["blocks"]
+    selected = {
+        i for i, (_, _, _, tmin, tmax) in enumerate(blocks)
+        if (start_time is None or tmax >= start_time) and (end_time is None or tmin <= end_time)
+    }
+    for postings, values in ((index["ips"], ips), (index["ports"], ports)):
+        if values is not None:
+            selected &= {i for value in values for i in postings.get(value, [])}
+    return sorted(selected)
+
+
+def read_blocks(csv_path, index, block_ids, columns=None):
+    """
+    Read the rows of the given index blocks, reading consecutive blocks with a single read.
+    """
+    blocks = index["blocks"]
+    frames = []
+    with open(csv_path, 'rb') as f:
+        for _, run in itertools.groupby(enumerate(block_ids), key=lambda item: item[1] - item[0]):
+            run = [block_id for _, block_id in run]
+            start, end = blocks[run[0]][0], blocks[run[-1]][1]
+            f.seek(start)
+            frames.append(pd.read_csv(io.BytesIO(f.read(end - start)), header=None, names=index["columns"], usecols=columns))
+    if not frames:
+        return pd.DataFrame(columns=[name for name in index["columns"] if columns is None or name in columns])
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_rows(csv_path, start, end=None, columns=None, chunk_rows=BLOCK_ROWS):
+    """
+    Read the rows of a packet CSV between byte offsets start and end (line boundaries, end of
+    file when None), e.g. the rows appended since a known size.
+
+    Yields:
+    - (offset, rows): Offset after the rows and a DataFrame of at most chunk_rows rows.
+    """
+    with open(csv_path, 'rb') as f:
+        names = f.readline().decode().strip().split(',')
+        f.seek(start)
+        offset = start
+        while end is None or offset < end:
+            data = b"".join(itertools.islice(f, chunk_rows))
+            if end is not None:
+                data = data[:end - offset]
+            if not data:
+                break
+            offset += len(data)
+            yield offset, pd.read_csv(io.BytesIO(data), header=None, names=names, usecols=columns)
+
+
+def query(csv_path, start_time=None, end_time=None, ips=None, ports=None, columns=None):
+    """
+    Load the rows of a packet CSV (Parquet or PCAP) file within a time window, optionally limited to
+    rows with one of the IPs (as source or destination) and one of the ports (as source or destination).
+
+    Tables already in memory (a dataset_cache.Dataset, a DataFrame or a file in the shared cache)
+    are filtered directly. CSV files are read through their sidecar index, only the blocks that
+    can hold matching rows are read. Parquet files are read with a filter on Time, PCAPs are
+    decoded (see vector_decode).
+
+    Parameters:
+    - csv_path: Path to the CSV (Parquet or PCAP) file, or a dataset_cache.Dataset.
+    - start_time: Optional start of the time window (epoch seconds, inclusive).
+    - end_time: Optional end of the time window (epoch seconds, inclusive).
+    - ips: Optional list of IPs.
+    - ports: Optional list of ports.
+    - columns: Optional list of columns to return.
+
+    Returns:
+    - DataFrame with the matching rows, in file order.
+    """
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + INDEX_COLUMNS))
+    if isinstance(csv_path, (dc.Dataset, pd.DataFrame)):
+        df = dc.load_table(csv_path, read_columns)
+    elif dc.shared_cache.cached(csv_path, read_columns) is not None:
+        df = dc.shared_cache.load(csv_path, read_columns)
+    elif tio.is_parquet(csv_path):
+        filters = []
+        if start_time is not None:
+            filters.append(("Time", ">=", start_time))
+        if end_time is not None:
+            filters.append(("Time", "<=", end_time))
+        df = tio.read_table(csv_path, columns=read_columns, filters=filters or None)
+    elif tio.is_pcap(csv_path):
+        df = tio.read_table(csv_path, columns=read_columns)
+    else:
+        index = load_index(csv_path)
+        df = read_blocks(csv_path, index, candidate_blocks(index, start_time, end_time, ips, ports), read_columns)
+
+    mask = pd.Series(True, index=df.index)
+    if start_time is not None:
+        mask &= df["Time"] >= start_time
+    if end_time is not None:
+        mask &= df["Time"] <= end_time
+    if ips is not None:
+        mask &= df["SourceIP"].isin(ips) | df["DestinationIP"].isin(ips)
+    if ports is not None:
+        mask &= df["SourcePort"].isin(ports) | df["DestinationPort"].isin(ports)
+    df = df[mask].reset_index(drop=True)
+    return df if columns is None else df[list(columns)]
@@ -0,0 +1,342 @@
+import ipaddress
+import math
+import re
+from functools import lru_cache
+import numpy as np
+import raw_pcap as rp
+import vector_decode as vd
+
+PROTOCOLS = {"icmp": 1, "tcp": 6, "udp": 17}
+TIME_OPERATORS = (">=", "<=", "==", "!=", ">", "<")
+
+_token = re.compile(r"\s*(\(|\)|&&|\|\||!=|!|>=|<=|==|>|<|[^\s()!<>=&|]+)")
+
+# Header fields of a record, read straight from its bytes (-1 when the record has no such field)
+_FIELDS_SOURCE = """
+    off = ipv4_offset(data, linktype)
+    if off is not None and off >= 0 and len(data) >= off + 20 and data[off] >> 4 == 4:
+        ip = True
+        proto = data[off + 9]
+        src = (data[off + 12] << 24) | (data[off + 13] << 16) | (data[off + 14] << 8) | data[off + 15]
+        dst = (data[off + 16] << 24) | (data[off + 17] << 16) | (data[off + 18] << 8) | data[off + 19]
+        l4 = off + ((data[off] & 0x0F) << 2)
+        if proto in (6, 17) and not ((data[off + 6] << 8) | data[off + 7]) & 0x1FFF and len(data) >= l4 + 4:
+            sport = (data[l4] << 8) | data[l4 + 1]
+            dport = (data[l4 + 2] << 8) | data[l4 + 3]
+        else:
+            sport = dport = -1
+    else:
+        ip = False
+        proto = src = dst = sport = dport = -1
+"""
+
+
+class PacketFilter:
+    """
+    A filter expression compiled into predicates on undecoded capture records.
+
+    The expression language is a subset of BPF/tcpdump over the IPv4 headers:
+
+    - host A.B.C.D, net A.B.C.D/len, port N, portrange N-M, each optionally preceded by src or dst
+    - tcp, udp, icmp, ip, proto N (or proto tcp|udp|icmp)
+    - time OP T, with OP one of >= <= == != > < and T an epoch timestamp
+    - and (&&), or (||), not (!) and parentheses
+
+    Ports only match on TCP/UDP packets that are not a later fragment. Packets that are not
+    IPv4 only match expressions that do not test their headers (e.g. "not tcp").
+
+    The expression is compiled once into a Python function reading the header fields at their
+    byte offsets (match) and into its NumPy counterpart on the decoded headers of a
+    vector_decode.RecordBlock (mask), so packets are selected before any dissection.
+
+    Parameters:
+    - expression: Filter expression, e.g. "udp and host 192.168.0.33 and not port 53".
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        tree = Parser(expression).parse()
+        namespace = {"ipv4_offset": rp.ipv4_offset, "np": np}
+        fields = _FIELDS_SOURCE if uses_headers(tree) else ""
+        exec(f"def match(data, linktype, time):{fields}\n    return {to_python(tree)}\n", namespace)
+        exec(f"def match_headers(ip, proto, src, dst, sport, dport, time):\n    return {to_numpy(tree)}\n", namespace)
+        self.match = namespace["match"]
+        self.match_headers = namespace["match_headers"]
+
+    def __call__(self, pckt):
+        return self.match(pckt.data, pckt.linktype, pckt.time)
+
+    def filter(self, pckts):
+        """
+        Yield the records (raw_pcap.RawPacket) of an iterable that match the expression.
+        """
+        match = self.match
+        for pckt in pckts:
+            if match(pckt.data, pckt.linktype, pckt.time):
+                yield pckt
+
+    def mask(self, block):
+        """
+        Return the boolean mask of the records of a vector_decode.RecordBlock that match.
+        """
+        headers, _, _ = vd.decode_block(block)
+        ok = headers["ok"]
+        n = len(block)
+        result = np.zeros(n, dtype=bool)
+        if ok.any():
+            selected = headers[ok]
+            matches = self.match_headers(
+                np.ones(len(selected), dtype=bool), selected["proto"].astype(np.int64),
+                selected["src"].astype(np.int64), selected["dst"].astype(np.int64),
+                selected["sport"].astype(np.int64), selected["dport"].astype(np.int64), selected["time"])
+            result[ok] = np.broadcast_to(matches, len(selected))
+        # Records the vectorized decoder does not handle are matched one by one
+        for i in np.flatnonzero(~ok).tolist():
+            pckt = block.packet(i)
+            result[i] = self.match(pckt.data, pckt.linktype, pckt.time)
+        return result
+
+    def filter_blocks(self, blocks):
+        """
+        Yield the vector_decode.RecordBlock of an iterable reduced to their matching records.
+        """
+        for block in blocks:
+            yield block.select(self.mask(block))
+
+    def __repr__(self):
+        return f"PacketFilter({self.expression!r})"
+
+
+class FilteredReader:
+    """
+    Reader wrapper yielding only the records of reader (a RawPcapReader or MmapPcapReader)
+    that match pckt_filter, dissected with Scapy after the match when to_scapy is set.
+    """
+
+    def __init__(self, reader, pckt_filter, to_scapy=False):
+        self.reader = reader
+        self.pckt_filter = compile_filter(pckt_filter)
+        self.to_scapy = to_scapy
+
+    def __iter__(self):
+        for pckt in self.pckt_filter.filter(self.reader):
+            yield pckt.to_scapy() if self.to_scapy else pckt
+
+    def read_time_range(self, start_time=None, end_time=None):
+        # Matching records of reader.read_time_range (see raw_pcap.RawPcapReader)
+        for pckt in self.pckt_filter.filter(self.reader.read_time_range(start_time, end_time)):
+            yield pckt.to_scapy() if self.to_scapy else pckt
+
+    def close(self):
+        self.reader.close()
+
+
+@lru_cache(maxsize=64)
+def _compile(expression):
+    return PacketFilter(expression)
+
+
+def compile_filter(pckt_filter):
+    """
+    Return a PacketFilter for an expression (compiled once per expression), a PacketFilter or None.
+    """
+    if pckt_filter is None or isinstance(pckt_filter, PacketFilter):
+        return pckt_filter
+    return _compile(pckt_filter)
+
+
+def filter_expression(pckt_filter):
+    # The expression of a filter, to hand it to worker processes
+    return pckt_filter.expression if isinstance(pckt_filter, PacketFilter) else pckt_filter
+
+
+def filter_packets(pckts, pckt_filter):
+    """
+    Keep the records of an iterable of raw_pcap.RawPacket matching pckt_filter (all when None).
+    """
+    pckt_filter = compile_filter(pckt_filter)
+    return pckts if pckt_filter is None else pckt_filter.filter(pckts)
+
+
+class Parser:
+    """
+    Recursive descent parser of filter expressions into nested tuples:
+    ("and", a, b), ("or", a, b), ("not", a), ("host"|"net"|"port", direction, ...),
+    ("proto", number), ("ip",) and ("time", operator, value).
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = []
+        pos = 0
+        while pos < len(expression):
+            m = _token.match(expression, pos)
+            if m is None:
+                break
+            self.tokens.append(m.group(1))
+            pos = m.end()
+        if expression[pos:].strip():
+            self.error(f"unexpected '{expression[pos:].strip()}'")
+        self.pos = 0
+
+    def error(self, message):
+        raise ValueError(f"Invalid filter expression '{self.expression}': {message}")
+
+    def peek(self):
+        return self.tokens[self.pos].lower() if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            self.error("unexpected end")
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def parse(self):
+        if not self.tokens:
+            self.error("empty expression")
+        tree = self.parse_or()
+        if self.peek() is not None:
+            self.error(f"unexpected '{self.peek()}'")
+        return tree
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.peek() in ("or", "||"):
+            self.take()
+            tree = ("or", tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_not()
+        while self.peek() in ("and", "&&"):
+            self.take()
+            tree = ("and", tree, self.parse_not())
+        return tree
+
+    def parse_not(self):
+        if self.peek() in ("not", "!"):
+            self.take()
+            return ("not", self.parse_not())
+        if self.peek() == "(":
+            self.take()
+            tree = self.parse_or()
+            if self.take() != ")":
+                self.error("missing ')'")
+            return tree
+        return self.parse_primitive()
+
+    def parse_primitive(self):
+        token = self.take().lower()
+        direction = "any"
+        if token in ("src", "dst"):
+            direction, token = token, self.take().lower()
+            if token not in ("host", "net", "port", "portrange"):
+                self.error(f"'{direction}' must be followed by host, net, port or portrange")
+
+        if token == "host":
+            return ("host", direction, self.address(self.take()))
+        if token == "net":
+            try:
+                net = ipaddress.IPv4Network(self.take(), strict=False)
+            except ValueError as e:
+                self.error(str(e))
+            return ("net", direction, int(net.network_address), int(net.netmask))
+        if token == "port":
+            port = self.number(self.take(), 65535)
+            return ("port", direction, port, port)
+        if token == "portrange":
+            first, _, last = self.take().partition("-")
+            first, last = self.number(first, 65535), self.number(last, 65535)
+            if first > last:
+                self.error(f"empty port range {first}-{last}")
+            return ("port", direction, first, last)
+        if token in PROTOCOLS:
+            return ("proto", PROTOCOLS[token])
+        if token == "ip":
+            if self.peek() == "proto":
+                self.take()
+                return self.parse_proto()
+            return ("ip",)
+        if token == "proto":
+            return self.parse_proto()
+        if token == "time":
+            operator = self.take()
+            if operator not in TIME_OPERATORS:
+                self.error(f"unknown time operator '{operator}'")
+            try:
+                timestamp = float(self.take())
+            except ValueError:
+                timestamp = math.nan
+            if not math.isfinite(timestamp):
+                self.error("time must be compared with an epoch timestamp")
+            return ("time", operator, timestamp)
+        self.error(f"unknown primitive '{token}'")
+
+    def parse_proto(self):
+        token = self.take().lower()
+        return ("proto", PROTOCOLS[token] if token in PROTOCOLS else self.number(token, 255))
+
+    def address(self, token):
+        # Dotted quads only, inet_aton would also take short forms such as 1.2.3
+        try:
+            return int(ipaddress.IPv4Address(token))
+        except ValueError:
+            self.error(f"invalid IPv4 address '{token}'")
+
+    def number(self, token, maximum):
+        if not (token.isascii() and token.isdigit()) or int(token) > maximum:
+            self.error(f"invalid number '{token}' (0-{maximum})")
+        return int(token)
+
+
+def uses_headers(tree):
+    if tree[0] in ("and", "or"):
+        return uses_headers(tree[1]) or uses_headers(tree[2])
+    if tree[0] == "not":
+        return uses_headers(tree[1])
+    return tree[0] != "time"
+
+
+def directions(direction, src, dst):
+    return [src] if direction == "src" else [dst] if direction == "dst" else [src, dst]
+
+
+def to_python(tree):
+    # Expression of the match function on the fields of _FIELDS_SOURCE
+    kind = tree[0]
+    if kind in ("and", "or"):
+        return f"({to_python(tree[1])} {kind} {to_python(tree[2])})"
+    if kind == "not":
+        return f"(not {to_python(tree[1])})"
+    if kind == "host":
+        return "(" + " or ".join(f"{field} == {tree[2]}" for field in directions(tree[1], "src", "dst")) + ")"
+    if kind == "net":
+        return "(ip and (" + " or ".join(f"({field} & {tree[3]}) == {tree[2]}" for field in directions(tree[1], "src", "dst")) + "))"
+    if kind == "port":
+        return "(" + " or ".join(f"{tree[2]} <= {field} <= {tree[3]}" for field in directions(tree[1], "sport", "dport")) + ")"
+    if kind == "proto":
+        return f"(proto == {tree[1]})"
+    if kind == "ip":
+        return "ip"
+    return f"(time {tree[1]} {tree[2]!r})"
+
+
+def to_numpy(tree):
+    # Same expression on arrays of decoded IPv4 TCP/UDP headers
+    kind = tree[0]
+    if kind in ("and", "or"):
+        return f"({to_numpy(tree[1])} {'&' if kind == 'and' else '|'} {to_numpy(tree[2])})"
+    if kind == "not":
+        return f"(~{to_numpy(tree[1])})"
+    if kind == "host":
+        return "(" + " | ".join(f"({field} == {tree[2]})" for field in directions(tree[1], "src", "dst")) + ")"
+    if kind == "net":
+        return "(" + " | ".join(f"(({field} & {tree[3]}) == {tree[2]})" for field in directions(tree[1], "src", "dst")) + ")"
+    if kind == "port":
+        return "(" + " | ".join(f"(({field} >= {tree[2]}) & ({field} <= {tree[3]}))" for field in directions(tree[1], "sport", "dport")) + ")"
+    if kind == "proto":
+        return f"(proto == {tree[1]})"
+    if kind == "ip":
+        return "ip"
+    return f"(time {tree[1]} {tree[2]!r})"
@@ -1,5 +1,6 @@
 import base64
 import constants as c
+import raw_pcap as rp
 
 def process_data_pckt(_pckt, _no):
     pckt_data = {}
@@ -24,7 +25,7 @@ def process_pckt(_pckt, _no):
             "AcknowledgementNumber": int(_pckt["TCP"].ack) if _pckt.haslayer('TCP') else 0,
             "Protocol": get_protocol_name(_pckt["IP"].proto) if _pckt.haslayer('IP') else "",
             "Length": int(_pckt["IP"].len) if _pckt.haslayer('IP') else 0,
-            "Load": base64.b64encode(_pckt["Raw"].load).decode('utf-8') if _pckt.haslayer('Raw') else ""
+            "Load": _pckt["Raw"].load if _pckt.haslayer('Raw') else b""
         }
     elif _pckt.haslayer('UDP'):
         pckt_data = {
@@ -38,7 +39,7 @@ def process_pckt(_pckt, _no):
             "AcknowledgementNumber": 0,  # TCP-only field
             "Protocol": get_protocol_name(_pckt["IP"].proto) if _pckt.haslayer('IP') else "",
             "Length": int(_pckt["IP"].len) if _pckt.haslayer('IP') else 0,
-            "Load": base64.b64encode(_pckt["Raw"].load).decode('utf-8') if _pckt.haslayer('Raw') else ""
+            "Load": _pckt["Raw"].load if _pckt.haslayer('Raw') else b""
         }
     return pckt_data
 
@@ -74,11 +75,96 @@ def process_metadata_payload(_pckt, _no):
     pckt_payload = {
             "No": _no,
             "Length": int(_pckt["IP"].len) if _pckt.haslayer('IP') else 0,
-            "Load": base64.b64encode(_pckt["Raw"].load).decode('utf-8') if _pckt.haslayer('Raw') else ""
+            "Load": _pckt["Raw"].load if _pckt.haslayer('Raw') else b""
         }
     
     return pckt_metadata, pckt_payload
 
 
+def process_raw_pckt(_rec, _no):
+    fields = rp.decode_transport(_rec.data, _rec.linktype)
+    if fields is None:
+        return process_pckt(_rec.to_scapy(), _no)
+
+    proto, src, dst, sport, dport, seq, ack, ip_len, load = fields
+    pckt_data = {
+        "Time": _rec.sec,
+        "No": _no,
+        "SourceIP": src,
+        "DestinationIP": dst,
+        "SourcePort": sport,
+        "DestinationPort": dport,
+        "SequenceNumber": seq,
+        "AcknowledgementNumber": ack,
+        "Protocol": get_protocol_name(proto),
+        "Length": ip_len,
+        "Load": load
+    }
+    return pckt_data
+
+def process_raw_data_pckt(_rec, _no):
+    fields = rp.decode_transport(_rec.data, _rec.linktype)
+    if fields is None:
+        return process_data_pckt(_rec.to_scapy(), _no)
+
+    load = fields[8]
+    pckt_data = {
+        "Time": _rec.sec,
+        "Pckt_No": _no,
+        "Data": base64.b64encode(load) if load else None
+    }
+    return pckt_data
+
+def process_raw_metadata_payload(_rec, _no):
+    fields = rp.decode_transport(_rec.data, _rec.linktype)
+    if fields is None:
+        return process_metadata_payload(_rec.to_scapy(), _no)
+
+    proto, src, dst, sport, dport, seq, ack, ip_len, load = fields
+    pckt_metadata = {
+        "Time": _rec.sec,
+        "No": _no,
+        "SourceIP": src,
+        "DestinationIP": dst,
+        "SourcePort": sport,
+        "DestinationPort": dport,
+        "SequenceNumber": seq,
+        "AcknowledgementNumber": ack,
+        "Protocol": get_protocol_name(proto),
+        "Length": ip_len,
+    }
+    pckt_payload = {
+        "No": _no,
+        "Length": ip_len,
+        "Load": load
+    }
+
+    return pckt_metadata, pckt_payload
+
+def get_processor(_process, backend):
+    """
+    Return the packet processing function matching a reader backend.
+
+    Parameters:
+    - _process: One of process_pckt, process_data_pckt or process_metadata_payload.
+    - backend: "scapy" (dissect every packet), "raw" (decode headers from bytes,
+      Scapy only for packets the raw decoder cannot handle), "mmap" (same as raw on
+      the memory-mapped records of MmapPcapReader) or "vector" (same as mmap for the
+      conversions that are not decoded block-wise, see vector_decode).
+    """
+    if backend == "scapy":
+        return _process
+    if backend in ("raw", "mmap", "vector"):
+        return RAW_PROCESSORS[_process]
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+RAW_PROCESSORS = {
+    process_pckt: process_raw_pckt,
+    process_data_pckt: process_raw_data_pckt,
+    process_metadata_payload: process_raw_metadata_payload,
+}
+
+
 def get_protocol_name(protocol_number):
     return c.protocol_mapping.get(protocol_number, "Unknown")
\ No newline at end of file
@@ -0,0 +1,209 @@
+import mmap
+import struct
+import zlib
+from array import array
+import numpy as np
+
+STORE_SUFFIX = ".pstore"
+STORE_MAGIC = b"PLST"
+STORE_END_MAGIC = b"PLSE"
+STORE_VERSION = 1
+BLOCK_BYTES = 1024 * 1024  # Uncompressed payload bytes per block
+
+COMPRESSIONS = {None: 0, "zlib": 1}
+
+_store_header = struct.Struct("<4sHH")  # magic, version, compression
+_store_footer = struct.Struct("<QQQ4s")  # table offset, blocks, rows, end magic
+
+# Offset table: one entry per block and per packet, stored after the last block
+BLOCK_DTYPE = np.dtype([("offset", "<u8"), ("stored", "<u4"), ("size", "<u4"), ("first", "<u8")])
+ROW_DTYPE = np.dtype([("No", "<u4"), ("Length", "<u2"), ("size", "<u4")])
+
+
+def is_payload_store(path):
+    return str(path).endswith(STORE_SUFFIX)
+
+
+class PayloadStoreWriter:
+    """
+    Write packet payloads as raw bytes to a payload store, the binary counterpart of the payload CSV.
+
+    Payloads are concatenated into blocks of about block_bytes bytes, each optionally compressed,
+    followed by an offset table giving the packet number ("No", as in the metadata CSV), IP length
+    and payload size of every packet. Accepts the same chunks of payload dicts as the CSV writers.
+
+    Parameters:
+    - path: Output file path (.pstore).
+    - compression: None or "zlib" (compressed per block).
+    - block_bytes: Uncompressed bytes per block.
+    """
+
+    def __init__(self, path, compression=None, block_bytes=BLOCK_BYTES):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.path = path
+        self.compression = compression
+        self.block_bytes = block_bytes
+        self.f = open(path, 'wb')
+        self.f.write(_store_header.pack(STORE_MAGIC, STORE_VERSION, COMPRESSIONS[compression]))
+        self.blocks = []
+        self.numbers = array("I")
+        self.lengths = array("H")
+        self.sizes = array("I")
+        self.pending = []  # Payloads of the current block
+        self.pending_bytes = 0
+        self.block_first = 0  # First row of the current block
+
+    def append(self, no, length, load):
+        self.write_rows([no], [length], [load])
+
+    def write(self, chunk):
+        self.write_rows([row["No"] for row in chunk], [row["Length"] for row in chunk], [row["Load"] for row in chunk])
+
+    def write_frame(self, frame):
+        self.write_rows(frame["No"].tolist(), frame["Length"].tolist(), frame["Load"].tolist())
+
+    def write_rows(self, numbers, lengths, loads):
+        # A block is closed once it holds block_bytes, after the rows of the current call
+        sizes = [len(load) for load in loads]
+        self.numbers.extend(numbers)
+        self.lengths.extend(lengths)
+        self.sizes.extend(sizes)
+        self.pending.extend(load for load in loads if load)
+        self.pending_bytes += sum(sizes)
+        if self.pending_bytes >= self.block_bytes:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.pending:
+            return
+        data = b"".join(self.pending)
+        stored = zlib.compress(data, 1) if self.compression == "zlib" else data
+        self.blocks.append((self.f.tell(), len(stored), len(data), self.block_first))
+        self.f.write(stored)
+        self.pending = []
+        self.pending_bytes = 0
+        self.block_first = len(self.numbers)
+
+    def close(self):
+        self.flush_block()
+        table_offset = self.f.tell()
+        self.f.write(np.array(self.blocks, dtype=BLOCK_DTYPE).tobytes())
+        rows = np.zeros(len(self.numbers), dtype=ROW_DTYPE)
+        rows["No"] = self.numbers
+        rows["Length"] = self.lengths
+        rows["size"] = self.sizes
+        self.f.write(rows.tobytes())
+        self.f.write(_store_footer.pack(table_offset, len(self.blocks), len(rows), STORE_END_MAGIC))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PayloadStore:
+    """
+    Read a payload store: random lookup of a packet's payload by its number and streaming scans.
+
+    Parameters:
+    - path: Payload store path (.pstore).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < _store_header.size + _store_footer.size:
+            self.close()
+            raise ValueError(f"{path} is not a complete payload store")
+        magic, version, compression = _store_header.unpack_from(self.mm, 0)
+        table_offset, n_blocks, n_rows, end_magic = _store_footer.unpack_from(self.mm, len(self.mm) - _store_footer.size)
+        if magic != STORE_MAGIC or end_magic != STORE_END_MAGIC or version != STORE_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a complete payload store")
+
+        self.compressed = compression == COMPRESSIONS["zlib"]
+        self.blocks = np.frombuffer(self.mm, BLOCK_DTYPE, n_blocks, table_offset).copy()
+        rows = np.frombuffer(self.mm, ROW_DTYPE, n_rows, table_offset + n_blocks * BLOCK_DTYPE.itemsize).copy()
+        self.numbers = rows["No"]
+        self.lengths = rows["Length"]
+        self.sizes = rows["size"].astype(np.int64)
+        # Start of every payload in the uncompressed stream, and the block holding it
+        self.starts = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=self.starts[1:])
+        self.row_block = np.searchsorted(self.blocks["first"], np.arange(n_rows), side="right") - 1
+        self.sorted = bool(np.all(self.numbers[1:] > self.numbers[:-1]))
+        self.cached_block = (-1, b"")
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def block_data(self, block_id):
+        # Uncompressed bytes of a block, the last one read is kept for sequential lookups
+        if self.cached_block[0] != block_id:
+            offset, stored, _, _ = self.blocks[block_id].tolist()
+            data = self.mm[offset:offset + stored]
+            self.cached_block = (block_id, zlib.decompress(data) if self.compressed else data)
+        return self.cached_block[1]
+
+    def row(self, no):
+        # Row of packet number no, None when it is not in the store
+        if self.sorted:
+            i = int(np.searchsorted(self.numbers, no))
+            return i if i < len(self.numbers) and self.numbers[i] == no else None
+        matches = np.flatnonzero(self.numbers == no)
+        return int(matches[0]) if len(matches) else None
+
+    def get(self, no):
+        """
+        Return the payload bytes of packet number no (b"" for packets without payload).
+        """
+        i = self.row(no)
+        if i is None:
+            raise KeyError(no)
+        if not self.sizes[i]:
+            return b""
+        block_id = int(self.row_block[i])
+        start = int(self.starts[i] - self.starts[self.blocks["first"][block_id]])
+        return self.block_data(block_id)[start:start + int(self.sizes[i])]
+
+    __getitem__ = get
+
+    def scan(self, first=None, last=None):
+        """
+        Yield (No, Length, payload) for every packet in file order, optionally only the packets
+        numbered first to last (inclusive). Each block is read and decompressed once.
+        """
+        # Block k holds the payloads of the rows from its first row to the next block's first row
+        bounds = self.blocks["first"].tolist() + [len(self)]
+        if bounds[0] != 0:
+            bounds.insert(0, 0)  # No blocks, only empty payloads
+        for start, end in zip(bounds, bounds[1:]):
+            yield from self.scan_rows(start, end, first, last)
+
+    def scan_rows(self, start, end, first, last):
+        data = None
+        base = self.starts[start]
+        for i in range(start, end):
+            no = int(self.numbers[i])
+            if (first is not None and no < first) or (last is not None and no > last):
+                continue
+            size = int(self.sizes[i])
+            if size and data is None:
+                data = self.block_data(int(self.row_block[i]))
+            offset = int(self.starts[i] - base)
+            yield no, int(self.lengths[i]), data[offset:offset + size] if size else b""
+
+    def close(self):
+        self.cached_block = (-1, b"")
+        self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
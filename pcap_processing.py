@@ -1,63 +1,132 @@
 from scapy.all import *
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import ipaddress
 import os
+import shutil
+import socket
+import tempfile
 import time
 import constants as c
-import file_mgmt as fm
+import instrumentation as ins
+import packet_filter as pf
+import raw_pcap as rp
 
 
 
-def extract_pcap(file_name):    
+def extract_pcap(file_name):
+    split_pcap_by_host(file_name, hosts=[c.IP_PREFIX + str(i) for i in range(33, 34)]) #21
+
+@ins.instrumented("split_pcap_by_host")
+def split_pcap_by_host(file_name, hosts=None, subnet=None, max_open_writers=64, pckt_filter=None):
+    """
+    Split a PCAP into one file per host in a single pass over the capture.
+
+    Every packet is written, with its original record bytes, to the file of its
+    source and/or destination host: PCAP_DIR/<ip>/<ip>_<file_name>.
+
+    Parameters:
+    - file_name: Name of the PCAP file inside PCAP_DIR.
+    - hosts: List of host IPs to extract.
+    - subnet: Alternatively, a subnet (e.g. "192.168.0.0/24"); every address in it gets its own file.
+    - max_open_writers: Maximum number of output files kept open, the least recently used is closed first.
+    - pckt_filter: Optional filter expression, only matching packets are written (see packet_filter.PacketFilter).
+    """
     start = time.process_time()
 
-    for i in range(33, 34): #21
-            current_ip = c.IP_PREFIX + str(i)
-            filtered_pckts = []
-
-            current_cap = fm.open_pcap(c.PCAP_DIR + file_name)
-                
-            print("Time taken to open PCAP file: " + str(time.process_time() - start))
-            print("Extracting IP: " + c.IP_PREFIX + str(i))
-
-            if not os.path.isdir(c.PCAP_DIR + current_ip):
-                os.mkdir(c.PCAP_DIR + current_ip)
-            else:
-                print("Directory already exists.")
-
-            #write_file = PcapWriter(c.PCAP_DIR + current_ip + "/" + current_ip + "_" + file_name, append=True)
-            write_file = PcapWriter(c.PCAP_DIR + current_ip + "/" + current_ip + "_" + file_name)
-            for packet in current_cap:
-                if packet.haslayer(IP):
-                    if packet[IP].src == current_ip or packet[IP].dst == current_ip:
-                        print(packet.summary())
-                        filtered_pckts.append(packet)
-            write_file.write(filtered_pckts)
-
-def extract_pcap_timestamp(_pcap, output_pcap, stop_timestamp):
+    host_set = {socket.inet_aton(ip) for ip in hosts or []}
+    if subnet:
+        net = ipaddress.ip_network(subnet)
+        net_addr, net_mask = int(net.network_address), int(net.netmask)
+
+    def is_selected(addr):
+        if addr in host_set:
+            return True
+        return subnet is not None and (int.from_bytes(addr, "big") & net_mask) == net_addr
+
+    writers = OrderedDict()  # ip -> RawPcapWriter, least recently used first
+    created = set()  # Hosts whose output was already truncated during this run
+
+    def get_writer(ip):
+        writer = writers.get(ip)
+        if writer is not None:
+            writers.move_to_end(ip)
+            return writer
+        if len(writers) >= max_open_writers:
+            _, oldest = writers.popitem(last=False)
+            oldest.close()
+        directory = c.PCAP_DIR + ip
+        os.makedirs(directory, exist_ok=True)
+        writer = rp.RawPcapWriter(directory + "/" + ip + "_" + file_name, reader, append=ip in created)
+        created.add(ip)
+        writers[ip] = writer
+        return writer
+
+    pckt_no = 0
+    written = 0
+    reader = rp.MmapPcapReader(c.PCAP_DIR + file_name)
+    ins.track(reader)
+    try:
+        for pckt in ins.timed_iter("read", pf.filter_packets(reader, pckt_filter)):
+            pckt_no += 1
+            addresses = rp.ipv4_addresses(pckt)
+            if addresses is not None:
+                src, dst = addresses
+                if is_selected(src):
+                    get_writer(socket.inet_ntoa(src)).write(pckt)
+                    written += 1
+                if dst != src and is_selected(dst):
+                    get_writer(socket.inet_ntoa(dst)).write(pckt)
+                    written += 1
+
+            if pckt_no % 100000 == 0:  # Periodic logging
+                print(f"Processed {pckt_no} packets")
+                ins.progress(pckt_no, pckt)
+    finally:
+        reader.close()
+        for writer in writers.values():
+            writer.close()
+
+    print(f"Split {pckt_no} packets into {len(created)} host files ({written} packets written) "
+          f"in {time.process_time() - start:.1f}s")
+
+@ins.instrumented("extract_pcap_timestamp")
+def extract_pcap_timestamp(_pcap, output_pcap, stop_timestamp, start_timestamp=None, pckt_filter=None):
     """
     Extract packets from a PCAP file and write to a new PCAP file, stopping at a specified timestamp.
 
+    With a start timestamp, reading starts close to it through the packet index of the
+    input (built on first use, see raw_pcap.load_packet_index) instead of at the first packet.
+
     Parameters:
     - _pcap: Input PCAP file path.
-    - output_pcap: Output PCAP file path.
+    - output_pcap: Output PCAP file path (appended to if it exists).
     - stop_timestamp: Epoch timestamp to stop processing packets.
+    - start_timestamp: Optional epoch timestamp of the first packet to extract.
+    - pckt_filter: Optional filter expression, only matching packets are extracted (see packet_filter.PacketFilter).
     """
-    cap = fm.open_pcap(_pcap)
-    writer = PcapWriter(output_pcap, append=True, sync=True)
+    match = pf.compile_filter(pckt_filter)
+    cap = rp.MmapPcapReader(_pcap)  # libpcap or pcapng
+    writer = rp.RawPcapWriter(output_pcap, cap, append=True)
 
     pckt_no = 0
 
     try:
-        for pckt in cap:
+        for pckt in cap.read_time_range(start_timestamp):
             # Stop processing if packet timestamp exceeds stop_timestamp
             if pckt.time > stop_timestamp:
                 print(f"Stopping processing as packet timestamp {pckt.time} exceeds stop_timestamp {stop_timestamp}")
                 break
+            if match is not None and not match(pckt):
+                continue
 
             pckt_no += 1
             writer.write(pckt)
 
             if pckt_no % 10000 == 0:  # Periodic logging
                 print(f"Processed {pckt_no} packets")
+                ins.progress(pckt_no, pckt)
 
     finally:
         cap.close()  # Ensure the input file is properly closed
@@ -65,23 +134,88 @@ def extract_pcap_timestamp(_pcap, output_pcap, stop_timestamp):
 
     print(f"Finished writing to {output_pcap}. Total packets written: {pckt_no}")
 
-def extract_dns_pckt():
+def extract_dns_pckt(workers=None, ports=(53, 5353), pckt_filter=None):
+    """
+    Extract the DNS packets of every per-host capture in PCAP_DIR/192.168.0.N/ into
+    PCAP_DIR/dns_pckts.pcap, ordered by timestamp (appended if the file exists).
 
-    dns_pckt = []
-    write_file = PcapWriter(c.PCAP_DIR + "dns_pckts" + ".pcap", append=True)
+    The per-host files are scanned in a process pool. Each worker checks the TCP/UDP
+    ports in the raw bytes first and only dissects candidate packets with Scapy, then
+    streams the matches to a temporary file; the temporary files are merged at the end.
 
+    Parameters:
+    - workers: Number of worker processes (defaults to the CPU count).
+    - ports: Ports Scapy dissects as DNS; packets on other ports are skipped without decoding.
+    - pckt_filter: Optional filter expression narrowing the packets checked for DNS (see packet_filter.PacketFilter).
+    """
+    files = []
     for i in range(1,52):
         directory = c.PCAP_DIR + c.IP_PREFIX + str(i) + "/"
 
         if os.path.isdir(directory):
             for filename in os.listdir(directory):
                 f = os.path.join(directory, filename)
-                print(f)
                 if os.path.isfile(f):
-                    current_pcap = fm.open_pcap(f)
-                    print("Extracting DNS packets from: " + f)
-                    for packet in current_pcap:
-                        if packet.haslayer(DNS):
-                            dns_pckt.append(packet)
-                            
-    write_file.write(dns_pckt)
\ No newline at end of file
+                    files.append(f)
+
+    tmp_dir = tempfile.mkdtemp(prefix="dns_", dir=c.PCAP_DIR)
+    try:
+        expression = pf.filter_expression(pckt_filter)
+        tasks = [(f, os.path.join(tmp_dir, f"dns_{n}.pcap"), tuple(ports), expression) for n, f in enumerate(files)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(extract_dns_from_file, tasks))
+
+        parts = [part for part, count in results if count]
+        total = merge_pcaps_by_time(parts, c.PCAP_DIR + "dns_pckts" + ".pcap", append=True)
+        print(f"Extracted {total} DNS packets from {len(files)} files")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def extract_dns_from_file(task):
+    # Worker of extract_dns_pckt: stream the DNS packets of one capture to output_pcap
+    input_pcap, output_pcap, ports, pckt_filter = task
+    print("Extracting DNS packets from: " + input_pcap)
+
+    count = 0
+    with rp.MmapPcapReader(input_pcap) as reader, rp.RawPcapWriter(output_pcap, reader) as writer:
+        for pckt in pf.filter_packets(reader, pckt_filter):
+            transport = rp.transport_ports(pckt.data, pckt.linktype)
+            if transport is not None and transport[1] not in ports and transport[2] not in ports:
+                continue
+            if pckt.to_scapy().haslayer(DNS):
+                writer.write(pckt)
+                count += 1
+    return output_pcap, count
+
+def merge_pcaps_by_time(input_pcaps, output_pcap, append=False):
+    """
+    Merge PCAP files that are each in timestamp order into one timestamp-ordered PCAP,
+    holding only one packet per input in memory.
+
+    Parameters:
+    - input_pcaps: List of PCAP file paths with the same link type and timestamp precision.
+    - output_pcap: Output PCAP file path.
+    - append: Append to output_pcap if it already exists.
+
+    Returns:
+    - The number of packets written.
+    """
+    if not input_pcaps:
+        return 0
+
+    readers = [rp.RawPcapReader(f) for f in input_pcaps]
+    try:
+        first = readers[0]
+        for reader in readers[1:]:
+            if reader.linktype != first.linktype or reader.nano != first.nano:
+                raise ValueError(f"Cannot merge {reader.name}: link type or timestamp precision differs from {first.name}")
+
+        count = 0
+        with rp.RawPcapWriter(output_pcap, first, append=append) as writer:
+            for pckt in heapq.merge(*readers, key=lambda p: (p.sec, p.frac)):
+                writer.write(pckt)
+                count += 1
+    finally:
+        for reader in readers:
+            reader.close()
+    return count
@@ -1,15 +1,17 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter
 import pytz
 from datetime import datetime
 import constants as c
+import dataset_cache as dc
+import traffic_cube as tc
 import os
 
 def plot_top_associations(input_csv, associations_csv, start_time, end_time):
     """
     Plot network data for the top 5 associations chronologically within a user-defined time interval,
-    aggregating packets by the minute.
+    aggregating packets by the minute. The per-minute bytes are read from the traffic cube of the
+    CSV (see traffic_cube), which is built on first use.
 
     Parameters:
     - input_csv: Path to the CSV file containing network data.
@@ -17,16 +19,13 @@ def plot_top_associations(input_csv, associations_csv, start_time, end_time):
     - start_time: Start of the time interval (epoch seconds).
     - end_time: End of the time interval (epoch seconds).
     """
-    # Load network data
-    df = pd.read_csv(input_csv)
-
     # Load the sorted associations and take the top 5
-    associations_df = pd.read_csv(associations_csv).head(5)
+    associations_df = dc.load_table(associations_csv).head(5)
 
-    print(associations_df.columns)
+    # Per-minute traffic of every association
+    cube = tc.open_cube(input_csv)
 
-    # Convert epoch time to datetime
-    df["FormattedTime"] = pd.to_datetime(df["Time"], unit="s")
+    print(associations_df.columns)
 
     # Set up the plot
     plt.figure(figsize=(14, 8))
@@ -38,19 +37,11 @@ def plot_top_associations(input_csv, associations_csv, start_time, end_time):
         source_port = row["SourcePort"]
         dest_port = row["DestinationPort"]
 
-        # Filter the data for the specific association and time range
-        filtered_df = df[
-            (df["SourceIP"] == source_ip) &
-            (df["DestinationIP"] == dest_ip) &
-            (df["SourcePort"] == source_port) &
-            (df["DestinationPort"] == dest_port) &
-            (df["Time"] >= start_time) &
-            (df["Time"] <= end_time)
-        ]
-
-        # Aggregate packet lengths by minute
-        filtered_df.set_index("FormattedTime", inplace=True)
-        aggregated_df = filtered_df.resample("1min").sum()["Length"]
+        # Packet lengths of the association aggregated by minute within the time range
+        key_ids = cube.select(
+            "association", SourceIP=source_ip, DestinationIP=dest_ip, SourcePort=source_port, DestinationPort=dest_port
+        )
+        aggregated_df = cube.series("association", key_ids, start_time, end_time)
 
         # Plot the aggregated data
         plt.plot(
@@ -81,7 +72,8 @@ def plot_top_associations(input_csv, associations_csv, start_time, end_time):
 def plot_multiple_sourceips_destport(csv_file, source_ips, dest_port, source_port, start_time, end_time):
     """
     Plot network data for multiple SourceIP-DestPort pairs within a user-defined time interval,
-    aggregating packets by the minute.
+    aggregating packets by the minute. The per-minute bytes are read from the traffic cube of the
+    CSV (see traffic_cube), which is built on first use.
 
     Parameters:
     - csv_file: Path to the CSV file containing network data.
@@ -90,54 +82,25 @@ def plot_multiple_sourceips_destport(csv_file, source_ips, dest_port, source_por
     - start_time: Start of the time interval (epoch seconds).
     - end_time: End of the time interval (epoch seconds).
     """
-    # Load CSV data
-    df = pd.read_csv(csv_file)
+    cube = tc.open_cube(csv_file)
 
-    # Convert epoch time to datetime for easier manipulation
-    df["FormattedTime"] = pd.to_datetime(df["Time"], unit="s").dt.tz_localize("UTC")
+    # Aggregate packet lengths by minute for the given SourceIP-DestPort pairs and time range,
+    # one column per IP
+    aggregated_df_out = cube.frame("source", "SourceIP", source_ips, start_time, end_time, DestinationPort=dest_port)
+    aggregated_df_in = cube.frame("destination", "DestinationIP", source_ips, start_time, end_time, SourcePort=dest_port)
 
-    target_tz = pytz.timezone("Etc/GMT-2")
-    df["FormattedTime"] = df["FormattedTime"].dt.tz_convert(target_tz)
-
-    # Filter data for the given SourceIP-DestPort pairs and time range
-    filtered_df_out = df[
-        (df["SourceIP"].isin(source_ips)) &
-        (df["DestinationPort"] == dest_port) &
-        (df["Time"] >= start_time) &
-        (df["Time"] <= end_time)
-    ]
-
-    filtered_df_in = df[
-        (df["DestinationIP"].isin(source_ips)) &
-        (df["SourcePort"] == dest_port) &
-        (df["Time"] >= start_time) &
-        (df["Time"] <= end_time)
-    ]
-
-    if filtered_df_out.empty:
+    if aggregated_df_out.empty:
         print("No matching data found for the given criteria.")
         return
     
-    if filtered_df_in.empty:
+    if aggregated_df_in.empty:
         print("No matching data found for the given criteria.")
         return
 
-    # Aggregate packet lengths by minute
-    filtered_df_out.set_index("FormattedTime", inplace=True)
-    aggregated_df_out = (
-        filtered_df_out.groupby("SourceIP")["Length"]
-        .resample("1min")
-        .sum()
-        .unstack(level=0)
-    )
-
-    filtered_df_in.set_index("FormattedTime", inplace=True)
-    aggregated_df_in = (
-        filtered_df_in.groupby("DestinationIP")["Length"]
-        .resample("1min")
-        .sum()
-        .unstack(level=0)
-    )
+    # Convert the epoch minutes to the local time zone
+    target_tz = pytz.timezone("Etc/GMT-2")
+    aggregated_df_out.index = aggregated_df_out.index.tz_localize("UTC").tz_convert(target_tz)
+    aggregated_df_in.index = aggregated_df_in.index.tz_localize("UTC").tz_convert(target_tz)
 
     # Plot the aggregated data for each SourceIP
     plt.figure(figsize=(12, 6))
@@ -1,4 +1,5 @@
 import pandas as pd
+import dataset_cache as dc
 import games as g
 
 def extract_unique_ports(input_csv, output_csv):
@@ -11,7 +12,7 @@ def extract_unique_ports(input_csv, output_csv):
     - output_csv: Path to save the unique ports.
     """
     # Load input CSV
-    data = pd.read_csv(input_csv)
+    data = dc.load_table(input_csv, columns=["DestinationPort"])
 
     # Extract unique ports from the DestinationPort column
     unique_ports = sorted(data["DestinationPort"].dropna().unique())
@@ -32,7 +33,7 @@ def extract_unique_ports_with_ip_filter(input_csv, output_csv, ip_list):
     - ip_list: List of IPs to filter on SourceIP or DestinationIP.
     """
     # Load input CSV
-    data = pd.read_csv(input_csv)
+    data = dc.load_table(input_csv, columns=["SourceIP", "DestinationPort"])
 
     # Filter rows where SourceIP matches the IP list
     filtered_data = data[(data['SourceIP'].isin(ip_list))]
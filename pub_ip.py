@@ -1,4 +1,5 @@
 import pandas as pd
+import dataset_cache as dc
 import games as g
 
 def extract_destination_ips(input_csv, source_ip_list, output_csv):
@@ -11,7 +12,7 @@ def extract_destination_ips(input_csv, source_ip_list, output_csv):
     - output_csv: Path to save the unique Destination IPs.
     """
     # Load the CSV data
-    data = pd.read_csv(input_csv)
+    data = dc.load_table(input_csv, columns=["SourceIP", "DestinationIP"])
 
     # Filter rows where SourceIP is in the given list
     filtered_data = data[data["SourceIP"].isin(source_ip_list)]
@@ -0,0 +1,826 @@
+import bisect
+import hashlib
+import math
+import mmap
+import os
+import socket
+import struct
+import sys
+from array import array
+from scapy.all import conf, TCP, UDP
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NANO = 0xa1b23c4d
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+PCAPNG_SHB_TYPE = b"\x0a\x0d\x0d\x0a"
+PCAPNG_BYTE_ORDER_MAGIC_LE = b"\x4d\x3c\x2b\x1a"
+PCAPNG_IDB = 1
+PCAPNG_OPB = 2
+PCAPNG_SPB = 3
+PCAPNG_EPB = 6
+PCAPNG_OPT_IF_TSRESOL = 9
+
+PACKET_INDEX_MAGIC = b"PIDX"
+PACKET_INDEX_VERSION = 2
+PACKET_INDEX_STRIDE = 1000  # Records between two entries of the packet index
+PACKET_INDEX_SUFFIX = ".pidx"
+PACKET_INDEX_DIGEST_BYTES = 64 * 1024  # Bytes at the start and end of the PCAP file digested in its packet index
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW_OLD = 12
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+
+ETH_TYPE_IPV4 = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_VLAN = 0x8100
+
+_ipv4_header = struct.Struct("!BBHHHBBH4s4s")
+_tcp_header = struct.Struct("!HHIIB")
+_udp_header = struct.Struct("!HHH")
+_index_header = struct.Struct("<4sHIQQ40s")
+
+
+def _scapy_bound_ports(layer):
+    # Ports on which Scapy dissects the payload into an application layer instead of Raw
+    ports = set()
+    for fields, _cls in layer.payload_guess:
+        for name in ("sport", "dport"):
+            if name in fields:
+                ports.add(fields[name])
+    return frozenset(ports)
+
+
+TCP_BOUND_PORTS = _scapy_bound_ports(TCP)
+UDP_BOUND_PORTS = _scapy_bound_ports(UDP)
+
+
+class RawPacket:
+    """
+    A single capture record: timestamps, lengths and the undecoded link-layer bytes
+    (bytes, or a memoryview of the mapped file for MmapPcapReader).
+    """
+    __slots__ = ("time", "sec", "frac", "caplen", "wirelen", "data", "linktype", "offset", "record")
+
+    def __init__(self, sec, frac, time, caplen, wirelen, data, linktype, offset, record=None):
+        self.sec = sec
+        self.frac = frac
+        self.time = time
+        self.caplen = caplen
+        self.wirelen = wirelen
+        self.data = data
+        self.linktype = linktype
+        self.offset = offset
+        self.record = record  # Whole record (header and data) when read from a mapped file
+
+    def to_scapy(self):
+        """
+        Dissect the record with Scapy, the same way PcapReader would.
+        """
+        ll_cls = conf.l2types.num2layer.get(self.linktype, conf.raw_layer)
+        try:
+            pckt = ll_cls(bytes(self.data))
+        except Exception:
+            pckt = conf.raw_layer(bytes(self.data))
+        pckt.time = self.time
+        pckt.wirelen = self.wirelen
+        return pckt
+
+
+class RawPcapReader:
+    """
+    Sequential libpcap reader that yields RawPacket records without building Scapy objects.
+
+    Parameters:
+    - name: Path to the PCAP file.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.f = open(name, "rb")
+        self.header = self.f.read(GLOBAL_HEADER_LEN)
+        self.parse_header()
+
+    def parse_header(self):
+        # Byte order, timestamp precision and link type from the libpcap global header
+        name = self.name
+        if len(self.header) < GLOBAL_HEADER_LEN:
+            self.f.close()
+            raise ValueError(f"{name} is too short to be a PCAP file")
+
+        magic_le = struct.unpack("<I", self.header[:4])[0]
+        magic_be = struct.unpack(">I", self.header[:4])[0]
+        if magic_le in (PCAP_MAGIC, PCAP_MAGIC_NANO):
+            self.endian, magic = "<", magic_le
+        elif magic_be in (PCAP_MAGIC, PCAP_MAGIC_NANO):
+            self.endian, magic = ">", magic_be
+        elif self.header[:4] == PCAPNG_SHB_TYPE:
+            self.f.close()
+            raise ValueError(f"{name} is a pcapng file, read it with MmapPcapReader (mmap or vector backend)")
+        else:
+            self.f.close()
+            raise ValueError(f"{name} is not a libpcap file (magic {self.header[:4].hex()})")
+
+        self.nano = magic == PCAP_MAGIC_NANO
+        self.tsresol = 1e-9 if self.nano else 1e-6
+        _, _, _, _, self.snaplen, self.linktype = struct.unpack(self.endian + "HHiIII", self.header[4:])
+        self.record_header = struct.Struct(self.endian + "IIII")
+
+    def __iter__(self):
+        unpack_from = self.record_header.unpack_from
+        linktype = self.linktype
+        tsresol = self.tsresol
+        read = self.f.read
+
+        offset = self.f.tell()
+        buf = b""
+        pos = 0
+        while True:
+            if len(buf) - pos < RECORD_HEADER_LEN:
+                buf = buf[pos:] + read(READ_BLOCK_SIZE)
+                pos = 0
+                if len(buf) < RECORD_HEADER_LEN:
+                    return
+            sec, frac, caplen, wirelen = unpack_from(buf, pos)
+            end = pos + RECORD_HEADER_LEN + caplen
+            if end > len(buf):
+                buf = buf[pos:] + read(max(READ_BLOCK_SIZE, end - pos))
+                pos = 0
+                end = RECORD_HEADER_LEN + caplen
+                if end > len(buf):
+                    return  # truncated last record
+            data = buf[pos + RECORD_HEADER_LEN:end]
+            yield RawPacket(sec, frac, sec + frac * tsresol, caplen, wirelen, data, linktype, offset)
+            offset += end - pos
+            pos = end
+
+    def seek(self, offset):
+        """
+        Position the reader on the record starting at byte offset.
+        """
+        self.f.seek(offset)
+
+    def read_range(self, start, end):
+        """
+        Yield the records whose header starts in the byte range [start, end).
+        """
+        self.seek(start)
+        for pckt in self:
+            if pckt.offset >= end:
+                break
+            yield pckt
+
+    def read_time_range(self, start_time=None, end_time=None, index=None):
+        """
+        Yield the records with a timestamp of at least start_time, stopping at the first record
+        after end_time. The reader jumps close to start_time with the packet index instead of
+        reading the capture from its first record.
+
+        Parameters:
+        - start_time: Optional epoch timestamp of the first record to yield.
+        - end_time: Optional epoch timestamp after which reading stops.
+        - index: PacketIndex of the file (loaded or built with load_packet_index by default).
+        """
+        if start_time is not None:
+            index = index or load_packet_index(self.name)
+            self.seek(index.offset_for_time(start_time))
+        for pckt in self:
+            if end_time is not None and pckt.time > end_time:
+                break
+            if start_time is None or pckt.time >= start_time:
+                yield pckt
+
+    def read_packets(self, first, last=None, index=None):
+        """
+        Yield the records number first to last (1-based, inclusive), seeking with the packet index.
+
+        Parameters:
+        - first: Number of the first record.
+        - last: Optional number of the last record (defaults to the end of the file).
+        - index: PacketIndex of the file (loaded or built with load_packet_index by default).
+        """
+        index = index or load_packet_index(self.name)
+        offset, skip = index.offset_for_packet(first)
+        self.seek(offset)
+        number = first - skip - 1
+        for pckt in self:
+            number += 1
+            if number < first:
+                continue
+            if last is not None and number > last:
+                break
+            yield pckt
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MmapPcapReader(RawPcapReader):
+    """
+    Memory-mapped reader for libpcap (both byte orders, micro- or nanosecond timestamps)
+    and pcapng files. Records are yielded as RawPacket whose data and record (header plus
+    data) are memoryview slices of the mapped file, so no packet bytes are copied.
+
+    pcapng timestamps are converted to nanoseconds (nano is True) and every packet carries
+    the link type of its interface. The header attribute is a nanosecond libpcap header with
+    the first interface's link type, so the records of interfaces with that link type can be
+    written with RawPcapWriter (which refuses the others).
+
+    The slices are only valid while the reader is open; copy them (bytes(...)) to keep them.
+
+    Parameters:
+    - name: Path to the PCAP or pcapng file.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.f = open(name, "rb")
+        try:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files cannot be mapped
+            self.f.close()
+            raise ValueError(f"{name} is too short to be a PCAP file")
+        self.view = memoryview(self.mm)
+
+        self.pcapng = bytes(self.view[:4]) == PCAPNG_SHB_TYPE
+        if self.pcapng:
+            self.interfaces = []  # (linktype, units per second) per interface id of the current section
+            pos = 0
+            while pos + 12 <= len(self.view) and not self.interfaces:
+                pos = self.read_pcapng_block(pos)[0]
+            if not self.interfaces:
+                self.close()
+                raise ValueError(f"{name} has no pcapng interface description")
+            self.linktype = self.interfaces[0][0]
+            self.snaplen = self.snaplen or 262144  # 0 means no limit in pcapng
+            self.endian = "<"
+            self.nano = True
+            self.tsresol = 1e-9
+            self.record_header = struct.Struct("<IIII")
+            self.header = struct.pack("<IHHiIII", PCAP_MAGIC_NANO, 2, 4, 0, 0, self.snaplen, self.linktype)
+        else:
+            self.header = bytes(self.view[:GLOBAL_HEADER_LEN])
+            try:
+                self.parse_header()
+            except ValueError:
+                self.close()
+                raise
+            self.f.seek(GLOBAL_HEADER_LEN)
+
+    def __iter__(self):
+        if self.pcapng:
+            yield from self.iter_pcapng()
+            return
+
+        view = self.view
+        size = len(view)
+        unpack_from = self.record_header.unpack_from
+        linktype = self.linktype
+        tsresol = self.tsresol
+        pos = self.f.tell()
+        while pos + RECORD_HEADER_LEN <= size:
+            sec, frac, caplen, wirelen = unpack_from(view, pos)
+            end = pos + RECORD_HEADER_LEN + caplen
+            if end > size:
+                return  # truncated last record
+            yield RawPacket(sec, frac, sec + frac * tsresol, caplen, wirelen,
+                            view[pos + RECORD_HEADER_LEN:end], linktype, pos, view[pos:end])
+            pos = end
+
+    def iter_pcapng(self):
+        pos = self.f.tell()
+        size = len(self.view)
+        while pos + 12 <= size:
+            start = pos
+            pos, pckt = self.read_pcapng_block(pos)
+            if pckt is not None:
+                pckt.offset = start
+                yield pckt
+
+    def read_pcapng_block(self, pos):
+        """
+        Parse the pcapng block at pos.
+
+        Returns:
+        - (offset of the next block, RawPacket or None for non-packet blocks).
+        """
+        view = self.view
+        if bytes(view[pos:pos + 4]) == PCAPNG_SHB_TYPE:
+            # A section header sets the byte order of the blocks that follow it
+            bom = bytes(view[pos + 8:pos + 12])
+            self.endian = "<" if bom == PCAPNG_BYTE_ORDER_MAGIC_LE else ">"
+            self.interfaces = []
+        endian = self.endian
+        block_type, total_len = struct.unpack_from(endian + "II", view, pos)
+        end = pos + total_len
+        if total_len < 12 or end > len(view):
+            return len(view), None  # truncated or corrupt tail
+
+        if block_type == PCAPNG_IDB:
+            linktype, _, snaplen = struct.unpack_from(endian + "HHI", view, pos + 8)
+            units = 10 ** 6
+            opt = pos + 16
+            while opt + 4 <= end - 4:
+                code, length = struct.unpack_from(endian + "HH", view, opt)
+                if code == 0:
+                    break
+                if code == PCAPNG_OPT_IF_TSRESOL and length >= 1:
+                    value = view[opt + 4]
+                    units = 2 ** (value & 0x7F) if value & 0x80 else 10 ** value
+                opt += 4 + (length + 3) // 4 * 4
+            self.interfaces.append((linktype, units))
+            if not self.interfaces[1:]:
+                self.snaplen = snaplen
+            return end, None
+
+        if block_type in (PCAPNG_EPB, PCAPNG_OPB):
+            if block_type == PCAPNG_EPB:
+                interface, ts_high, ts_low, caplen, wirelen = struct.unpack_from(endian + "IIIII", view, pos + 8)
+            else:
+                interface, _, ts_high, ts_low, caplen, wirelen = struct.unpack_from(endian + "HHIIII", view, pos + 8)
+            data_start = pos + 28
+        elif block_type == PCAPNG_SPB:
+            interface, ts_high, ts_low = 0, 0, 0
+            wirelen = struct.unpack_from(endian + "I", view, pos + 8)[0]
+            caplen = min(wirelen, total_len - 16)
+            data_start = pos + 12
+        else:
+            return end, None
+
+        linktype, units = self.interfaces[interface]
+        ts = (ts_high << 32) | ts_low
+        sec, rest = divmod(ts, units)
+        frac = rest * 1000000000 // units
+        return end, RawPacket(sec, frac, sec + frac * 1e-9, caplen, wirelen,
+                              view[data_start:data_start + caplen], linktype, pos, view[pos:end])
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            pass  # Slices of the mapping are still referenced, it is unmapped once they are released
+        self.f.close()
+
+
+class RawPcapWriter:
+    """
+    Write RawPacket records unchanged to a PCAP file with the global header of the source capture.
+    The header has a single link type, so write raises ValueError for a record of another link
+    type (an interface of a multi-interface pcapng file) instead of writing a corrupt frame.
+
+    Parameters:
+    - path: Output PCAP file path.
+    - reader: RawPcapReader the records come from (provides header and byte order).
+    - append: Append to an existing file instead of truncating it.
+    - buffer_size: Size of the write buffer in bytes.
+    """
+
+    def __init__(self, path, reader, append=False, buffer_size=256 * 1024):
+        self.path = path
+        self.pack = reader.record_header.pack
+        self.linktype = reader.linktype
+        self.f = open(path, "ab" if append else "wb", buffering=buffer_size)
+        if self.f.tell() == 0:
+            self.f.write(reader.header)
+
+    def write(self, pckt):
+        if pckt.linktype != self.linktype:
+            raise ValueError(f"Cannot write a link type {pckt.linktype} record to {self.path} (link type {self.linktype})")
+        self.f.write(self.pack(pckt.sec, pckt.frac, pckt.caplen, pckt.wirelen))
+        self.f.write(pckt.data)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_record_headers(reader):
+    """
+    Walk the record headers of an open RawPcapReader from its current position without
+    copying the packet data.
+
+    Yields:
+    - (offset, sec, frac, caplen) of every record, in file order.
+    """
+    unpack_from = reader.record_header.unpack_from
+    read = reader.f.read
+    offset = reader.f.tell()
+    buf = b""
+    pos = 0
+    while True:
+        if len(buf) - pos < RECORD_HEADER_LEN:
+            buf = buf[pos:] + read(READ_BLOCK_SIZE)
+            pos = 0
+            if len(buf) < RECORD_HEADER_LEN:
+                return
+        sec, frac, caplen, _ = unpack_from(buf, pos)
+        end = pos + RECORD_HEADER_LEN + caplen
+        if end > len(buf):
+            buf = buf[pos:] + read(max(READ_BLOCK_SIZE, end - pos))
+            pos = 0
+            end = RECORD_HEADER_LEN + caplen
+            if end > len(buf):
+                return  # truncated last record
+        yield offset, sec, frac, caplen
+        offset += end - pos
+        pos = end
+
+
+def iter_record_chunks(reader, chunk_bytes=READ_BLOCK_SIZE):
+    """
+    Read an open RawPcapReader from its current position as chunks of whole records, so the
+    records can be decoded elsewhere (see iter_buffer_records). A truncated last record is dropped.
+
+    Yields:
+    - (offset, data): File offset of the first record and the bytes of about chunk_bytes of records.
+    """
+    unpack_from = reader.record_header.unpack_from
+    read = reader.f.read
+    offset = reader.f.tell()
+    buf = b""
+    while True:
+        data = read(chunk_bytes)
+        buf = buf + data if buf else data
+        # Cut after the last complete record of the buffer
+        pos = 0
+        while pos + RECORD_HEADER_LEN <= len(buf):
+            end = pos + RECORD_HEADER_LEN + unpack_from(buf, pos)[2]
+            if end > len(buf):
+                break
+            pos = end
+        if pos:
+            yield offset, buf[:pos]
+            offset += pos
+            buf = buf[pos:]
+        if not data:
+            return
+
+
+def iter_buffer_records(buf, record_header, tsresol, linktype, offset=0):
+    """
+    Yield the RawPacket records of a bytes buffer holding whole records (see iter_record_chunks).
+
+    Parameters:
+    - buf: Record bytes.
+    - record_header: struct.Struct of the record headers (RawPcapReader.record_header).
+    - tsresol: Seconds per timestamp fraction unit (1e-6 or 1e-9).
+    - linktype: Link type of the capture.
+    - offset: File offset of the first record.
+    """
+    unpack_from = record_header.unpack_from
+    pos = 0
+    while pos + RECORD_HEADER_LEN <= len(buf):
+        sec, frac, caplen, wirelen = unpack_from(buf, pos)
+        end = pos + RECORD_HEADER_LEN + caplen
+        if end > len(buf):
+            return
+        yield RawPacket(sec, frac, sec + frac * tsresol, caplen, wirelen, buf[pos + RECORD_HEADER_LEN:end], linktype, offset + pos)
+        pos = end
+
+
+def scan_record_offsets(name):
+    """
+    Walk the record headers of a PCAP file and return the byte offset of every record.
+
+    Parameters:
+    - name: Path to the PCAP file.
+
+    Returns:
+    - array('Q') of record offsets, in file order.
+    """
+    with RawPcapReader(name) as reader:
+        return array("Q", (offset for offset, _, _, _ in iter_record_headers(reader)))
+
+
+class PacketIndex:
+    """
+    Sparse index of a PCAP file: the byte offset of every stride-th record (records 0, stride,
+    2 * stride, ...) and the latest timestamp seen up to each of them. Keeping the running
+    maximum makes the times sorted, so binary search also works for slightly out of order captures.
+
+    Parameters:
+    - stride: Records between two index entries.
+    - size: Size of the PCAP file when it was indexed.
+    - times: array('d') of running maximum timestamps.
+    - offsets: array('Q') of record offsets.
+    - digest: Digests of the first and last bytes of the PCAP file, see file_digest.
+    """
+
+    def __init__(self, stride, size, times, offsets, digest):
+        self.stride = stride
+        self.size = size
+        self.times = times
+        self.offsets = offsets
+        self.digest = digest
+
+    def offset_for_time(self, start_time):
+        """
+        Offset of a record such that every record before it is older than start_time.
+        """
+        i = bisect.bisect_left(self.times, start_time) - 1
+        return self.offsets[max(i, 0)] if self.offsets else GLOBAL_HEADER_LEN
+
+    def offset_for_packet(self, number):
+        """
+        Offset of the closest indexed record before packet number (1-based) and the number
+        of records to skip from there.
+        """
+        i = min((number - 1) // self.stride, len(self.offsets) - 1)
+        if i < 0:
+            return (self.offsets[0] if self.offsets else GLOBAL_HEADER_LEN), number - 1
+        return self.offsets[i], number - 1 - i * self.stride
+
+    def save(self, path):
+        times, offsets = array("d", self.times), array("Q", self.offsets)
+        if sys.byteorder == "big":
+            times.byteswap()
+            offsets.byteswap()
+        with open(path, "wb") as f:
+            f.write(_index_header.pack(PACKET_INDEX_MAGIC, PACKET_INDEX_VERSION, self.stride, self.size, len(offsets), self.digest))
+            f.write(times.tobytes())
+            f.write(offsets.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, version, stride, size, count, digest = _index_header.unpack(f.read(_index_header.size))
+            if magic != PACKET_INDEX_MAGIC or version != PACKET_INDEX_VERSION:
+                raise ValueError(f"{path} is not a packet index")
+            times, offsets = array("d"), array("Q")
+            times.frombytes(f.read(8 * count))
+            offsets.frombytes(f.read(8 * count))
+        if sys.byteorder == "big":
+            times.byteswap()
+            offsets.byteswap()
+        return cls(stride, size, times, offsets, digest)
+
+
+def build_packet_index(name, stride=PACKET_INDEX_STRIDE):
+    """
+    Index every stride-th record of a PCAP or pcapng file and save the index next to it (<name>.pidx).
+    The offsets are those of MmapPcapReader records (block offsets in pcapng files).
+
+    Returns:
+    - The PacketIndex.
+    """
+    times, offsets = array("d"), array("Q")
+    latest = -math.inf
+    with MmapPcapReader(name) as reader:
+        tsresol = reader.tsresol
+        if reader.pcapng:
+            records = ((pckt.offset, pckt.sec, pckt.frac, pckt.caplen) for pckt in reader)
+        else:
+            records = iter_record_headers(reader)
+        for i, (offset, sec, frac, _) in enumerate(records):
+            latest = max(latest, sec + frac * tsresol)
+            if i % stride == 0:
+                times.append(latest)
+                offsets.append(offset)
+    size = os.path.getsize(name)
+    index = PacketIndex(stride, size, times, offsets, file_digest(name, size))
+    try:
+        index.save(name + PACKET_INDEX_SUFFIX)
+    except OSError as e:
+        print(f"Could not save the packet index of {name}: {e}")
+    return index
+
+
+def file_digest(name, size):
+    """
+    SHA-1 digests of the first and last PACKET_INDEX_DIGEST_BYTES of a file (40 bytes), telling a
+    rewritten file of the same size from the indexed one.
+    """
+    with open(name, "rb") as f:
+        head = hashlib.sha1(f.read(min(size, PACKET_INDEX_DIGEST_BYTES))).digest()
+        f.seek(size - min(size, PACKET_INDEX_DIGEST_BYTES))
+        tail = hashlib.sha1(f.read(min(size, PACKET_INDEX_DIGEST_BYTES))).digest()
+    return head + tail
+
+
+def load_packet_index(name):
+    """
+    Load the packet index of a PCAP file, building it when it is missing or the file changed
+    (size and digests of its first and last bytes).
+    """
+    try:
+        index = PacketIndex.load(name + PACKET_INDEX_SUFFIX)
+        size = os.path.getsize(name)
+        if index.size == size and index.digest == file_digest(name, size):
+            return index
+    except (OSError, ValueError, struct.error):
+        pass
+    return build_packet_index(name)
+
+
+def ipv4_offset(data, linktype):
+    """
+    Locate the IPv4 header inside a link-layer frame.
+
+    Returns the header offset, -1 for frames that cannot carry IP (e.g. ARP),
+    or None when the frame needs a full Scapy dissection to be interpreted.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        off = 12
+        eth_type = (data[off] << 8) | data[off + 1]
+        while eth_type == ETH_TYPE_VLAN:
+            off += 4
+            if len(data) < off + 2:
+                return None
+            eth_type = (data[off] << 8) | data[off + 1]
+        off += 2
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_RAW_OLD, LINKTYPE_IPV4):
+        if not data or data[0] >> 4 != 4:
+            return None
+        return 0
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None
+        eth_type = (data[14] << 8) | data[15]
+        off = 16
+    else:
+        return None
+
+    if eth_type == ETH_TYPE_IPV4:
+        return off
+    if eth_type == ETH_TYPE_ARP:
+        return -1
+    return None
+
+
+def transport_ports(data, linktype):
+    """
+    Return (proto, sport, dport) of a non-fragmented IPv4 TCP/UDP frame,
+    or None when the ports cannot be read from the bytes alone.
+    """
+    off = ipv4_offset(data, linktype)
+    if off is None or off < 0 or len(data) < off + 20 or data[off] >> 4 != 4:
+        return None
+    ihl = (data[off] & 0x0F) << 2
+    proto = data[off + 9]
+    l4 = off + ihl
+    if proto not in (6, 17) or ihl < 20 or len(data) < l4 + 4:
+        return None
+    if ((data[off + 6] << 8) | data[off + 7]) & 0x3FFF:
+        return None
+    return proto, (data[l4] << 8) | data[l4 + 1], (data[l4 + 2] << 8) | data[l4 + 3]
+
+
+def ipv4_in_place_ok(pckt, off):
+    """
+    True when the IPv4 header at off can be edited in place with the same result as a
+    Scapy dissect/rebuild: the header is complete and, for truncated records, the TCP/UDP
+    header is too (Scapy would fill missing fields with defaults when rebuilding).
+    """
+    data = pckt.data
+    if len(data) < off + 20 or data[off] >> 4 != 4:
+        return False
+    ihl = (data[off] & 0x0F) << 2
+    if ihl < 20 or len(data) < off + ihl:
+        return False
+    if pckt.caplen >= pckt.wirelen:
+        return True
+    l4 = off + ihl
+    proto = data[off + 9]
+    if proto == 6:
+        return len(data) >= l4 + 13 and len(data) >= l4 + ((data[l4 + 12] >> 4) << 2)
+    if proto == 17:
+        return len(data) >= l4 + 8
+    return False
+
+
+def ipv4_header_checksum(data, off, ihl):
+    # Internet checksum of the IPv4 header at off, computed with the checksum field as zero
+    words = struct.unpack_from("!%dH" % (ihl // 2), data, off)
+    total = sum(words) - words[5]
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def update_checksum(checksum, old, new):
+    """
+    Incrementally update an Internet checksum after old bytes were replaced by new ones
+    (RFC 1624, eqn. 3: HC' = ~(~HC + ~m + m') for every 16-bit word).
+    """
+    total = ~checksum & 0xFFFF
+    for i in range(0, len(old), 2):
+        total += (~((old[i] << 8) | old[i + 1]) & 0xFFFF) + ((new[i] << 8) | new[i + 1])
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def update_l4_checksum(buf, off, ihl, old_addresses, new_addresses):
+    """
+    Patch the TCP/UDP checksum of the packet in buf after its IPv4 addresses changed.
+    Non-first fragments, headers outside the captured bytes and UDP without checksum are left alone.
+    """
+    if ((buf[off + 6] << 8) | buf[off + 7]) & 0x1FFF:
+        return
+    proto = buf[off + 9]
+    if proto == 6:
+        pos = off + ihl + 16
+    elif proto == 17:
+        pos = off + ihl + 6
+    else:
+        return
+    if len(buf) < pos + 2:
+        return
+    checksum = (buf[pos] << 8) | buf[pos + 1]
+    if proto == 17 and checksum == 0:
+        return
+    checksum = update_checksum(checksum, old_addresses, new_addresses)
+    if proto == 17 and checksum == 0:
+        checksum = 0xFFFF
+    buf[pos:pos + 2] = checksum.to_bytes(2, "big")
+
+
+def ipv4_addresses(pckt):
+    """
+    Return the (src, dst) IPv4 addresses of a record as 4-byte strings, None if it has no IP layer.
+    Frames the byte-level parser cannot interpret are dissected with Scapy.
+    """
+    data = pckt.data
+    off = ipv4_offset(data, pckt.linktype)
+    if off is not None and off >= 0 and len(data) >= off + 20 and data[off] >> 4 == 4:
+        return data[off + 12:off + 16], data[off + 16:off + 20]
+    if off is not None and off < 0:
+        return None
+
+    scapy_pckt = pckt.to_scapy()
+    if not scapy_pckt.haslayer("IP"):
+        return None
+    ip = scapy_pckt["IP"]
+    return socket.inet_aton(ip.src), socket.inet_aton(ip.dst)
+
+
+def decode_transport(data, linktype):
+    """
+    Decode the IPv4 and TCP/UDP headers of a frame straight from its bytes.
+
+    Returns a tuple (proto, src, dst, sport, dport, seq, ack, ip_len, load) for
+    IPv4 TCP/UDP packets, or None when the frame must be handed to Scapy to get
+    identical results (non-IPv4, fragments, tunnels, ports with a Scapy dissector, ...).
+    """
+    off = ipv4_offset(data, linktype)
+    if off is None or off < 0:
+        return None
+
+    size = len(data)
+    if size < off + 20:
+        return None
+    ver_ihl, _, ip_len, _, flags_frag, _, proto, _, src, dst = _ipv4_header.unpack_from(data, off)
+    ihl = (ver_ihl & 0x0F) << 2
+    if ver_ihl >> 4 != 4 or ihl < 20 or size < off + ihl or ip_len < ihl:
+        return None
+    if flags_frag & 0x3FFF:
+        return None  # fragments, let Scapy decide how much of the L4 header it sees
+
+    l4 = off + ihl
+    end = min(off + ip_len, size)
+
+    if proto == 6:
+        if end - l4 < 20:
+            return None
+        sport, dport, seq, ack, dataofs = _tcp_header.unpack_from(data, l4)
+        hdr_len = (dataofs >> 4) << 2
+        if hdr_len < 20 or l4 + hdr_len > end:
+            return None
+        load = data[l4 + hdr_len:end]
+        if load and (sport in TCP_BOUND_PORTS or dport in TCP_BOUND_PORTS):
+            return None
+        return (proto, socket.inet_ntoa(src), socket.inet_ntoa(dst), sport, dport, seq, ack, ip_len, load)
+
+    if proto == 17:
+        if end - l4 < 8:
+            return None
+        sport, dport, udp_len = _udp_header.unpack_from(data, l4)
+        if udp_len < 8:
+            return None
+        load = data[l4 + 8:min(end, l4 + udp_len)]
+        if load and (sport in UDP_BOUND_PORTS or dport in UDP_BOUND_PORTS):
+            return None
+        return (proto, socket.inet_ntoa(src), socket.inet_ntoa(dst), sport, dport, 0, 0, ip_len, load)
+
+    return None
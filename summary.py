@@ -1,63 +1,184 @@
+import os
+import numpy as np
 import pandas as pd
+import dataset_cache as dc
 import games as g
 
+SUMMARY_COLUMNS = ["Time", "SourceIP", "DestinationIP", "Length"]
+PAIR_COLUMNS = ["SourceIP", "DestinationIP", "Count", "First", "Last", "Bytes"]
+
+# IP lists of games.py summarized by generate_summary_tables
+GAME_GROUPS = {
+    "CLASH_ROYALE": g.CLASH_ROYALE,
+    "EAFC": g.EAFC,
+    "BRAWLHALLA": g.BRAWLHALLA,
+    "ROCKET_LEAGUE": g.ROCKET_LEAGUE,
+    "CHESS": g.CHESS,
+    "MGMT": g.MGMT,
+}
+
 def generate_summary_table(csv_file, ip_list):
     """
     Generates a summary table similar to the given format from the CSV file,
     filtering on a specified list of IPs.
 
     Parameters:
-        csv_file (str): Path to the CSV file.
+        csv_file (str): Path to the CSV (or Parquet) file.
         ip_list (list): List of IPs to filter the data.
 
     Returns:
         summary_table (pd.DataFrame): A summary table as a DataFrame.
     """
-    # Load the CSV file
-    df = pd.read_csv(csv_file)
+    pairs, ips = load_pair_table(csv_file)
+    return summarize_pairs(pairs, ips, ip_list)
+
+def generate_summary_tables(csv_file, ip_groups=GAME_GROUPS):
+    """
+    Generates the summary table of several IP lists, loading the CSV file only once.
+
+    Parameters:
+        csv_file (str): Path to the CSV (or Parquet) file.
+        ip_groups (dict): Mapping of group name to list of IPs, defaults to the games in games.py.
+
+    Returns:
+        summary_tables (dict): Mapping of group name to its summary table.
+    """
+    pairs, ips = load_pair_table(csv_file)
+    return {name: summarize_pairs(pairs, ips, ip_list) for name, ip_list in ip_groups.items()}
+
+def load_pair_table(csv_file):
+    """
+    Load a metadata file and aggregate it per (SourceIP, DestinationIP) pair in one grouped pass.
+
+    IPs are integer-encoded in sorted order (0 for missing), so each pair is a single integer key
+    and the pairs come out in the same order as a groupby on the IP strings.
+
+    Returns:
+        pairs (pd.DataFrame): Src, Dst codes with Count, First, Last (Time) and Bytes (Length sum) per pair.
+        ips (np.ndarray): The IP string of every code, index 0 being missing.
+    """
+    df = dc.load_table(csv_file, columns=SUMMARY_COLUMNS)
 
     # Ensure necessary columns exist
-    required_columns = ["Time", "SourceIP", "DestinationIP", "Length"]
-    if not set(required_columns).issubset(df.columns):
+    if not set(SUMMARY_COLUMNS).issubset(df.columns):
         raise ValueError("CSV file must include the following columns: Time, SourceIP, DestinationIP, Length")
 
-    # Filter rows where SourceIP or DestinationIP is in the ip_list
-    df = df[(df['SourceIP'].isin(ip_list)) | (df['DestinationIP'].isin(ip_list))]
+    return pair_table(df)
 
-    # Total messages in each direction
-    client_to_server = df[df['DestinationIP'].isin(ip_list)].shape[0]
-    server_to_client = df[df['SourceIP'].isin(ip_list)].shape[0]
+def pair_table(df):
+    """
+    Aggregate a DataFrame of metadata rows (with SUMMARY_COLUMNS) per (SourceIP, DestinationIP) pair,
+    see load_pair_table.
+    """
+    codes, uniques = pd.factorize(pd.concat([df["SourceIP"], df["DestinationIP"]], ignore_index=True), sort=True)
+    codes = codes.astype(np.int64) + 1  # Missing IPs (-1) become 0
+    n = len(uniques) + 1
+    src, dst = codes[:len(df)], codes[len(df):]
+
+    grouped = pd.DataFrame({"Key": src * n + dst, "Time": df["Time"].to_numpy(), "Length": df["Length"].to_numpy()})
+    pairs = grouped.groupby("Key").agg(Count=("Time", "size"), First=("Time", "min"), Last=("Time", "max"), Bytes=("Length", "sum"))
+    keys = pairs.index.to_numpy()
+    pairs = pairs.reset_index(drop=True)
+    pairs["Src"] = keys // n
+    pairs["Dst"] = keys % n
+
+    ips = np.concatenate([np.array([None], dtype=object), np.asarray(uniques, dtype=object)])
+    return pairs, ips
+
+def pairs_to_frame(pairs, ips):
+    # Pair table with the IPs as strings (None when missing), the rows of a pair CSV
+    return pd.DataFrame({
+        "SourceIP": ips[pairs["Src"].to_numpy()], "DestinationIP": ips[pairs["Dst"].to_numpy()],
+        "Count": pairs["Count"].to_numpy(), "First": pairs["First"].to_numpy(),
+        "Last": pairs["Last"].to_numpy(), "Bytes": pairs["Bytes"].to_numpy(),
+    }, columns=PAIR_COLUMNS)
+
+def frame_to_pairs(frame):
+    # (pairs, ips) of load_pair_table from pair CSV rows
+    codes, uniques = pd.factorize(pd.concat([frame["SourceIP"], frame["DestinationIP"]], ignore_index=True), sort=True)
+    codes = codes.astype(np.int64) + 1  # Missing IPs (-1) become 0
+    pairs = frame[["Count", "First", "Last", "Bytes"]].reset_index(drop=True)
+    pairs["Src"] = codes[:len(frame)]
+    pairs["Dst"] = codes[len(frame):]
+    ips = np.concatenate([np.array([None], dtype=object), np.asarray(uniques, dtype=object)])
+    return pairs, ips
+
+def update_pair_csv(pair_csv, metadata):
+    """
+    Add metadata rows to a pair CSV, the per-pair aggregates of load_pair_table with the IPs as
+    strings (PAIR_COLUMNS). Counts and bytes are summed and first/last times merged, so the CSV
+    of a growing metadata file can be updated with its new rows only.
+
+    Parameters:
+        pair_csv (str): Path of the pair CSV, created when missing.
+        metadata (pd.DataFrame): New metadata rows, with SUMMARY_COLUMNS.
+    """
+    new = pairs_to_frame(*pair_table(metadata))
+    if os.path.isfile(pair_csv):
+        frame = pd.concat([pd.read_csv(pair_csv), new], ignore_index=True)
+        new = frame.groupby(["SourceIP", "DestinationIP"], dropna=False, sort=False).agg(
+            Count=("Count", "sum"), First=("First", "min"), Last=("Last", "max"), Bytes=("Bytes", "sum")).reset_index()
+    new.to_csv(pair_csv, index=False)
+
+def generate_pair_summary_tables(pair_csv, ip_groups=GAME_GROUPS):
+    """
+    Same as generate_summary_tables, computed from a pair CSV (see update_pair_csv) instead of the metadata.
+
+    Parameters:
+        pair_csv (str): Path of the pair CSV.
+        ip_groups (dict): Mapping of group name to list of IPs, defaults to the games in games.py.
+
+    Returns:
+        summary_tables (dict): Mapping of group name to its summary table.
+    """
+    pairs, ips = frame_to_pairs(pd.read_csv(pair_csv))
+    return {name: summarize_pairs(pairs, ips, ip_list) for name, ip_list in ip_groups.items()}
 
-    # Total sessions (unique client-server pairs)
-    #unique_sessions = df.groupby(['SourceIP', 'DestinationIP']).ngroups
+def summarize_pairs(pairs, ips, ip_list):
+    """
+    Compute the summary table of one IP list from the pair table of load_pair_table.
+    """
+    member = pd.Series(ips).isin(ip_list).to_numpy(copy=True)
+    member[0] = False
+    src_in = member[pairs["Src"].to_numpy()]
+    dst_in = member[pairs["Dst"].to_numpy()]
 
-    # Alternative method to calculate unique sessions (both directions are counted as a single association)
-    df['SessionKey'] = df.apply(lambda row: tuple(sorted([row['SourceIP'], row['DestinationIP']])), axis=1)
-    unique_sessions = df['SessionKey'].nunique()
+    # Keep pairs where SourceIP or DestinationIP is in the ip_list
+    selected = src_in | dst_in
+    df = pairs[selected]
+    src_in, dst_in = src_in[selected], dst_in[selected]
+
+    # Total messages in each direction
+    client_to_server = int(df["Count"][dst_in].sum())
+    server_to_client = int(df["Count"][src_in].sum())
 
+    # Total sessions, both directions are counted as a single association
+    low = np.minimum(df["Src"], df["Dst"])
+    high = np.maximum(df["Src"], df["Dst"])
+    unique_sessions = len(np.unique(low * len(ips) + high))
 
-    # Session durations (if time is in epoch seconds)
-    df['Time'] = pd.to_datetime(df['Time'], unit='s')
-    session_durations = df.groupby(['SourceIP', 'DestinationIP'])['Time'].agg([min, max])
-    session_durations['Duration'] = (session_durations['max'] - session_durations['min']).dt.total_seconds()
+    # Sessions with a missing IP are not grouped, as in a groupby on the IP columns
+    sessions = df[(df["Src"] > 0) & (df["Dst"] > 0)]
 
-    avg_session_duration = session_durations['Duration'].mean()
-    median_session_duration = session_durations['Duration'].median()
-    std_session_duration = session_durations['Duration'].std()
+    # Session durations (time is in epoch seconds)
+    durations = (sessions["Last"] - sessions["First"]).astype(float)
+    avg_session_duration = durations.mean()
+    median_session_duration = durations.median()
+    std_session_duration = durations.std()
 
     # Messages per session
-    msgs_per_session = df.groupby(['SourceIP', 'DestinationIP']).size()
+    msgs_per_session = sessions["Count"]
     avg_msgs = msgs_per_session.mean()
     median_msgs = msgs_per_session.median()
     std_msgs = msgs_per_session.std()
 
     # Bit rates in KBps (Length column)
-    total_length = df['Length'].sum() / 1024  # Convert to KB
-    total_duration = (df['Time'].max() - df['Time'].min()).total_seconds()
+    total_length = df["Bytes"].sum() / 1024  # Convert to KB
+    total_duration = float(df["Last"].max() - df["First"].min())
     avg_bitrate = total_length / total_duration if total_duration > 0 else 0
 
     # Log size (approximate size of all packets in bytes)
-    log_size = df['Length'].sum() / (1024 * 1024)  # Convert to MB
+    log_size = df["Bytes"].sum() / (1024 * 1024)  # Convert to MB
 
     # Create a summary dictionary
     summary_data = {
@@ -75,15 +196,6 @@ def generate_summary_table(csv_file, ip_list):
     summary_table = pd.DataFrame(summary_data.items(), columns=['Metric', 'Value'])
     return summary_table
 
-#summary_table = generate_summary_table("csv/28_06_1000-1330_metadata.csv", g.CLASH_ROYALE)
-#print(summary_table)
-#summary_table = generate_summary_table("csv/28_06_1000-1330_metadata.csv", g.ROCKET_LEAGUE)
-#print(summary_table)
-#summary_table = generate_summary_table("csv/28_06_1000-1330_metadata.csv", g.EAFC)
-#print(summary_table)
-#summary_table = generate_summary_table("csv/28_06_1000-1330_metadata.csv", g.CHESS)
-#print(summary_table)
-#summary_table = generate_summary_table("csv/28_06_1000-1330_metadata.csv", g.BRAWLHALLA)
-#print(summary_table)
-#summary_table = generate_summary_table("csv/28_06_1000-1330_metadata.csv", g.MGMT)
-#print(summary_table)
\ No newline at end of file
+#for game, summary_table in generate_summary_tables("csv/28_06_1000-1330_metadata.csv").items():
+#    print(game)
+#    print(summary_table)
@@ -0,0 +1,371 @@
+import base64
+import itertools
+import os
+import re
+import socket
+import struct
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet is optional, CSV input/output works without pyarrow
+    pa = None
+    pq = None
+
+# Column types of the Parquet outputs; IPv4 addresses are stored as uint32
+CSV_TYPES = {
+    "Time": "uint32", "No": "uint32", "SourceIP": "ip", "DestinationIP": "ip",
+    "SourcePort": "uint16", "DestinationPort": "uint16", "SequenceNumber": "uint32",
+    "AcknowledgementNumber": "uint32", "Protocol": "category", "Length": "uint16", "Load": "string"
+}
+METADATA_TYPES = {k: v for k, v in CSV_TYPES.items() if k != "Load"}
+PAYLOAD_TYPES = {"No": "uint32", "Length": "uint16", "Payload": "string"}
+PAYLOAD_KEYS = ["No", "Length", "Load"]
+
+IP_COLUMNS = ("SourceIP", "DestinationIP")
+# Columns of the CSV outputs written as integers, missing values as 0
+CSV_INT_COLUMNS = ("Time", "No", "SourcePort", "DestinationPort", "SequenceNumber", "AcknowledgementNumber", "Length")
+CSV_BUFFER_SIZE = 1024 * 1024  # Bytes CsvChunkWriter buffers between two writes to its file
+ROW_GROUP_SIZE = 128 * 1024
+CHUNK_ROWS = 1000000  # Rows per chunk of iter_table
+
+
+def is_parquet(path):
+    return str(path).endswith((".parquet", ".pq"))
+
+
+def is_pcap(path):
+    return str(path).endswith((".pcap", ".pcapng", ".cap"))
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet support requires pyarrow (pip install pyarrow)")
+
+
+def ip_to_int(ip):
+    # Dotted IPv4 string to integer, None for empty/IPv6 values
+    try:
+        return struct.unpack("!I", socket.inet_aton(ip))[0]
+    except (OSError, TypeError):
+        return None
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+
+def arrow_type(kind):
+    if kind == "ip":
+        return pa.uint32()
+    if kind == "category":
+        return pa.dictionary(pa.int8(), pa.string())
+    return pa.type_for_alias(kind)
+
+
+class ParquetChunkWriter:
+    """
+    Write chunks of packet dicts (as produced by packet_processing) to a typed Parquet file.
+
+    Parameters:
+    - path: Output Parquet file path.
+    - types: Mapping of column name to type, e.g. METADATA_TYPES.
+    - keys: Dict keys feeding each column, in column order (defaults to the column names).
+    - row_group_size: Rows buffered before a row group is written.
+    """
+
+    def __init__(self, path, types, keys=None, row_group_size=ROW_GROUP_SIZE):
+        require_pyarrow()
+        self.path = path
+        self.types = types
+        self.keys = keys or list(types)
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([(name, arrow_type(kind)) for name, kind in types.items()])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def write(self, chunk):
+        self.rows.extend(chunk)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def write_frame(self, frame):
+        """
+        Write a DataFrame whose columns are the dict keys of write(), e.g. a block of vector_decode.
+        """
+        self.flush()
+        if len(frame):
+            self.write_columns([frame[key].tolist() for key in self.keys])
+
+    def flush(self):
+        if not self.rows:
+            return
+        self.write_columns([[row.get(key) for row in self.rows] for key in self.keys])
+        self.rows = []
+
+    def write_columns(self, columns):
+        arrays = []
+        for (name, kind), values in zip(self.types.items(), columns):
+            if kind == "ip":
+                arrays.append(pa.array([ip_to_int(v) for v in values], type=pa.uint32()))
+            elif kind == "category":
+                # Empty strings become nulls, the same values pd.read_csv gives for the CSV output
+                arrays.append(pa.array([v or None for v in values], type=pa.string()).dictionary_encode().cast(arrow_type(kind)))
+            elif kind == "string":
+                arrays.append(pa.array([v or None for v in encode_payloads(values)], type=pa.string()))
+            else:
+                # Same as write_chunk_to_csv: missing numbers are written as 0
+                arrays.append(pa.array([v or 0 for v in values], type=arrow_type(kind)))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema), row_group_size=self.row_group_size)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class CsvChunkWriter:
+    """
+    Write chunks of packet dicts (as produced by packet_processing) to a CSV file kept open.
+
+    The rows are formatted column by column straight into text, byte-identical to the
+    DataFrame.to_csv output of write_chunk_to_csv: one column per dict key, integer columns as
+    integers (missing values as 0), raw payloads as base64, None as an empty field and text
+    quoted only when needed. The header is written once, when the file is created.
+
+    Parameters:
+    - path: Output CSV file path.
+    - columns: CSV header columns.
+    - int_columns: Keys of the columns written as integers.
+    - append: Append to an existing CSV instead of creating it with a header.
+    - buffer_size: Bytes buffered before they are written to the file.
+    """
+
+    def __init__(self, path, columns, int_columns=CSV_INT_COLUMNS, append=False, buffer_size=CSV_BUFFER_SIZE):
+        self.path = path
+        self.columns = list(columns)
+        self.int_columns = int_columns
+        self.f = open(path, 'ab' if append else 'wb', buffering=buffer_size)
+        self.position = self.f.tell()  # Size of the file once the buffer is flushed
+        if not append:
+            self.write_text(format_csv_header(self.columns))
+
+    def write(self, chunk):
+        self.write_text(format_csv_rows(chunk, self.int_columns))
+
+    def write_frame(self, frame):
+        """
+        Write a DataFrame whose columns are the dict keys of write(), e.g. a block of vector_decode.
+        """
+        self.write_text(format_csv_frame(frame))
+
+    def write_text(self, text):
+        data = text.encode('utf-8')
+        self.f.write(data)
+        self.position += len(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def format_csv_header(columns):
+    return ",".join(csv_text(column) for column in columns) + os.linesep
+
+
+def format_csv_rows(rows, int_columns=CSV_INT_COLUMNS):
+    """
+    Format packet dicts as CSV lines, the same text as pd.DataFrame(rows).to_csv without header
+    and index once the int_columns are converted with fillna(0).astype(int) and the raw
+    payloads of Load encoded with encode_payloads.
+
+    Parameters:
+    - rows: List of dicts, every key is a column (in order of appearance, missing values as None).
+    - int_columns: Keys of the columns written as integers.
+    """
+    keys = list(dict.fromkeys(itertools.chain.from_iterable(rows)))
+    if not keys:
+        return os.linesep * len(rows)  # Empty dicts (packets without metadata) give empty lines
+    if len(keys) == 1:
+        return pandas_csv_rows(rows, keys, int_columns)  # Single empty fields are quoted
+    fields = []
+    for key in keys:
+        values = [row.get(key) for row in rows]
+        if key == "Load":
+            fields.append(encode_payloads(values))
+        elif key in int_columns:
+            fields.append([str(v) if type(v) is int else int_text(v) for v in values])
+        else:
+            texts = text_fields(values)
+            if texts is None:
+                return pandas_csv_rows(rows, keys, int_columns)
+            fields.append(texts)
+    return join_csv_fields(fields)
+
+
+def format_csv_frame(frame):
+    """
+    Format a DataFrame of packet rows as CSV lines, the same text as frame.to_csv without header
+    and index once the raw payloads of Load are encoded with encode_payloads.
+    """
+    keys = list(frame.columns)
+    if not len(frame):
+        return ""
+    if len(keys) == 1:
+        return pandas_csv_frame(frame)  # Single empty fields are quoted
+    fields = []
+    for key in keys:
+        column = frame[key]
+        if key == "Load":
+            fields.append(encode_payloads(column.tolist()))
+        elif column.dtype.kind in "iu":
+            fields.append(list(map(str, column.tolist())))
+        else:
+            texts = text_fields(column.tolist()) if column.dtype.kind in "OT" else None
+            if texts is None:
+                return pandas_csv_frame(frame)
+            fields.append(texts)
+    return join_csv_fields(fields)
+
+
+def pandas_csv_frame(frame):
+    # The DataFrame formatting of format_csv_frame, for columns of other types than integers and text
+    if "Load" in frame.columns:
+        frame = frame.assign(Load=encode_payloads(frame["Load"].tolist()))
+    return frame.to_csv(None, index=False, header=False)
+
+
+def pandas_csv_rows(rows, keys, int_columns):
+    # The DataFrame formatting of format_csv_rows, for values whose column type only pandas infers
+    df = pd.DataFrame(rows, columns=keys)
+    if "Load" in df.columns:
+        df["Load"] = encode_payloads(df["Load"].tolist())
+    for col in int_columns:
+        if col in df.columns:
+            df[col] = df[col].fillna(0).astype(int)
+    return df.to_csv(None, index=False, header=False)
+
+
+def join_csv_fields(fields):
+    # Lines of a list of columns of field texts
+    return os.linesep.join(map(",".join, zip(*fields))) + os.linesep
+
+
+def int_text(value):
+    return "0" if value is None or value != value else str(int(value))
+
+
+_csv_special = re.compile(r'[,"\r\n]')
+
+
+def csv_text(value):
+    # A text field, quoted like csv.QUOTE_MINIMAL when it holds a separator, quote or line break
+    if _csv_special.search(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def text_fields(values):
+    # Fields of a text column (None and NaN as ""), None when it holds numbers whose column type pandas infers
+    try:
+        if not _csv_special.search("".join(values)):
+            return values  # Only strings, none to quote
+    except TypeError:
+        pass
+    texts = []
+    for value in values:
+        if type(value) is str:
+            texts.append(csv_text(value))
+        elif value is None or (type(value) is float and value != value):
+            texts.append("")
+        elif isinstance(value, (bytes, bytearray)):
+            texts.append(csv_text(str(value)))
+        else:
+            return None
+    return texts
+
+
+def encode_payloads(values):
+    """
+    Encode raw payloads (bytes or memoryviews, as produced by packet_processing) into the
+    base64 text of the CSV and Parquet outputs, "" for empty and missing payloads.
+    """
+    b64encode = base64.b64encode
+    return [b64encode(v).decode('ascii') if isinstance(v, (bytes, memoryview)) and v else "" for v in values]
+
+
+def ips_to_strings(values, mask=None):
+    """
+    Convert an array of uint32 IPv4 addresses into dotted strings (NaN where mask is set).
+    Every distinct address is formatted once.
+    """
+    uniques, inverse = np.unique(values, return_inverse=True)
+    names = np.array([int_to_ip(int(v)) for v in uniques], dtype=object)
+    result = names[inverse.reshape(-1)]
+    if mask is not None:
+        result[mask] = np.nan
+    return result
+
+
+def read_table(path, columns=None, filters=None):
+    """
+    Load a packet table written as CSV or Parquet into a DataFrame.
+
+    Only the requested columns are read. IP columns come back as dotted strings
+    so both formats can be used interchangeably by the analysis modules. A PCAP path
+    gives its metadata table, decoded block-wise without writing a CSV (see vector_decode).
+
+    Parameters:
+    - path: Path to a .csv, .parquet or .pcap file.
+    - columns: Optional list of columns to load.
+    - filters: Optional row filters of Parquet files, e.g. [("Time", ">=", start)]; ignored for CSV.
+    """
+    if is_pcap(path):
+        import vector_decode as vd  # Imported here, decoding pulls in Scapy
+        frames = list(vd.iter_metadata_frames(path, columns))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns or vd.METADATA_COLUMNS)
+    if not is_parquet(path):
+        return pd.read_csv(path, usecols=columns)
+
+    require_pyarrow()
+    return table_to_frame(pq.read_table(path, columns=columns, filters=filters))
+
+
+def iter_table(path, columns=None, chunksize=CHUNK_ROWS, dtype=None):
+    """
+    Read a packet table written as CSV or Parquet as a sequence of DataFrames of at most chunksize rows.
+
+    Parameters:
+    - path: Path to a .csv, .parquet or .pcap file.
+    - columns: Optional list of columns to load.
+    - chunksize: Rows per chunk (records per decoded block for PCAP input).
+    - dtype: Optional column types for CSV and PCAP input (Parquet columns are already typed).
+    """
+    if is_pcap(path):
+        import vector_decode as vd  # Imported here, decoding pulls in Scapy
+        for frame in vd.iter_metadata_frames(path, columns, chunksize):
+            yield frame if dtype is None else frame.astype(dtype)
+        return
+    if not is_parquet(path):
+        with pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=chunksize) as reader:
+            yield from reader
+        return
+
+    require_pyarrow()
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+        yield table_to_frame(pa.Table.from_batches([batch]))
+
+
+def table_to_frame(table):
+    # Arrow table to DataFrame with the IP columns as dotted strings
+    data = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if name in IP_COLUMNS:
+            data[name] = ips_to_strings(column.fill_null(0).to_numpy(), column.is_null().to_numpy())
+        else:
+            data[name] = column.to_pandas()
+    return pd.DataFrame(data, columns=table.column_names)
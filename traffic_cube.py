@@ -0,0 +1,523 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import dataset_cache as dc
+import metadata_index as mi
+import table_io as tio
+
+CUBE_SUFFIX = ".cube"
+CUBE_META = "cube.json"
+CUBE_VERSION = 1
+CUBE_RESOLUTIONS = (1, 60)  # Seconds per time bucket: per-second and per-minute tables
+CUBE_BATCH_ROWS = 1000000  # Packets aggregated at a time while a cube is built
+CUBE_COLUMNS = ["Time", "SourceIP", "DestinationIP", "SourcePort", "DestinationPort", "Length"]
+DIGEST_BYTES = 64 * 1024  # Bytes at the start and end of the covered table whose digests tell an appended table from a new one
+
+# View -> key columns. "host" and "port" count a packet for each of its two endpoints (once when they are equal)
+CUBE_VIEWS = {
+    "association": ("SourceIP", "DestinationIP", "SourcePort", "DestinationPort"),
+    "source": ("SourceIP", "DestinationPort"),
+    "destination": ("DestinationIP", "SourcePort"),
+    "host": ("IP",),
+    "port": ("Port",),
+}
+KEY_TYPES = {"SourceIP": "<u4", "DestinationIP": "<u4", "IP": "<u4", "SourcePort": "<u2", "DestinationPort": "<u2", "Port": "<u2"}
+IP_KEYS = ("SourceIP", "DestinationIP", "IP")
+ROW_TYPE = np.dtype([("Bucket", "<i8"), ("Packets", "<u8"), ("Bytes", "<u8")])
+
+
+def cube_path(table_path):
+    return table_path + CUBE_SUFFIX
+
+
+class CubeBuilder:
+    """
+    Aggregate packet rows into a traffic cube while they are written, and save it.
+
+    The cube holds, for every view of CUBE_VIEWS and every resolution, the packets and bytes of
+    each key (association, host and port...) per time bucket. Rows are collected in batches of
+    batch_rows packets; every batch is grouped into the buckets of the finest resolution, the
+    coarser resolutions are grouped from those, and the partial tables are merged as they grow,
+    so memory follows the number of (key, bucket) pairs rather than the number of packets.
+
+    Parameters:
+    - path: Cube directory, written by save.
+    - resolutions: Seconds per time bucket of each table.
+    - batch_rows: Packets aggregated at a time.
+    """
+
+    def __init__(self, path, resolutions=CUBE_RESOLUTIONS, batch_rows=CUBE_BATCH_ROWS):
+        self.path = path
+        self.resolutions = sorted(resolutions)
+        self.batch_rows = batch_rows
+        self.lists = {name: [] for name in CUBE_COLUMNS}  # Columns of the dict rows not aggregated yet
+        self.frames = []  # DataFrames (or dicts of column arrays) not aggregated yet
+        self.pending = 0
+        self.tables = {}  # (view, resolution) -> partial tables (dicts of column arrays), merged as they grow
+        self.packets = 0
+        self.start = None
+        self.end = None
+
+    def add_rows(self, rows):
+        for name, values in self.lists.items():
+            values.extend([row[name] for row in rows])
+        self.pending += len(rows)
+        if self.pending >= self.batch_rows:
+            self.aggregate()
+
+    def add_frame(self, frame):
+        self.frames.append(frame[CUBE_COLUMNS])
+        self.pending += len(frame)
+        if self.pending >= self.batch_rows:
+            self.aggregate()
+
+    def load(self, cube):
+        # Start from the tables of an existing TrafficCube, to add the rows appended to its table
+        for view in CUBE_VIEWS:
+            keys = cube.array(f"{view}.keys")
+            for resolution in self.resolutions:
+                rows = cube.array(f"{view}.{resolution}")
+                counts = np.diff(cube.array(f"{view}.{resolution}.starts"))
+                table = {column: np.repeat(keys[column].astype(np.int64), counts) for column in keys.dtype.names}
+                table.update((name, rows[name].astype(np.int64)) for name in ROW_TYPE.names)
+                self.tables[(view, resolution)] = [table]
+        self.packets = cube.meta["packets"]
+        self.start = cube.meta["start"]
+        self.end = cube.meta["end"]
+
+    def aggregate(self):
+        frames = self.frames
+        if self.lists["Time"]:
+            frames.append({name: np.array(values, dtype=object if name.endswith("IP") else np.int64)
+                           for name, values in self.lists.items()})
+        self.lists = {name: [] for name in CUBE_COLUMNS}
+        self.frames = []
+        self.pending = 0
+        frames = [frame for frame in frames if len(frame["Time"])]
+        if not frames:
+            return
+
+        time = np.concatenate([np.asarray(frame["Time"], dtype=np.int64) for frame in frames])
+        length = np.concatenate([np.asarray(frame["Length"], dtype=np.int64) for frame in frames])
+        self.packets += len(time)
+        self.start = int(time.min()) if self.start is None else min(self.start, int(time.min()))
+        self.end = int(time.max()) if self.end is None else max(self.end, int(time.max()))
+        endpoints = {
+            "SourceIP": np.concatenate([encode_ips(frame["SourceIP"]) for frame in frames]),
+            "DestinationIP": np.concatenate([encode_ips(frame["DestinationIP"]) for frame in frames]),
+            "SourcePort": np.concatenate([np.asarray(frame["SourcePort"], dtype=np.int64) for frame in frames]),
+            "DestinationPort": np.concatenate([np.asarray(frame["DestinationPort"], dtype=np.int64) for frame in frames]),
+        }
+
+        for view, columns in CUBE_VIEWS.items():
+            keys, times, lengths = view_rows(columns, endpoints, time, length)
+            base = None  # Table of the finest resolution
+            for resolution in self.resolutions:
+                if base is None or resolution % self.resolutions[0]:
+                    table = group(keys, times, np.ones(len(times), dtype=np.int64), lengths, resolution)
+                    base = table if base is None else base
+                else:
+                    # Coarser buckets are sums of the finer ones
+                    table = group({column: base[column] for column in columns}, base["Bucket"], base["Packets"], base["Bytes"], resolution)
+                parts = self.tables.setdefault((view, resolution), [])
+                parts.append(table)
+
+                # Merge the partial tables once they outgrow the table merged so far
+                if len(parts) > 1 and sum(len(part["Bucket"]) for part in parts[1:]) > len(parts[0]["Bucket"]):
+                    self.tables[(view, resolution)] = [merge_tables(parts, columns, resolution)]
+
+    def save(self, source=None, size=None):
+        """
+        Write the cube. source is the packet table it covers (its first size bytes, the whole
+        file when None), recorded so open_cube can tell an up to date cube from a stale one.
+        """
+        self.aggregate()
+        temporary = self.path + ".tmp"
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+
+        for view, columns in CUBE_VIEWS.items():
+            for resolution in self.resolutions:
+                table = merge_tables(self.tables.get((view, resolution), []), columns, resolution)
+                order = np.lexsort([table[name] for name in reversed(list(columns) + ["Bucket"])])
+                table = {name: values[order] for name, values in table.items()}
+
+                # Rows of a key are consecutive, starts[k]:starts[k + 1] are those of key k
+                changed = np.zeros(len(order), dtype=bool)
+                if len(order):
+                    changed[0] = True
+                    for column in columns:
+                        changed[1:] |= table[column][1:] != table[column][:-1]
+                first_rows = np.flatnonzero(changed)
+                starts = np.append(first_rows, len(order)).astype(np.int64)
+
+                if resolution == self.resolutions[0]:
+                    # Every resolution has the same keys, in the same order
+                    keys = np.empty(len(first_rows), dtype=[(column, KEY_TYPES[column]) for column in columns])
+                    for column in columns:
+                        keys[column] = table[column][first_rows]
+                    np.save(os.path.join(temporary, f"{view}.keys.npy"), keys)
+
+                rows = np.empty(len(order), dtype=ROW_TYPE)
+                for name in ROW_TYPE.names:
+                    rows[name] = table[name]
+                np.save(os.path.join(temporary, f"{view}.{resolution}.npy"), rows)
+                np.save(os.path.join(temporary, f"{view}.{resolution}.starts.npy"), starts)
+
+        meta = {
+            "version": CUBE_VERSION, "resolutions": self.resolutions,
+            "views": {view: list(columns) for view, columns in CUBE_VIEWS.items()},
+            "packets": self.packets, "start": self.start, "end": self.end,
+            "source": source_info(source, size) if isinstance(source, str) and os.path.isfile(source) else None,
+        }
+        with open(os.path.join(temporary, CUBE_META), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(temporary, self.path)
+        print(f"Traffic cube saved to {self.path} ({self.packets} packets)")
+
+
+def encode_ips(column):
+    # Dotted IPv4 strings to integers (-1 for missing values), every distinct address converted once
+    codes, uniques = pd.factorize(column)
+    lookup = np.empty(len(uniques) + 1, dtype=np.int64)
+    for i, ip in enumerate(uniques):
+        value = tio.ip_to_int(ip) if isinstance(ip, str) else None
+        lookup[i] = -1 if value is None else value
+    lookup[-1] = -1
+    return lookup[codes]
+
+
+def view_rows(columns, endpoints, time, length):
+    # Key columns, times and lengths of the packets counted in a view (rows with a missing IP are skipped)
+    if columns == ("IP",) or columns == ("Port",):
+        source, destination = ("SourceIP", "DestinationIP") if columns == ("IP",) else ("SourcePort", "DestinationPort")
+        src, dst = endpoints[source], endpoints[destination]
+        first = src >= 0
+        second = (dst >= 0) & (dst != src)
+        return ({columns[0]: np.concatenate([src[first], dst[second]])},
+                np.concatenate([time[first], time[second]]), np.concatenate([length[first], length[second]]))
+    valid = np.ones(len(time), dtype=bool)
+    for column in columns:
+        if column in IP_KEYS:
+            valid &= endpoints[column] >= 0
+    if valid.all():
+        return {column: endpoints[column] for column in columns}, time, length
+    return {column: endpoints[column][valid] for column in columns}, time[valid], length[valid]
+
+
+def group(keys, times, packets, lengths, resolution):
+    """
+    Sum packets and bytes per key and time bucket. The key columns are packed into one integer
+    (factorized whenever the next column would not fit), every (key, bucket) pair becomes
+    key code * buckets + bucket number, and the pairs are counted with a factorization and bincount.
+
+    Returns:
+    - A table: dict of the key columns, Bucket, Packets and Bytes arrays.
+    """
+    buckets = times // resolution * resolution
+    if not len(buckets):
+        table = {column: values[:0] for column, values in keys.items()}
+        table.update(Bucket=buckets, Packets=packets[:0], Bytes=lengths[:0])
+        return table
+    code = np.zeros(len(buckets), dtype=np.int64)
+    bound = 1  # Codes are below bound
+    for column, values in keys.items():
+        bits = 32 if column in IP_KEYS else 16
+        if bound >= 1 << (62 - bits):
+            code, uniques = pd.factorize(code)
+            bound = len(uniques)
+        code = (code << bits) | values
+        bound <<= bits
+    first = buckets.min()
+    width = (buckets.max() - first) // resolution + 1
+    if bound >= (1 << 62) // width:
+        code = pd.factorize(code)[0]
+    slots, uniques = pd.factorize(code * width + (buckets - first) // resolution)
+
+    # Row of the first occurrence of every pair (written in reverse, the first occurrence is written last)
+    rows = np.empty(len(uniques), dtype=np.int64)
+    rows[slots[::-1]] = np.arange(len(slots) - 1, -1, -1)
+    table = {column: values[rows] for column, values in keys.items()}
+    table["Bucket"] = buckets[rows]
+    table["Packets"] = np.bincount(slots, weights=packets, minlength=len(uniques)).astype(np.int64)
+    table["Bytes"] = np.bincount(slots, weights=lengths, minlength=len(uniques)).astype(np.int64)
+    return table
+
+
+def merge_tables(tables, columns, resolution):
+    if not tables:
+        return {name: np.array([], dtype=np.int64) for name in list(columns) + list(ROW_TYPE.names)}
+    if len(tables) == 1:
+        return tables[0]
+    merged = {name: np.concatenate([table[name] for table in tables]) for name in list(columns) + list(ROW_TYPE.names)}
+    return group({column: merged[column] for column in columns}, merged["Bucket"], merged["Packets"], merged["Bytes"], resolution)
+
+
+def source_info(path, size=None):
+    # Covered size and digests of the first and last bytes of the covered part of a table
+    size = os.path.getsize(path) if size is None else size
+    head = min(size, DIGEST_BYTES)
+    with open(path, "rb") as f:
+        head_digest = hashlib.sha1(f.read(head)).hexdigest()
+        f.seek(size - min(size, DIGEST_BYTES))
+        tail_digest = hashlib.sha1(f.read(min(size, DIGEST_BYTES))).hexdigest()
+    return {"size": size, "head": head_digest, "tail": tail_digest}
+
+
+def is_csv(path):
+    return not tio.is_parquet(path) and not tio.is_pcap(path)
+
+
+def complete_size(csv_path):
+    # Size of a CSV up to the end of its last complete line (a row still being written is left out)
+    size = os.path.getsize(csv_path)
+    with open(csv_path, "rb") as f:
+        while size > 0:
+            start = max(size - DIGEST_BYTES, 0)
+            f.seek(start)
+            last = f.read(size - start).rfind(b"\n")
+            if last >= 0:
+                return start + last + 1
+            size = start
+    return 0
+
+
+def header_size(csv_path):
+    with open(csv_path, "rb") as f:
+        return len(f.readline())
+
+
+def build_cube(source, path=None, resolutions=CUBE_RESOLUTIONS, chunksize=CUBE_BATCH_ROWS):
+    """
+    Build the traffic cube of a packet table in one chunked pass, for tables converted without
+    it. Memory follows the size of the cube, not of the table.
+
+    Parameters:
+    - source: Path of a metadata .csv, .parquet or .pcap file.
+    - path: Cube directory (defaults to the sidecar path, see cube_path).
+    - resolutions: Seconds per time bucket of each table.
+    - chunksize: Rows read and aggregated at a time.
+
+    Returns:
+    - The path of the cube.
+    """
+    path = path or cube_path(source)
+    builder = CubeBuilder(path, resolutions, chunksize)
+    if is_csv(source):
+        # Up to the last complete row, a CSV still being appended to is extended later (see open_cube)
+        size = complete_size(source)
+        for _, rows in mi.read_rows(source, header_size(source), size, CUBE_COLUMNS, chunksize):
+            builder.add_frame(rows)
+        builder.save(source, size)
+    else:
+        for chunk in dc.iter_table(source, columns=CUBE_COLUMNS, chunksize=chunksize):
+            builder.add_frame(chunk)
+        builder.save(source)
+    return path
+
+
+def extend_cube(cube, source, chunksize=CUBE_BATCH_ROWS):
+    # Add the rows appended to a CSV since its cube was saved
+    builder = CubeBuilder(cube.path, cube.resolutions, chunksize)
+    builder.load(cube)
+    size = complete_size(source)
+    for _, rows in mi.read_rows(source, cube.meta["source"]["size"], size, CUBE_COLUMNS, chunksize):
+        builder.add_frame(rows)
+    builder.save(source, size)
+
+
+def cube_state(meta, source):
+    # "current", "appended" (a CSV with rows after those covered) or "stale"
+    info = meta.get("source") if meta is not None and meta.get("version") == CUBE_VERSION else None
+    if info is None or not os.path.isfile(source):
+        return "stale"
+    size = os.path.getsize(source)
+    if size < info["size"] or source_info(source, info["size"]) != info:
+        return "stale"
+    if size == info["size"] or not is_csv(source) or complete_size(source) == info["size"]:
+        return "current"
+    return "appended"
+
+
+def open_cube(source):
+    """
+    Open the traffic cube of a packet table, building it first when it is missing or does not
+    match the table, and adding the new rows when the table is a CSV that was appended to (e.g.
+    by follow mode) since the cube was saved.
+
+    Parameters:
+    - source: Path of a metadata .csv, .parquet or .pcap file.
+
+    Returns:
+    - A TrafficCube.
+    """
+    path = cube_path(source)
+    meta_path = os.path.join(path, CUBE_META)
+    meta = None
+    if os.path.isfile(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    state = cube_state(meta, source)
+    if state == "stale":
+        print(f"Building the traffic cube of {source}")
+        build_cube(source, path)
+    elif state == "appended":
+        print(f"Adding the new rows of {source} to its traffic cube")
+        extend_cube(TrafficCube(path), source)
+    return TrafficCube(path)
+
+
+class TrafficCube:
+    """
+    Read side of a traffic cube: packets and bytes per time bucket of the keys of each view.
+
+    The tables are memory-mapped; the rows of a key are consecutive and ordered by bucket, so a
+    window of a key is found by binary search and reading a series never scans the packets.
+
+    Parameters:
+    - path: Cube directory written by CubeBuilder.save.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, CUBE_META)) as f:
+            self.meta = json.load(f)
+        self.resolutions = self.meta["resolutions"]
+        self.arrays = {}
+
+    def array(self, name):
+        if name not in self.arrays:
+            file = os.path.join(self.path, name + ".npy")
+            try:
+                self.arrays[name] = np.load(file, mmap_mode="r")
+            except ValueError:
+                self.arrays[name] = np.load(file)  # Empty arrays cannot be mapped
+        return self.arrays[name]
+
+    def keys(self, view):
+        """
+        Return the keys of a view as a DataFrame (IPs as dotted strings), row k is key id k.
+        """
+        keys = self.array(f"{view}.keys")
+        return pd.DataFrame({
+            column: tio.ips_to_strings(keys[column]) if column in IP_KEYS else np.asarray(keys[column])
+            for column in keys.dtype.names
+        })
+
+    def select(self, view, **values):
+        """
+        Return the ids of the keys of a view matching every given column, e.g.
+        select("source", SourceIP=["192.168.0.2", "192.168.0.13"], DestinationPort=9339).
+        A value is a single value or a list of accepted values.
+        """
+        keys = self.array(f"{view}.keys")
+        mask = np.ones(len(keys), dtype=bool)
+        for column, value in values.items():
+            if column not in keys.dtype.names:
+                raise ValueError(f"View {view} has no column {column}")
+            accepted = list(value) if isinstance(value, (list, tuple, set, np.ndarray, pd.Series)) else [value]
+            if column in IP_KEYS:
+                accepted = [tio.ip_to_int(ip) if isinstance(ip, str) else None for ip in accepted]
+                accepted = [ip for ip in accepted if ip is not None]
+            mask &= np.isin(keys[column], np.array(accepted, dtype=np.int64))
+        return np.flatnonzero(mask)
+
+    def series(self, view, key_ids, start_time=None, end_time=None, resolution=60, value="Bytes"):
+        """
+        Return the packets or bytes of a set of keys per time bucket, summed over the keys.
+
+        Matches resample(f"{resolution}s").sum() on the packets with start_time <= Time <= end_time:
+        buckets from the first to the last one with packets, empty buckets in between being 0.
+        Buckets cut by the window are completed from the finest table, so the counts are exact
+        when it has a resolution of a second.
+
+        Parameters:
+        - view: View of the keys (see CUBE_VIEWS).
+        - key_ids: Key ids, see select.
+        - start_time: Start of the time window (epoch seconds, None for no bound).
+        - end_time: End of the time window (epoch seconds, inclusive, None for no bound).
+        - resolution: Seconds per bucket, one of the resolutions of the cube.
+        - value: "Bytes" or "Packets".
+
+        Returns:
+        - A Series of the values indexed by the bucket start times (UTC).
+        """
+        if resolution not in self.resolutions:
+            raise ValueError(f"No table with a resolution of {resolution}s, the cube has {self.resolutions}")
+        low = None if start_time is None else math.ceil(start_time)
+        high = None if end_time is None else math.floor(end_time)
+        finest = self.resolutions[0]
+
+        if finest == resolution or resolution % finest:
+            parts = [self.gather(view, key_ids, resolution, low, high, value)]
+        else:
+            # Whole buckets from the table, the parts of the buckets cut by the window from the finest one
+            first_full = None if low is None else -(-low // resolution) * resolution
+            end_full = None if high is None else (high + 1) // resolution * resolution
+            parts = []
+            if first_full is None or end_full is None or first_full < end_full:
+                parts.append(self.gather(view, key_ids, resolution, first_full, None if end_full is None else end_full - 1, value))
+            if low is not None:
+                parts.append(self.gather(view, key_ids, finest, low, first_full - 1 if high is None else min(first_full - 1, high), value))
+            if high is not None:
+                parts.append(self.gather(view, key_ids, finest, end_full if low is None else max(end_full, first_full), high, value))
+
+        buckets = np.concatenate([part[0] for part in parts]) // resolution * resolution
+        values = np.concatenate([part[1] for part in parts])
+        if not len(buckets):
+            return pd.Series([], index=pd.DatetimeIndex([], dtype="datetime64[ns]"), dtype=np.int64, name=value)
+        first = buckets.min()
+        dense = np.zeros((buckets.max() - first) // resolution + 1, dtype=np.int64)
+        np.add.at(dense, (buckets - first) // resolution, values)
+        index = pd.to_datetime(first + resolution * np.arange(len(dense)), unit="s")
+        return pd.Series(dense, index=index, name=value)
+
+    def frame(self, view, column, values, start_time=None, end_time=None, resolution=60, value="Bytes", **conditions):
+        """
+        Return one series (see series) per value of a key column as the columns of a DataFrame,
+        e.g. the bytes of several hosts to a port. Values without packets in the window have no
+        column; buckets outside the range of a column are NaN.
+
+        Parameters:
+        - column: Key column of the view whose values give the columns.
+        - values: Values of the column.
+        - conditions: Further columns the keys must match (see select).
+        """
+        columns = {}
+        for item in values:
+            ids = self.select(view, **{column: item}, **conditions)
+            series = self.series(view, ids, start_time, end_time, resolution, value)
+            if len(series):
+                columns[item] = series
+        return pd.DataFrame(columns)
+
+    def gather(self, view, key_ids, resolution, low, high, value):
+        # Buckets and values of the keys in a table, for the buckets overlapping [low, high]
+        if low is not None and high is not None and low > high:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        rows = self.array(f"{view}.{resolution}")
+        starts = self.array(f"{view}.{resolution}.starts")
+        buckets = []
+        values = []
+        for key in key_ids:
+            first, last = int(starts[key]), int(starts[key + 1])
+            key_buckets = rows["Bucket"][first:last]
+            begin = first if low is None else first + int(np.searchsorted(key_buckets, low - resolution + 1))
+            end = last if high is None else first + int(np.searchsorted(key_buckets, high, side="right"))
+            buckets.append(np.asarray(rows["Bucket"][begin:end], dtype=np.int64))
+            values.append(np.asarray(rows[value][begin:end], dtype=np.int64))
+        if not buckets:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(buckets), np.concatenate(values)
+
+
+if __name__ == "__main__":
+    # Example usage
+    input_csv = "test.csv"  # Replace with your metadata CSV file path
+    cube = open_cube(input_csv)
+    print(cube.keys("association").head())
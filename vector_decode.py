@@ -0,0 +1,303 @@
+import itertools
+from array import array
+import numpy as np
+import pandas as pd
+import packet_processing as pp
+import raw_pcap as rp
+import table_io as tio
+
+BLOCK_RECORDS = 65536  # Records decoded per block
+MAX_VLAN_TAGS = 4  # Deeper VLAN stacks are decoded per packet
+
+# Decoded header fields of one record; ok is False for records that need per-packet decoding
+HEADER_DTYPE = np.dtype([
+    ("time", "f8"), ("sec", "u4"), ("src", "u4"), ("dst", "u4"), ("sport", "u2"), ("dport", "u2"),
+    ("seq", "u4"), ("ack", "u4"), ("proto", "u1"), ("len", "u2"), ("ok", "?"),
+])
+
+METADATA_COLUMNS = ["Time", "No", "SourceIP", "DestinationIP", "SourcePort", "DestinationPort",
+                    "SequenceNumber", "AcknowledgementNumber", "Protocol", "Length"]
+
+PROTOCOL_NAMES = np.array([pp.get_protocol_name(proto) for proto in range(256)], dtype=object)
+_TCP_BOUND_PORTS = np.array(sorted(rp.TCP_BOUND_PORTS), dtype=np.int64)
+_UDP_BOUND_PORTS = np.array(sorted(rp.UDP_BOUND_PORTS), dtype=np.int64)
+
+
+class RecordBlock:
+    """
+    A block of consecutive capture records as arrays: the record data lives in buf (the mapped
+    file itself for MmapPcapReader on libpcap, a copy otherwise) at start[i]:start[i] + caplen[i].
+    """
+    __slots__ = ("buf", "start", "caplen", "wirelen", "sec", "frac", "tsresol", "linktype", "offset")
+
+    def __init__(self, buf, start, caplen, wirelen, sec, frac, tsresol, linktype, offset):
+        self.buf = buf
+        self.start = start
+        self.caplen = caplen
+        self.wirelen = wirelen
+        self.sec = sec
+        self.frac = frac
+        self.tsresol = tsresol
+        self.linktype = linktype
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.start)
+
+    def times(self):
+        return self.sec + self.frac * self.tsresol
+
+    def packet(self, i):
+        # One record as a RawPacket, for the per-packet decoders
+        start = int(self.start[i])
+        sec, frac = int(self.sec[i]), int(self.frac[i])
+        return rp.RawPacket(sec, frac, sec + frac * self.tsresol, int(self.caplen[i]), int(self.wirelen[i]),
+                            bytes(self.buf[start:start + int(self.caplen[i])]), int(self.linktype[i]), int(self.offset[i]))
+
+    def select(self, key):
+        # Records selected by a slice, index array or boolean mask, sharing the buffer
+        return RecordBlock(self.buf, self.start[key], self.caplen[key], self.wirelen[key], self.sec[key],
+                           self.frac[key], self.tsresol, self.linktype[key], self.offset[key])
+
+
+def iter_blocks(reader, block_records=BLOCK_RECORDS):
+    """
+    Read a capture as RecordBlocks of at most block_records records, from the reader's current position.
+
+    libpcap files opened with MmapPcapReader are walked header by header on the mapping and
+    their blocks point into it without copying; other readers are iterated and their
+    records copied into one buffer per block.
+    """
+    if isinstance(reader, rp.MmapPcapReader) and not reader.pcapng:
+        yield from _iter_mapped_blocks(reader, block_records)
+        return
+
+    records = iter(reader)
+    while True:
+        chunk = list(itertools.islice(records, block_records))
+        if not chunk:
+            return
+        caplen = np.array([p.caplen for p in chunk], dtype=np.int64)
+        start = np.zeros(len(chunk), dtype=np.int64)
+        np.cumsum(caplen[:-1], out=start[1:])
+        yield RecordBlock(
+            np.frombuffer(b"".join(bytes(p.data) for p in chunk), dtype=np.uint8), start, caplen,
+            np.array([p.wirelen for p in chunk], dtype=np.int64),
+            np.array([p.sec for p in chunk], dtype=np.int64), np.array([p.frac for p in chunk], dtype=np.int64),
+            reader.tsresol, np.array([p.linktype for p in chunk], dtype=np.int64),
+            np.array([p.offset for p in chunk], dtype=np.int64),
+        )
+
+
+def _iter_mapped_blocks(reader, block_records):
+    mm = reader.mm
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    size = len(mm)
+    unpack_from = reader.record_header.unpack_from
+    header_len = rp.RECORD_HEADER_LEN
+    pos = reader.f.tell()
+    while True:
+        offset, sec, frac, caplen, wirelen = array("q"), array("q"), array("q"), array("q"), array("q")
+        while len(offset) < block_records and pos + header_len <= size:
+            s, f, cl, wl = unpack_from(mm, pos)
+            if pos + header_len + cl > size:
+                pos = size  # truncated last record
+                break
+            offset.append(pos)
+            sec.append(s)
+            frac.append(f)
+            caplen.append(cl)
+            wirelen.append(wl)
+            pos += header_len + cl
+        reader.f.seek(pos)
+        if not offset:
+            return
+        offset = np.frombuffer(offset, dtype=np.int64)
+        yield RecordBlock(buf, offset + header_len, np.frombuffer(caplen, dtype=np.int64),
+                          np.frombuffer(wirelen, dtype=np.int64), np.frombuffer(sec, dtype=np.int64),
+                          np.frombuffer(frac, dtype=np.int64), reader.tsresol,
+                          np.full(len(offset), reader.linktype, dtype=np.int64), offset)
+
+
+def decode_block(block):
+    """
+    Decode the IPv4 and TCP/UDP headers of every record of a block at once.
+
+    The checks are the ones of raw_pcap.decode_transport, applied to whole arrays: records
+    it would hand to Scapy get ok set to False and must be decoded per packet.
+
+    Returns:
+    - headers: Structured array of HEADER_DTYPE, one entry per record.
+    - load_start, load_end: Position of the transport payload of every record in block.buf.
+    """
+    buf = block.buf
+    ds = block.start
+    cl = block.caplen
+    linktype = block.linktype
+    last = len(buf) - 1
+
+    def u8(pos):
+        return buf[np.minimum(ds + pos, last)].astype(np.int64)
+
+    def u16(pos):
+        return (u8(pos) << 8) | u8(pos + 1)
+
+    def u32(pos):
+        return (u16(pos) << 16) | u16(pos + 2)
+
+    n = len(block)
+    ok = np.ones(n, dtype=bool)
+    ip = np.zeros(n, dtype=np.int64)
+
+    # Link layer, as raw_pcap.ipv4_offset
+    eth = linktype == rp.LINKTYPE_ETHERNET
+    if eth.any():
+        ok &= ~eth | (cl >= 14)
+        type_pos = np.full(n, 12, dtype=np.int64)
+        eth_type = u16(type_pos)
+        for _ in range(MAX_VLAN_TAGS):
+            vlan = eth & (eth_type == rp.ETH_TYPE_VLAN)
+            if not vlan.any():
+                break
+            type_pos = np.where(vlan, type_pos + 4, type_pos)
+            ok &= ~vlan | (cl >= type_pos + 2)
+            eth_type = np.where(vlan, u16(type_pos), eth_type)
+        ok &= ~eth | (eth_type == rp.ETH_TYPE_IPV4)
+        ip = np.where(eth, type_pos + 2, ip)
+    sll = linktype == rp.LINKTYPE_LINUX_SLL
+    if sll.any():
+        ok &= ~sll | ((cl >= 16) & (u16(14) == rp.ETH_TYPE_IPV4))
+        ip = np.where(sll, 16, ip)
+    raw = np.isin(linktype, (rp.LINKTYPE_RAW, rp.LINKTYPE_RAW_OLD, rp.LINKTYPE_IPV4))
+    ok &= eth | sll | raw
+
+    # IPv4 header
+    ok &= cl >= ip + 20
+    ver_ihl = u8(ip)
+    ihl = (ver_ihl & 0x0F) << 2
+    ip_len = u16(ip + 2)
+    ok &= (ver_ihl >> 4 == 4) & (ihl >= 20) & (cl >= ip + ihl) & (ip_len >= ihl)
+    ok &= (u16(ip + 6) & 0x3FFF) == 0  # fragments
+    proto = u8(ip + 9)
+    tcp = proto == 6
+    udp = proto == 17
+    ok &= tcp | udp
+
+    # TCP/UDP header
+    l4 = ip + ihl
+    end = np.minimum(ip + ip_len, cl)
+    sport = u16(l4)
+    dport = u16(l4 + 2)
+    tcp_hdr = (u8(l4 + 12) >> 4) << 2
+    udp_len = u16(l4 + 4)
+    ok &= ~tcp | ((end - l4 >= 20) & (tcp_hdr >= 20) & (l4 + tcp_hdr <= end))
+    ok &= ~udp | ((end - l4 >= 8) & (udp_len >= 8))
+
+    load_start = np.where(tcp, l4 + tcp_hdr, l4 + 8)
+    load_end = np.maximum(np.where(tcp, end, np.minimum(end, l4 + udp_len)), load_start)
+    bound = np.where(tcp, np.isin(sport, _TCP_BOUND_PORTS) | np.isin(dport, _TCP_BOUND_PORTS),
+                     np.isin(sport, _UDP_BOUND_PORTS) | np.isin(dport, _UDP_BOUND_PORTS))
+    ok &= ~((load_end > load_start) & bound)  # payloads Scapy dissects further
+
+    headers = np.zeros(n, dtype=HEADER_DTYPE)
+    headers["time"] = block.times()
+    headers["sec"] = block.sec
+    headers["src"] = u32(ip + 12)
+    headers["dst"] = u32(ip + 16)
+    headers["sport"] = sport
+    headers["dport"] = dport
+    headers["seq"] = np.where(tcp, u32(l4 + 4), 0)
+    headers["ack"] = np.where(tcp, u32(l4 + 8), 0)
+    headers["proto"] = proto
+    headers["len"] = ip_len
+    headers["ok"] = ok
+    return headers, ds + load_start, ds + load_end
+
+
+def convert_block(block, pckt_no=0, payload=True):
+    """
+    Turn a RecordBlock into metadata and payload tables laid out like the CSV outputs.
+
+    Records decode_block could not handle go through packet_processing.process_raw_metadata_payload;
+    records without TCP/UDP metadata are skipped and do not consume a packet number, as in
+    data_model.write_metadata_payload.
+
+    Parameters:
+    - block: RecordBlock to convert.
+    - pckt_no: Number of the last packet already written.
+    - payload: Also build the payload table.
+
+    Returns:
+    - (metadata, payload, times): DataFrames with METADATA_COLUMNS and table_io.PAYLOAD_KEYS (payload is
+      None when not requested, Load holds the raw payload bytes) and the precise timestamp of every row.
+    """
+    headers, load_start, load_end = decode_block(block)
+    ok = headers["ok"]
+
+    fallback = {}
+    has_metadata = ok.copy()
+    for i in np.flatnonzero(~ok):
+        pckt_metadata, pckt_payload = pp.process_raw_metadata_payload(block.packet(i), 0)
+        if pckt_metadata:
+            fallback[i] = (pckt_metadata, pckt_payload)
+            has_metadata[i] = True
+
+    rows = np.flatnonzero(has_metadata)
+    selected = headers[rows]
+    numbers = np.arange(pckt_no + 1, pckt_no + 1 + len(rows), dtype=np.int64)
+    metadata = {
+        "Time": selected["sec"].astype(np.int64),
+        "No": numbers,
+        "SourceIP": tio.ips_to_strings(selected["src"]),
+        "DestinationIP": tio.ips_to_strings(selected["dst"]),
+        "SourcePort": selected["sport"].astype(np.int64),
+        "DestinationPort": selected["dport"].astype(np.int64),
+        "SequenceNumber": selected["seq"].astype(np.int64),
+        "AcknowledgementNumber": selected["ack"].astype(np.int64),
+        "Protocol": PROTOCOL_NAMES[selected["proto"]],
+        "Length": selected["len"].astype(np.int64),
+    }
+    payloads = None
+    if payload:
+        view = memoryview(block.buf)
+        # Filled element-wise, np.array would turn payloads of equal sizes into a 2-D array
+        loads = np.empty(len(rows), dtype=object)
+        loads[:] = [
+            view[start:end] if end > start else b""
+            for start, end in zip(load_start[rows].tolist(), load_end[rows].tolist())
+        ]
+        payloads = {"No": numbers, "Length": metadata["Length"].copy(), "Load": loads}
+
+    # Rows decoded per packet keep the values of the per-packet decoder
+    for j in np.flatnonzero(~ok[rows]):
+        pckt_metadata, pckt_payload = fallback[rows[j]]
+        for column in METADATA_COLUMNS[:1] + METADATA_COLUMNS[2:]:
+            metadata[column][j] = pckt_metadata[column]
+        if payload:
+            payloads["Length"][j] = pckt_payload["Length"]
+            payloads["Load"][j] = pckt_payload["Load"]
+
+    return (pd.DataFrame(metadata, columns=METADATA_COLUMNS),
+            pd.DataFrame(payloads, columns=tio.PAYLOAD_KEYS) if payload else None,
+            block.times()[rows])
+
+
+def iter_metadata_frames(_pcap, columns=None, block_records=BLOCK_RECORDS):
+    """
+    Decode a PCAP into metadata DataFrames, one per block, with the values pd.read_csv gives
+    for the metadata CSV (missing IPs and protocols as NaN).
+
+    Parameters:
+    - _pcap: PCAP or pcapng file path.
+    - columns: Optional list of metadata columns to keep.
+    - block_records: Records decoded per block.
+    """
+    pckt_no = 0
+    with rp.MmapPcapReader(_pcap) as reader:
+        for block in iter_blocks(reader, block_records):
+            metadata, _, _ = convert_block(block, pckt_no, payload=False)
+            pckt_no += len(metadata)
+            for column in ("SourceIP", "DestinationIP", "Protocol"):
+                metadata[column] = metadata[column].replace("", np.nan)
+            yield metadata if columns is None else metadata[list(columns)]
+            del metadata, block